@@ -0,0 +1,93 @@
+"""
+Compare the time and memory needed to decode Fetch API responses using the previous
+approach (decode the envelope to text, parse it, try base64 on every body) and the
+current one (parse the raw bytes, dispatch on "body_encoding").
+
+Usage: python benchmarks/bench_decode.py
+"""
+import base64
+import binascii
+import json
+import os
+import sys
+import timeit
+import tracemalloc
+
+from scrapy.http.response.text import TextResponse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from crawlera_fetch.jsoncodec import JsonCodec  # noqa: E402
+from crawlera_fetch.middleware import _decode_body  # noqa: E402
+
+
+SIZES = [1024, 100 * 1024, 1024 * 1024, 10 * 1024 * 1024]
+
+
+def legacy_decode(response: TextResponse) -> bytes:
+    json_response = json.loads(response.text)
+    try:
+        body = base64.b64decode(json_response["body"], validate=True)
+    except (binascii.Error, ValueError):
+        body = json_response["body"].encode(response.encoding)
+    return body
+
+
+def current_decode(response: TextResponse) -> bytes:
+    return _decode_body(JsonCodec().loads(response.body))
+
+
+def build_response(size: int, body_encoding: str) -> TextResponse:
+    page = (b"<p>crawlera fetch</p>\n" * (size // 22 + 1))[:size]
+    if body_encoding == "base64":
+        body = base64.b64encode(page).decode("ascii")
+    else:
+        body = page.decode("ascii")
+    envelope = {
+        "url": "https://example.org",
+        "original_status": 200,
+        "headers": {"Content-Type": "text/html"},
+        "body_encoding": body_encoding,
+        "body": body,
+    }
+    return TextResponse(
+        url="http://fetch.crawlera.com:8010/fetch/v2/",
+        body=json.dumps(envelope).encode("utf8"),
+        encoding="utf8",
+    )
+
+
+def measure(func, size: int, body_encoding: str):
+    number = max(1, 50 * 1024 * 1024 // (size * 10))
+    # fresh responses for every call, TextResponse caches the decoded text
+    responses = [build_response(size, body_encoding) for _ in range(number)]
+    elapsed = timeit.timeit(lambda: func(responses.pop()), number=number)
+    response = build_response(size, body_encoding)
+    tracemalloc.start()
+    func(response)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed / number, peak
+
+
+def main() -> None:
+    header = "{:>9} {:>7} {:>12} {:>12} {:>12} {:>12}"
+    print(header.format("size", "enc", "legacy ms", "current ms", "legacy peak", "current peak"))
+    for body_encoding in ("plain", "base64"):
+        for size in SIZES:
+            legacy_time, legacy_peak = measure(legacy_decode, size, body_encoding)
+            current_time, current_peak = measure(current_decode, size, body_encoding)
+            print(
+                "{:>9} {:>7} {:>12.3f} {:>12.3f} {:>12} {:>12}".format(
+                    size,
+                    body_encoding,
+                    legacy_time * 1000,
+                    current_time * 1000,
+                    legacy_peak,
+                    current_peak,
+                )
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""
+Measure the overhead of CrawleraFetchLogFormatter per crawled page, comparing the
+current implementation (original request read from the request meta) with the
+previous one (outgoing request body decoded for every log message).
+
+Usage: python benchmarks/bench_logformatter.py
+"""
+import json
+import os
+import sys
+import time
+from contextlib import suppress
+
+from scrapy import Request, Spider
+from scrapy.http.response import Response
+from scrapy.logformatter import LogFormatter
+from scrapy.utils.test import get_crawler
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from crawlera_fetch import (  # noqa: E402
+    CrawleraFetchLogFormatter,
+    CrawleraFetchMiddleware,
+    DownloadSlotPolicy,
+)
+
+
+SETTINGS = {
+    "CRAWLERA_FETCH_ENABLED": True,
+    "CRAWLERA_FETCH_APIKEY": "secret-key",
+    "CRAWLERA_FETCH_DOWNLOAD_SLOT_POLICY": DownloadSlotPolicy.Single,
+}
+
+
+class LegacyCrawleraFetchLogFormatter(CrawleraFetchLogFormatter):
+    """crawled as implemented before reading the original request from the meta"""
+
+    def crawled(self, request, response, spider):
+        result = LogFormatter.crawled(self, request, response, spider)
+        with suppress(ValueError):
+            payload = json.loads(request.body)
+            result["args"]["request"] = "<%s %s>" % (payload.get("method", "GET"), payload["url"])
+        return result
+
+
+def get_processed_requests(count):
+    spider_cls = type("FooSpider", (Spider,), {"name": "foo"})
+    spider = spider_cls()
+    spider.crawler = get_crawler(spider_cls, settings_dict=SETTINGS)
+    middleware = CrawleraFetchMiddleware.from_crawler(spider.crawler)
+    middleware.spider_opened(spider)
+    body = json.dumps({"query": "x" * 10000})
+    requests = [
+        Request("https://example.org/{}".format(i), method="POST", body=body) for i in range(count)
+    ]
+    return [middleware.process_request(request, spider) for request in requests], spider
+
+
+def run(logformatter, requests, spider):
+    responses = [Response(request.url, request=request) for request in requests]
+    start = time.perf_counter()
+    for request, response in zip(requests, responses):
+        logformatter.crawled(request, response, spider)
+    return (time.perf_counter() - start) / len(requests) * 1e6
+
+
+def main():
+    count = 20000
+    requests, spider = get_processed_requests(count)
+    for name, logformatter_cls in (
+        ("legacy", LegacyCrawleraFetchLogFormatter),
+        ("meta", CrawleraFetchLogFormatter),
+    ):
+        elapsed = run(logformatter_cls(), requests, spider)
+        print("{:<32} {:>10.2f} us/page".format(name, elapsed))
+
+
+if __name__ == "__main__":
+    main()
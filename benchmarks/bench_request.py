@@ -0,0 +1,111 @@
+"""
+Measure the number of requests per second processed by
+CrawleraFetchMiddleware.process_request, comparing the current implementation
+(per-spider request template) with the previous one (payload and headers built
+from scratch for each request).
+
+Usage: python benchmarks/bench_request.py
+"""
+import json
+import os
+import sys
+import time
+
+from scrapy import Request, Spider
+from scrapy.utils.reqser import request_to_dict
+from scrapy.utils.test import get_crawler
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from crawlera_fetch.middleware import (  # noqa: E402
+    META_KEY,
+    CrawleraFetchMiddleware,
+    DownloadSlotPolicy,
+)
+
+
+SETTINGS = {
+    "CRAWLERA_FETCH_ENABLED": True,
+    "CRAWLERA_FETCH_APIKEY": "secret-key",
+    "CRAWLERA_FETCH_DOWNLOAD_SLOT_POLICY": DownloadSlotPolicy.Single,
+    "CRAWLERA_FETCH_DEFAULT_ARGS": {"device": "desktop", "region": "us", "render": "no"},
+}
+
+
+class LegacyCrawleraFetchMiddleware(CrawleraFetchMiddleware):
+    """process_request as implemented before the introduction of request templates"""
+
+    def process_request(self, request, spider):
+        crawlera_meta = request.meta.get(META_KEY, {})
+        if crawlera_meta.get("skip") or crawlera_meta.get("original_request"):
+            return None
+        self._set_download_slot(request, spider)
+        self.stats.inc_value("crawlera_fetch/request_count")
+        self.stats.inc_value("crawlera_fetch/request_method_count/{}".format(request.method))
+        shub_jobkey = os.environ.get("SHUB_JOBKEY")
+        if shub_jobkey:
+            self.default_args["job_id"] = shub_jobkey
+        body = {"url": request.url, "body": request.body.decode(request.encoding)}
+        if request.method != "GET":
+            body["method"] = request.method
+        body.update(self.default_args)
+        body.update(crawlera_meta.get("args") or {})
+        body_json = json.dumps(body)
+        crawlera_meta.update(
+            {
+                "original_request": request_to_dict(request, spider=spider),
+                "timing": {"start_ts": time.time()},
+            }
+        )
+        request.headers.update(
+            {
+                "Content-Type": "application/json",
+                "Accept": "application/json",
+                "Authorization": self.auth_header,
+            }
+        )
+        if shub_jobkey:
+            request.headers["X-Crawlera-JobId"] = shub_jobkey
+        request.meta[META_KEY] = crawlera_meta
+        return request.replace(url=self.url, method="POST", body=body_json)
+
+
+def get_middleware(middleware_cls, settings):
+    spider_cls = type("FooSpider", (Spider,), {"name": "foo"})
+    spider = spider_cls()
+    spider.crawler = get_crawler(spider_cls, settings_dict=settings)
+    middleware = middleware_cls.from_crawler(spider.crawler)
+    middleware.spider_opened(spider)
+    return middleware, spider
+
+
+def run(middleware_cls, settings, count):
+    middleware, spider = get_middleware(middleware_cls, settings)
+    requests = [
+        Request(
+            "https://example.org/{}".format(i),
+            meta={"crawlera_fetch": {"args": {"region": "de"} if i % 10 == 0 else {}}},
+        )
+        for i in range(count)
+    ]
+    start = time.perf_counter()
+    for request in requests:
+        middleware.process_request(request, spider)
+    return count / (time.perf_counter() - start)
+
+
+def main():
+    os.environ.setdefault("SHUB_JOBKEY", "1/2/3")
+    count = 20000
+    lazy = dict(SETTINGS, CRAWLERA_FETCH_LAZY_ORIGINAL_REQUEST=True)
+    cases = [
+        ("legacy", LegacyCrawleraFetchMiddleware, SETTINGS),
+        ("template", CrawleraFetchMiddleware, SETTINGS),
+        ("template, lazy original request", CrawleraFetchMiddleware, lazy),
+    ]
+    for name, middleware_cls, settings in cases:
+        print("{:<32} {:>10.0f} requests/s".format(name, run(middleware_cls, settings, count)))
+
+
+if __name__ == "__main__":
+    main()
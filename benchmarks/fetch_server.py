@@ -0,0 +1,194 @@
+"""
+Local stand-in for the Crawlera Fetch API (/fetch/v2/), to run crawls through the
+middleware without sending requests to the real service.
+
+It accepts the JSON payloads built by CrawleraFetchMiddleware.process_request and,
+after a random delay, returns the same kind of envelopes as the real API: either a
+successful response (original_status, headers, body_encoding and body), an error
+reported with the "crawlera_error" field, or an error reported with the
+X-Crawlera-Error header.
+
+Latencies and body sizes are drawn from configurable distributions, given as
+"<name>:<parameters>":
+    constant:<value>
+    uniform:<low>,<high>
+    exponential:<mean>
+    lognormal:<mu>,<sigma>
+
+Usage:
+    python benchmarks/fetch_server.py [--port 8010] [--latency exponential:0.2]
+                                      [--body-size constant:20000] [--error-rate 0.05]
+"""
+import argparse
+import base64
+import json
+import random
+import sys
+from typing import Callable
+
+from twisted.internet import reactor
+from twisted.web.resource import Resource
+from twisted.web.server import NOT_DONE_YET, Site
+
+
+DISTRIBUTIONS = {
+    "constant": lambda value: value,
+    "uniform": random.uniform,
+    "exponential": lambda mean: random.expovariate(1 / mean) if mean else 0.0,
+    "lognormal": random.lognormvariate,
+}
+
+DEFAULT_ERROR_CODES = "banned,noslaves,serverbusy,timeout"
+
+
+def parse_distribution(spec: str) -> Callable[[], float]:
+    name, _, params = spec.partition(":")
+    try:
+        function = DISTRIBUTIONS[name]
+        args = [float(param) for param in params.split(",") if param]
+        function(*args)
+    except (KeyError, TypeError, ValueError):
+        raise argparse.ArgumentTypeError("invalid distribution: {!r}".format(spec))
+    return lambda: max(0.0, function(*args))
+
+
+def make_page(size: int) -> bytes:
+    chunk = b'<div class="item"><a href="https://example.org/item">Example item</a></div>\n'
+    return (chunk * (size // len(chunk) + 1))[:size]
+
+
+class FetchAPIResource(Resource):
+    isLeaf = True
+
+    def __init__(
+        self,
+        latency: Callable[[], float],
+        body_size: Callable[[], float],
+        body_encoding: str = "plain",
+        error_rate: float = 0.0,
+        error_codes: str = DEFAULT_ERROR_CODES,
+        header_error_rate: float = 0.0,
+    ) -> None:
+        super().__init__()
+        self.latency = latency
+        self.body_size = body_size
+        self.body_encoding = body_encoding
+        self.error_rate = error_rate
+        self.error_codes = error_codes.split(",")
+        self.header_error_rate = header_error_rate
+        self.request_count = 0
+
+    def render_POST(self, request):
+        self.request_count += 1
+        if not request.getHeader("Authorization"):
+            request.setResponseCode(407)
+            request.setHeader("X-Crawlera-Error", "bad_proxy_auth")
+            return b""
+        try:
+            payload = json.loads(request.content.read().decode("utf8"))
+            url = payload["url"]
+        except (KeyError, TypeError, ValueError):
+            request.setResponseCode(400)
+            request.setHeader("Content-Type", "application/json")
+            return self._encode({"crawlera_error": "bad_payload", "body": "Invalid payload"})
+
+        latency = self.latency()
+        delayed_call = reactor.callLater(latency, self._respond, request, url, latency)
+        request.notifyFinish().addErrback(lambda _: delayed_call.cancel())
+        return NOT_DONE_YET
+
+    def _respond(self, request, url: str, latency: float) -> None:
+        request.setHeader("Content-Type", "application/json")
+        request.setHeader("Server-Timing", "total;dur={:.1f}".format(latency * 1000))
+        if random.random() < self.error_rate:
+            error = random.choice(self.error_codes)
+            request.setResponseCode(503)
+            if random.random() < self.header_error_rate:
+                request.setHeader("X-Crawlera-Error", error)
+                body = b""
+            else:
+                body = self._encode(
+                    {
+                        "url": url,
+                        "crawlera_error": error,
+                        "crawlera_status": "fail",
+                        "body": "Simulated {} error".format(error),
+                        "id": "stand-in-{}".format(self.request_count),
+                    }
+                )
+        else:
+            page = make_page(int(self.body_size()))
+            if self.body_encoding == "base64":
+                page_body = base64.b64encode(page).decode("ascii")
+            else:
+                page_body = page.decode("utf8")
+            body = self._encode(
+                {
+                    "url": url,
+                    "original_status": 200,
+                    "headers": {
+                        "content-type": "text/html; charset=UTF-8",
+                        "content-length": str(len(page)),
+                        "X-Crawlera-Version": "stand-in",
+                    },
+                    "crawlera_status": "success",
+                    "body_encoding": self.body_encoding,
+                    "body": page_body,
+                }
+            )
+        request.write(body)
+        request.finish()
+
+    @staticmethod
+    def _encode(envelope: dict) -> bytes:
+        return json.dumps(envelope).encode("utf8")
+
+
+def get_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--port", type=int, default=8010, help="0 to use a random port")
+    parser.add_argument("--interface", default="127.0.0.1")
+    add_server_arguments(parser)
+    return parser
+
+
+def add_server_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument("--latency", type=parse_distribution, default="exponential:0.2")
+    parser.add_argument("--body-size", type=parse_distribution, default="constant:20000")
+    parser.add_argument("--body-encoding", choices=["plain", "base64"], default="plain")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--error-codes", default=DEFAULT_ERROR_CODES)
+    parser.add_argument(
+        "--header-error-rate",
+        type=float,
+        default=0.0,
+        help="fraction of the errors reported with the X-Crawlera-Error header",
+    )
+
+
+def get_resource(args: argparse.Namespace) -> FetchAPIResource:
+    return FetchAPIResource(
+        latency=args.latency,
+        body_size=args.body_size,
+        body_encoding=args.body_encoding,
+        error_rate=args.error_rate,
+        error_codes=args.error_codes,
+        header_error_rate=args.header_error_rate,
+    )
+
+
+def main():
+    args = get_parser().parse_args()
+    root = Resource()
+    fetch = Resource()
+    root.putChild(b"fetch", fetch)
+    fetch.putChild(b"v2", get_resource(args))
+    port = reactor.listenTCP(args.port, Site(root), interface=args.interface)
+    # the first line of output is read by loadtest.py to find out the port
+    print("Listening on http://{}:{}/fetch/v2/".format(args.interface, port.getHost().port))
+    sys.stdout.flush()
+    reactor.run()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,168 @@
+"""
+End-to-end load test: run a Scrapy crawl through CrawleraFetchMiddleware against the
+local Fetch API stand-in (benchmarks/fetch_server.py, started in a separate process
+unless --fetch-url is given), and report the pages per second, the CPU time per page
+and the peak RSS of the crawling process.
+
+Options not listed below are passed to the stand-in server (see fetch_server.py),
+Scrapy settings can be overridden with -s NAME=VALUE.
+
+Usage:
+    python benchmarks/loadtest.py [--requests 2000] [--domains 10] [--concurrency 32]
+                                  [--slot-policy domain] [--output results.json]
+                                  [--latency exponential:0.2] [-s NAME=VALUE ...]
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+
+from scrapy import Request, Spider
+from scrapy.crawler import CrawlerProcess
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from crawlera_fetch import DownloadSlotPolicy  # noqa: E402
+
+
+REPORTED_STATS = [
+    "crawlera_fetch/request_count",
+    "crawlera_fetch/response_count",
+    "crawlera_fetch/response_error",
+    "crawlera_fetch/retry/count",
+    "crawlera_fetch/avg_latency",
+    "crawlera_fetch/latency_p50",
+    "crawlera_fetch/latency_p99",
+]
+
+
+class LoadTestSpider(Spider):
+    name = "loadtest"
+
+    def __init__(self, request_count=2000, domain_count=10, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.request_count = int(request_count)
+        self.domain_count = int(domain_count)
+        self.page_count = 0
+
+    def start_requests(self):
+        for i in range(self.request_count):
+            url = "https://site{}.example.org/page/{}".format(i % self.domain_count, i)
+            yield Request(url, dont_filter=True)
+
+    def parse(self, response):
+        self.page_count += 1
+
+
+def start_server(server_args):
+    """Start fetch_server.py on a random port and return the process and its URL"""
+    server_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fetch_server.py")
+    process = subprocess.Popen(
+        [sys.executable, server_path, "--port", "0"] + server_args,
+        stdout=subprocess.PIPE,
+        universal_newlines=True,
+    )
+    prefix = "Listening on "
+    line = process.stdout.readline()
+    if not line.startswith(prefix):
+        process.kill()
+        sys.exit("Could not start the Fetch API stand-in server")
+    start = len(prefix)
+    return process, line[start:].strip()
+
+
+def peak_rss_mb():
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return max_rss / (1024 * 1024 if sys.platform == "darwin" else 1024)
+
+
+def run_crawl(args, fetch_url):
+    settings = {
+        "CRAWLERA_FETCH_ENABLED": True,
+        "CRAWLERA_FETCH_URL": fetch_url,
+        "CRAWLERA_FETCH_APIKEY": "loadtest",
+        "CRAWLERA_FETCH_RAISE_ON_ERROR": False,
+        "CRAWLERA_FETCH_DOWNLOAD_SLOT_POLICY": DownloadSlotPolicy(args.slot_policy),
+        "DOWNLOADER_MIDDLEWARES": {"crawlera_fetch.CrawleraFetchMiddleware": 585},
+        "CONCURRENT_REQUESTS": args.concurrency,
+        "CONCURRENT_REQUESTS_PER_DOMAIN": args.concurrency,
+        "ROBOTSTXT_OBEY": False,
+        "TELNETCONSOLE_ENABLED": False,
+        "LOG_LEVEL": "WARNING",
+    }
+    for setting in args.set:
+        name, _, value = setting.partition("=")
+        settings[name] = value
+
+    process = CrawlerProcess(settings)
+    crawler = process.create_crawler(LoadTestSpider)
+    process.crawl(crawler, request_count=args.requests, domain_count=args.domains)
+
+    usage_before = resource.getrusage(resource.RUSAGE_SELF)
+    start = time.perf_counter()
+    process.start()
+    elapsed = time.perf_counter() - start
+    usage_after = resource.getrusage(resource.RUSAGE_SELF)
+
+    cpu_time = (usage_after.ru_utime - usage_before.ru_utime) + (
+        usage_after.ru_stime - usage_before.ru_stime
+    )
+    pages = crawler.spider.page_count
+    stats = crawler.stats.get_stats()
+    return {
+        "pages": pages,
+        "elapsed": elapsed,
+        "pages_per_sec": pages / elapsed,
+        "cpu_ms_per_page": cpu_time / pages * 1000 if pages else None,
+        "peak_rss_mb": peak_rss_mb(),
+        "stats": {name: stats[name] for name in REPORTED_STATS if name in stats},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--domains", type=int, default=10)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument(
+        "--slot-policy",
+        choices=[policy.value for policy in DownloadSlotPolicy],
+        default=DownloadSlotPolicy.Domain.value,
+    )
+    parser.add_argument("--fetch-url", help="use an already running server")
+    parser.add_argument("--output", help="save the results to this JSON file")
+    parser.add_argument("-s", "--set", action="append", default=[], metavar="NAME=VALUE")
+    args, server_args = parser.parse_known_args()
+
+    server = None
+    fetch_url = args.fetch_url
+    if fetch_url is None:
+        server, fetch_url = start_server(server_args)
+    try:
+        results = run_crawl(args, fetch_url)
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+    print("Pages:            {}".format(results["pages"]))
+    print("Elapsed:          {:.2f} s".format(results["elapsed"]))
+    print("Pages/sec:        {:.1f}".format(results["pages_per_sec"]))
+    if results["cpu_ms_per_page"] is not None:
+        print("CPU per page:     {:.3f} ms".format(results["cpu_ms_per_page"]))
+    print("Peak RSS:         {:.1f} MB".format(results["peak_rss_mb"]))
+    for name, value in results["stats"].items():
+        print("{}: {}".format(name, value))
+
+    if args.output:
+        results["arguments"] = sys.argv[1:]
+        with open(args.output, "w") as output_file:
+            json.dump(results, output_file, indent=2, sort_keys=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,235 @@
+"""
+Microbenchmarks for the hot path of the middleware and the log formatter:
+CrawleraFetchMiddleware.process_request, CrawleraFetchMiddleware.process_response and
+CrawleraFetchLogFormatter.crawled, with synthetic Fetch API responses from a few bytes
+to several megabytes, with plain and base64 bodies.
+
+For each case, the number of operations per second, the mean time per call and the
+peak memory allocated by a single call are reported. Results can be saved as JSON
+and compared with the results of a previous run (e.g. from another commit).
+
+Usage:
+    python benchmarks/suite.py [--output results.json] [--compare previous.json]
+                               [--filter process_response] [--min-time 0.5]
+"""
+import argparse
+import base64
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import scrapy
+from scrapy import Request, Spider
+from scrapy.http.response.text import TextResponse
+from scrapy.utils.test import get_crawler
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from crawlera_fetch import (  # noqa: E402
+    CrawleraFetchLogFormatter,
+    CrawleraFetchMiddleware,
+    DownloadSlotPolicy,
+)
+
+
+SETTINGS = {
+    "CRAWLERA_FETCH_ENABLED": True,
+    "CRAWLERA_FETCH_URL": "http://fetch.crawlera.com:8010/fetch/v2/",
+    "CRAWLERA_FETCH_APIKEY": "secret-key",
+    "CRAWLERA_FETCH_DOWNLOAD_SLOT_POLICY": DownloadSlotPolicy.Single,
+}
+
+SIZES = [
+    ("tiny", 100),
+    ("small", 10 * 1024),
+    ("medium", 500 * 1024),
+    ("large", 5 * 1024 * 1024),
+]
+
+BODY_ENCODINGS = ["plain", "base64"]
+
+
+class BenchSpider(Spider):
+    name = "bench"
+
+    def parse(self, response):
+        pass
+
+
+def get_middleware(settings=None):
+    settings_dict = dict(SETTINGS, **(settings or {}))
+    spider = BenchSpider()
+    spider.crawler = get_crawler(BenchSpider, settings_dict=settings_dict)
+    middleware = CrawleraFetchMiddleware.from_crawler(spider.crawler)
+    middleware.spider_opened(spider)
+    return middleware, spider
+
+
+def make_page(size):
+    chunk = b'<div class="item"><a href="https://example.org/item">Example item</a></div>\n'
+    return (chunk * (size // len(chunk) + 1))[:size]
+
+
+def make_envelope(page, body_encoding):
+    """Same shape as the responses in tests/data/responses.py"""
+    if body_encoding == "base64":
+        body = base64.b64encode(page).decode("ascii")
+    else:
+        body = page.decode("utf8")
+    return json.dumps(
+        {
+            "url": "https://example.org",
+            "original_status": 200,
+            "headers": {
+                "X-Crawlera-Slave": "192.241.80.236:3128",
+                "X-Crawlera-Version": "1.43.0-",
+                "status": "200",
+                "content-type": "text/html; charset=UTF-8",
+                "date": "Fri, 24 Apr 2020 18:22:10 GMT",
+                "server": "ECS (dab/4B85)",
+                "content-length": str(len(page)),
+            },
+            "crawlera_status": "success",
+            "body_encoding": body_encoding,
+            "body": body,
+        }
+    ).encode("utf8")
+
+
+def measure(func, setup, min_time):
+    """
+    Call func(*setup()) repeatedly for at least min_time seconds (only the calls are
+    timed), then measure the peak memory allocated by a single call.
+    """
+    elapsed = 0.0
+    calls = 0
+    while elapsed < min_time or calls < 3:
+        args = setup()
+        start = time.perf_counter()
+        func(*args)
+        elapsed += time.perf_counter() - start
+        calls += 1
+
+    args = setup()
+    tracemalloc.start()
+    baseline, _ = tracemalloc.get_traced_memory()
+    func(*args)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        "calls": calls,
+        "ops_per_sec": calls / elapsed,
+        "mean_us": elapsed / calls * 1000000,
+        "allocated_bytes": peak - baseline,
+    }
+
+
+def get_cases():
+    middleware, spider = get_middleware()
+    logformatter = CrawleraFetchLogFormatter()
+
+    def request_setup():
+        return (Request("https://example.org", meta={"crawlera_fetch": {"args": {}}}), spider)
+
+    yield "process_request/GET", middleware.process_request, request_setup
+
+    def post_request_setup():
+        return (Request("https://example.org", method="POST", body=make_page(10 * 1024)), spider)
+
+    yield "process_request/POST-10KB", middleware.process_request, post_request_setup
+
+    for size_name, size in SIZES:
+        page = make_page(size)
+        for body_encoding in BODY_ENCODINGS:
+            envelope = make_envelope(page, body_encoding)
+
+            def response_setup(envelope=envelope):
+                processed = middleware.process_request(Request("https://example.org"), spider)
+                response = TextResponse(
+                    url=processed.url, request=processed, body=envelope, encoding="utf8"
+                )
+                return (processed, response, spider)
+
+            name = "process_response/{}/{}".format(body_encoding, size_name)
+            yield name, middleware.process_response, response_setup
+
+    def crawled_setup():
+        processed = middleware.process_request(Request("https://example.org"), spider)
+        response = TextResponse(url=processed.url, request=processed, body=b"{}")
+        return (processed, response, spider)
+
+    yield "logformatter/crawled", logformatter.crawled, crawled_setup
+
+
+def git_revision():
+    try:
+        output = subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return output.decode("ascii").strip()
+
+
+def compare(results, previous_path):
+    with open(previous_path) as previous_file:
+        previous = json.load(previous_file)
+    print()
+    print("Compared with {} ({}):".format(previous_path, previous.get("revision")))
+    print("{:<36} {:>14} {:>16}".format("case", "ops/sec ratio", "allocated ratio"))
+    for name, result in results.items():
+        old = previous["results"].get(name)
+        if not old:
+            continue
+        ops_ratio = result["ops_per_sec"] / old["ops_per_sec"]
+        alloc_ratio = (
+            result["allocated_bytes"] / old["allocated_bytes"] if old["allocated_bytes"] else 0
+        )
+        print("{:<36} {:>13.2f}x {:>15.2f}x".format(name, ops_ratio, alloc_ratio))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--output", help="save the results to this JSON file")
+    parser.add_argument("--compare", help="compare with results saved in this JSON file")
+    parser.add_argument("--filter", default="", help="only run cases containing this string")
+    parser.add_argument("--min-time", type=float, default=0.5, help="seconds per case")
+    args = parser.parse_args()
+
+    results = {}
+    print("{:<36} {:>12} {:>12} {:>16}".format("case", "ops/sec", "mean (us)", "allocated (B)"))
+    for name, func, setup in get_cases():
+        if args.filter not in name:
+            continue
+        result = measure(func, setup, args.min_time)
+        results[name] = result
+        print(
+            "{:<36} {:>12.0f} {:>12.1f} {:>16}".format(
+                name, result["ops_per_sec"], result["mean_us"], result["allocated_bytes"]
+            )
+        )
+
+    if args.output:
+        with open(args.output, "w") as output_file:
+            json.dump(
+                {
+                    "revision": git_revision(),
+                    "python": platform.python_version(),
+                    "scrapy": scrapy.__version__,
+                    "results": results,
+                },
+                output_file,
+                indent=2,
+                sort_keys=True,
+            )
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
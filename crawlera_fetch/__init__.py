@@ -1,2 +1,6 @@
 from .logformatter import CrawleraFetchLogFormatter  # noqa: F401
-from .middleware import CrawleraFetchMiddleware, DownloadSlotPolicy  # noqa: F401
+from .middleware import (  # noqa: F401
+    CrawleraFetchMiddleware,
+    DownloadSlotPolicy,
+    UpstreamBodyPolicy,
+)
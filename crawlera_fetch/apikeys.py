@@ -0,0 +1,78 @@
+import logging
+from typing import List, Optional
+
+from scrapy.statscollectors import StatsCollector
+from w3lib.http import basic_auth_header
+
+
+logger = logging.getLogger("crawlera-fetch-middleware")
+
+
+# Fetch API errors which indicate a problem with the API key (authentication or quota)
+DEFAULT_APIKEY_ERROR_CODES = (
+    "bad_proxy_auth",
+    "too_many_conns",
+    "user_session_limit",
+    "user_suspended",
+)
+
+
+class ApiKey:
+    __slots__ = ("index", "key", "auth_header", "outstanding", "disabled_until")
+
+    def __init__(self, index: int, key: str, password: str = "") -> None:
+        self.index = index
+        self.key = key
+        self.auth_header = basic_auth_header(key, password)
+        self.outstanding = 0
+        self.disabled_until = 0.0
+
+    def __repr__(self) -> str:
+        return "<ApiKey %d %s***>" % (self.index, self.key[:5])
+
+
+class ApiKeyPool:
+    """
+    Several API keys, each one used for at most "max_concurrency" requests at the same
+    time (0 for no limit). Requests use the least loaded key, keys which get an
+    authentication or quota error are taken out of rotation for "cooldown" seconds,
+    unless all the keys are out of rotation.
+    """
+
+    def __init__(
+        self,
+        keys: List[str],
+        stats: StatsCollector,
+        password: str = "",
+        max_concurrency: int = 0,
+        cooldown: float = 300.0,
+    ) -> None:
+        if not keys:
+            raise ValueError("At least one API key is required")
+        self.keys = [ApiKey(index, key, password) for index, key in enumerate(keys)]
+        self.stats = stats
+        self.max_concurrency = max_concurrency
+        self.cooldown = cooldown
+
+    def acquire(self, now: float) -> Optional[ApiKey]:
+        """Return the key to use for a new request, or None if all of them are busy"""
+        candidates = [key for key in self.keys if key.disabled_until <= now] or self.keys
+        apikey = min(candidates, key=lambda key: key.outstanding)
+        if self.max_concurrency and apikey.outstanding >= self.max_concurrency:
+            return None
+        apikey.outstanding += 1
+        self.stats.inc_value("crawlera_fetch/apikey/{}/request_count".format(apikey.index))
+        return apikey
+
+    def release(self, index: int, error: bool, now: float) -> None:
+        apikey = self.keys[index]
+        apikey.outstanding = max(0, apikey.outstanding - 1)
+        if not error:
+            return
+        self.stats.inc_value("crawlera_fetch/apikey/{}/error_count".format(apikey.index))
+        if apikey.disabled_until <= now:
+            apikey.disabled_until = now + self.cooldown
+            self.stats.inc_value("crawlera_fetch/apikey/{}/disabled".format(apikey.index))
+            logger.warning(
+                "API key %s*** taken out of rotation for %d seconds", apikey.key[:5], self.cooldown
+            )
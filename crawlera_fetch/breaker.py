@@ -0,0 +1,144 @@
+import logging
+from collections import deque
+from enum import Enum
+
+from scrapy.statscollectors import StatsCollector
+
+
+logger = logging.getLogger("crawlera-fetch-middleware")
+
+
+# Fetch API errors which indicate a problem with the service itself, rather than
+# with the target website (network errors are always counted as failures)
+DEFAULT_BREAKER_ERROR_CODES = ("JSONDecodeError", "serverbusy", "timeout")
+
+
+class BreakerState(Enum):
+    Closed = "closed"
+    Open = "open"
+    HalfOpen = "half_open"
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker for the Fetch API endpoint.
+
+    The outcome of each request is recorded in a sliding window of "window" seconds
+    (kept as per-second buckets). When the window contains at least "min_requests"
+    requests and the ratio of failures reaches "failure_ratio", the breaker opens:
+    requests are not allowed for "open_time" seconds. After that, the breaker is
+    half-open and lets "probes" requests through; it closes again once all of them
+    succeed, and opens again as soon as one of them fails.
+    """
+
+    def __init__(
+        self,
+        stats: StatsCollector,
+        window: float = 60.0,
+        min_requests: int = 20,
+        failure_ratio: float = 0.5,
+        open_time: float = 30.0,
+        probes: int = 1,
+    ) -> None:
+        self.stats = stats
+        self.window = window
+        self.min_requests = min_requests
+        self.failure_ratio = failure_ratio
+        self.open_time = open_time
+        self.probes = probes
+        self.state = BreakerState.Closed
+        self.buckets = deque()  # type: deque
+        self.total = 0
+        self.failures = 0
+        self.opened_at = 0.0
+        self.changed_at = 0.0
+        self.probes_sent = 0
+        self.probes_succeeded = 0
+
+    def _set_state(self, state: BreakerState, now: float) -> None:
+        if state == BreakerState.Open and self.state == BreakerState.Closed:
+            self.opened_at = now
+        elif state == BreakerState.Closed:
+            self.stats.inc_value("crawlera_fetch/breaker/open_time", now - self.opened_at)
+            self.buckets.clear()
+            self.total = self.failures = 0
+        self.state = state
+        self.changed_at = now
+        self.probes_sent = self.probes_succeeded = 0
+        self.stats.inc_value("crawlera_fetch/breaker/state_change/{}".format(state.value))
+
+    def _prune(self, now: float) -> None:
+        while self.buckets and self.buckets[0][0] <= now - self.window:
+            _, total, failures = self.buckets.popleft()
+            self.total -= total
+            self.failures -= failures
+
+    def allow_request(self, now: float) -> bool:
+        """
+        Whether a request can be sent to the Fetch API. In the half-open state, each
+        allowed request is a probe, and its outcome must be recorded with probe=True.
+        """
+        if self.state == BreakerState.Closed:
+            return True
+        if self.state == BreakerState.Open:
+            if now < self.changed_at + self.open_time:
+                return False
+            self._set_state(BreakerState.HalfOpen, now)
+        elif now >= self.changed_at + self.open_time:
+            # the probes did not complete, probably lost, send new ones
+            self.changed_at = now
+            self.probes_sent = self.probes_succeeded = 0
+        if self.probes_sent >= self.probes:
+            return False
+        self.probes_sent += 1
+        return True
+
+    def retry_after(self, now: float) -> float:
+        """Seconds until the state of the breaker might allow new requests"""
+        return max(0.0, self.changed_at + self.open_time - now)
+
+    def record(self, success: bool, now: float, probe: bool = False) -> None:
+        if self.state == BreakerState.HalfOpen and probe:
+            if not success:
+                logger.warning("Fetch API circuit breaker opened again, probe request failed")
+                self._set_state(BreakerState.Open, now)
+                return
+            self.probes_succeeded += 1
+            if self.probes_succeeded >= self.probes:
+                logger.info(
+                    "Fetch API circuit breaker closed after %.1f seconds", now - self.opened_at
+                )
+                self._set_state(BreakerState.Closed, now)
+            return
+        if self.state != BreakerState.Closed:
+            # outcome of a request sent before the breaker opened
+            return
+
+        second = int(now)
+        if self.buckets and self.buckets[-1][0] == second:
+            bucket = self.buckets[-1]
+        else:
+            bucket = [second, 0, 0]
+            self.buckets.append(bucket)
+        bucket[1] += 1
+        self.total += 1
+        if not success:
+            bucket[2] += 1
+            self.failures += 1
+        self._prune(now)
+
+        if self.total >= self.min_requests and self.failures >= self.failure_ratio * self.total:
+            logger.warning(
+                "Fetch API circuit breaker opened: %d failures out of %d requests in the last "
+                "%d seconds, holding new requests for %d seconds",
+                self.failures,
+                self.total,
+                self.window,
+                self.open_time,
+            )
+            self._set_state(BreakerState.Open, now)
+
+    def set_stats(self, now: float) -> None:
+        if self.state != BreakerState.Closed:
+            self.stats.inc_value("crawlera_fetch/breaker/open_time", now - self.opened_at)
+            self.opened_at = now
@@ -0,0 +1,128 @@
+import hashlib
+import json
+import logging
+import os
+import time
+from collections import OrderedDict, namedtuple
+from typing import Iterable, Optional
+
+from scrapy.statscollectors import StatsCollector
+
+
+logger = logging.getLogger("crawlera-fetch-middleware")
+
+
+CachedResponse = namedtuple("CachedResponse", ["url", "status", "headers", "body"])
+
+
+def cache_key(url: str, method: str, body: str, args: dict, ignore_args: Iterable[str]) -> str:
+    """
+    Fingerprint of a Fetch API request: the target URL, method and body, and the
+    arguments which affect the response (volatile ones, like "job_id", are ignored).
+    """
+    significant_args = {key: value for key, value in args.items() if key not in ignore_args}
+    canonical = json.dumps([url, method, body, significant_args], sort_keys=True)
+    return hashlib.sha1(canonical.encode("utf8")).hexdigest()
+
+
+class FetchCache:
+    """
+    On-disk cache of decoded Fetch API responses, with size-based LRU eviction and
+    per-entry expiration.
+
+    Each entry is stored in a single file: a JSON line with the URL, status, headers
+    and expiration time, followed by the raw (decoded) body. The LRU index is kept in
+    memory, and it is rebuilt from the file modification times (updated upon each
+    access) when the cache is opened.
+    """
+
+    def __init__(self, path: str, stats: StatsCollector, max_size: int = 0, ttl: int = 0) -> None:
+        self.path = path
+        self.stats = stats
+        self.max_size = max_size
+        self.ttl = ttl
+        self.index = OrderedDict()  # type: OrderedDict
+        self.size = 0
+        self._load_index()
+
+    def _load_index(self) -> None:
+        entries = []
+        for dirpath, _, filenames in os.walk(self.path):
+            for filename in filenames:
+                if filename.endswith(".tmp"):
+                    continue
+                stat = os.stat(os.path.join(dirpath, filename))
+                entries.append((stat.st_mtime, filename, stat.st_size))
+        for _, key, size in sorted(entries):
+            self.index[key] = size
+            self.size += size
+        self._evict()
+
+    def _entry_path(self, key: str) -> str:
+        return os.path.join(self.path, key[:2], key)
+
+    def _remove(self, key: str) -> None:
+        self.size -= self.index.pop(key)
+        try:
+            os.remove(self._entry_path(key))
+        except OSError:
+            pass
+
+    def _evict(self) -> None:
+        while self.max_size and self.size > self.max_size and self.index:
+            self._remove(next(iter(self.index)))
+            self.stats.inc_value("crawlera_fetch/cache/evicted")
+
+    def get(self, key: str) -> Optional[CachedResponse]:
+        if key not in self.index:
+            self.stats.inc_value("crawlera_fetch/cache/miss")
+            return None
+        path = self._entry_path(key)
+        try:
+            with open(path, "rb") as cache_file:
+                metadata = json.loads(cache_file.readline().decode("utf8"))
+                body = cache_file.read()
+        except (OSError, ValueError) as exc:
+            logger.warning("Could not read cache entry %s: %s" % (path, exc))
+            self._remove(key)
+            self.stats.inc_value("crawlera_fetch/cache/miss")
+            return None
+        if metadata["expires"] and metadata["expires"] < time.time():
+            self._remove(key)
+            self.stats.inc_value("crawlera_fetch/cache/expired")
+            self.stats.inc_value("crawlera_fetch/cache/miss")
+            return None
+        self.index.move_to_end(key)
+        os.utime(path)
+        self.stats.inc_value("crawlera_fetch/cache/hit")
+        return CachedResponse(metadata["url"], metadata["status"], metadata["headers"], body)
+
+    def store(
+        self,
+        key: str,
+        url: str,
+        status: int,
+        headers: dict,
+        body: bytes,
+        ttl: Optional[int] = None,
+    ) -> None:
+        ttl = self.ttl if ttl is None else ttl
+        metadata = {
+            "url": url,
+            "status": status,
+            "headers": headers,
+            "expires": time.time() + ttl if ttl else 0,
+        }
+        path = self._entry_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path + ".tmp", "wb") as cache_file:
+            cache_file.write(json.dumps(metadata).encode("utf8"))
+            cache_file.write(b"\n")
+            cache_file.write(body)
+        os.replace(path + ".tmp", path)
+        if key in self.index:
+            self.size -= self.index.pop(key)
+        self.index[key] = os.path.getsize(path)
+        self.size += self.index[key]
+        self.stats.inc_value("crawlera_fetch/cache/store")
+        self._evict()
@@ -0,0 +1,124 @@
+import gzip
+import logging
+import zlib
+from typing import Callable, Dict, FrozenSet, Iterable, List, Optional
+
+from scrapy.settings import BaseSettings
+from scrapy.utils.conf import build_component_list
+from scrapy.utils.misc import load_object
+
+
+logger = logging.getLogger("crawlera-fetch-middleware")
+
+
+# in order of preference, encodings whose library is not installed are skipped
+DEFAULT_ENCODINGS = ("zstd", "br", "gzip")
+
+
+def _gunzip(data: bytes) -> bytes:
+    return zlib.decompress(data, 16 + zlib.MAX_WBITS)
+
+
+def _inflate(data: bytes) -> bytes:
+    try:
+        return zlib.decompress(data)
+    except zlib.error:
+        # some servers send raw deflate streams, without the zlib header
+        return zlib.decompress(data, -zlib.MAX_WBITS)
+
+
+DECOMPRESSORS = {
+    "gzip": _gunzip,
+    "x-gzip": _gunzip,
+    "deflate": _inflate,
+}  # type: Dict[str, Callable[[bytes], bytes]]
+
+COMPRESSORS = {
+    "gzip": gzip.compress,
+    "deflate": zlib.compress,
+}  # type: Dict[str, Callable[[bytes], bytes]]
+
+try:
+    import brotli
+except ImportError:
+    try:
+        import brotlicffi as brotli  # type: ignore
+    except ImportError:
+        brotli = None  # type: ignore
+if brotli is not None:
+    DECOMPRESSORS["br"] = brotli.decompress
+    COMPRESSORS["br"] = brotli.compress
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None  # type: ignore
+if zstandard is not None:
+
+    def _zstd_decompress(data: bytes) -> bytes:
+        # frames compressed in streaming mode do not include the content size,
+        # which ZstdDecompressor.decompress requires
+        return zstandard.ZstdDecompressor().decompressobj().decompress(data)
+
+    DECOMPRESSORS["zstd"] = _zstd_decompress
+    COMPRESSORS["zstd"] = lambda data: zstandard.ZstdCompressor().compress(data)
+
+
+KNOWN_ENCODINGS = frozenset(["gzip", "x-gzip", "deflate", "br", "zstd"])
+
+
+def available_encodings(encodings: Iterable[str]) -> List[str]:
+    """Return the given encodings which can be decompressed, in the same order"""
+    available = []
+    for encoding in encodings:
+        encoding = encoding.strip().lower()
+        if encoding in DECOMPRESSORS:
+            available.append(encoding)
+        elif encoding in KNOWN_ENCODINGS:
+            logger.debug("%s content encoding not available (library not installed)", encoding)
+        else:
+            logger.warning("Unknown content encoding: %r" % encoding)
+    return available
+
+
+def http_compression_encodings(settings: BaseSettings) -> Optional[FrozenSet[str]]:
+    """
+    Return the content encodings decompressed by HttpCompressionMiddleware, or None if it
+    is not enabled. It removes the Content-Encoding header of the responses with other
+    encodings, leaving their body compressed.
+    """
+    from scrapy.downloadermiddlewares import httpcompression
+
+    if not settings.getbool("COMPRESSION_ENABLED", True):
+        return None
+    for path in build_component_list(settings.getwithbase("DOWNLOADER_MIDDLEWARES")):
+        middleware_cls = load_object(path) if isinstance(path, str) else path
+        if issubclass(middleware_cls, httpcompression.HttpCompressionMiddleware):
+            encodings = getattr(httpcompression, "ACCEPTED_ENCODINGS", [b"gzip", b"deflate"])
+            return frozenset(encoding.decode("ascii") for encoding in encodings)
+    return None
+
+
+def decompress(data: bytes, content_encoding: bytes) -> bytes:
+    """
+    Decompress data according to the value of a Content-Encoding header, which
+    lists the encodings in the order they were applied. Raise ValueError if one of
+    the encodings is not supported, or if the data cannot be decompressed.
+    """
+    for encoding in reversed(content_encoding.decode("latin1").lower().split(",")):
+        encoding = encoding.strip()
+        if not encoding or encoding == "identity":
+            continue
+        try:
+            decompressor = DECOMPRESSORS[encoding]
+        except KeyError:
+            raise ValueError("Unsupported content encoding: %r" % encoding)
+        try:
+            data = decompressor(data)
+        except Exception as exc:
+            raise ValueError("Could not decompress %s data: %s" % (encoding, exc)) from exc
+    return data
+
+
+def compress(data: bytes, encoding: str) -> bytes:
+    return COMPRESSORS[encoding](data)
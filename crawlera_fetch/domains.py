@@ -0,0 +1,68 @@
+from typing import Optional, Set
+
+from scrapy.statscollectors import StatsCollector
+
+from .histogram import LatencyHistogram
+from .topk import SpaceSaving
+
+
+MAX_ERROR_CODES = 10
+
+
+class DomainStats:
+    __slots__ = ("response_count", "error_count", "error_codes", "latency")
+
+    def __init__(self) -> None:
+        self.response_count = 0
+        self.error_count = 0
+        self.error_codes = SpaceSaving(MAX_ERROR_CODES)
+        self.latency = LatencyHistogram()
+
+
+class DomainStatsCollector:
+    """
+    Per-domain request count, latency and errors, for at most "max_domains" domains.
+    The most requested domains are kept (see SpaceSaving), request counts for
+    domains which were tracked after some other domain was evicted are approximate.
+    """
+
+    def __init__(self, max_domains: int) -> None:
+        self.domains = SpaceSaving(max_domains, factory=DomainStats)
+        self.reported = set()  # type: Set[str]
+
+    def record_request(self, domain: str) -> None:
+        self.domains.add(domain)
+
+    def record_response(self, domain: str, latency: float, error: Optional[str] = None) -> None:
+        domain_stats = self.domains.get(domain)
+        if domain_stats is None:
+            return
+        domain_stats.response_count += 1
+        domain_stats.latency.add(latency)
+        if error is not None:
+            domain_stats.error_count += 1
+            domain_stats.error_codes.add(error)
+
+    def set_stats(self, stats: StatsCollector, prefix: str = "crawlera_fetch/domain") -> None:
+        values = {}
+        for domain, request_count, _, domain_stats in self.domains.top():
+            key = "{}/{}/".format(prefix, domain)
+            values[key + "request_count"] = request_count
+            values[key + "response_count"] = domain_stats.response_count
+            values[key + "error_count"] = domain_stats.error_count
+            if domain_stats.response_count:
+                error_rate = domain_stats.error_count / domain_stats.response_count
+                values[key + "error_rate"] = error_rate
+            for name, latency in domain_stats.latency.named_percentiles().items():
+                values[key + "latency_" + name] = latency
+            for code, count, _, _ in domain_stats.error_codes.top():
+                values[key + "error/" + code] = count
+        for key, value in values.items():
+            stats.set_value(key, value)
+        # keys of the domains (and error codes) which were evicted are removed
+        all_stats = stats.get_stats()
+        for key in self.reported.difference(values):
+            all_stats.pop(key, None)
+        self.reported = set(values)
+        if self.domains.evicted:
+            stats.set_value(prefix + "/evicted", self.domains.evicted)
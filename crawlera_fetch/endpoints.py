@@ -0,0 +1,142 @@
+import logging
+from enum import Enum
+from typing import Container, List, Optional
+from urllib.parse import urlparse
+
+from scrapy.statscollectors import StatsCollector
+
+from .histogram import LatencyHistogram
+
+
+logger = logging.getLogger("crawlera-fetch-middleware")
+
+
+class EndpointStrategy(Enum):
+    RoundRobin = "round_robin"
+    LeastOutstanding = "least_outstanding"
+    Latency = "latency"
+
+
+class Endpoint:
+    __slots__ = (
+        "url",
+        "name",
+        "outstanding",
+        "ewma",
+        "consecutive_errors",
+        "unhealthy_until",
+        "response_count",
+        "error_count",
+        "latency",
+    )
+
+    def __init__(self, url: str) -> None:
+        self.url = url
+        self.name = urlparse(url).netloc
+        self.outstanding = 0
+        self.ewma = 0.0
+        self.consecutive_errors = 0
+        self.unhealthy_until = 0.0
+        self.response_count = 0
+        self.error_count = 0
+        self.latency = LatencyHistogram()
+
+    def __repr__(self) -> str:
+        return "<Endpoint %s>" % self.url
+
+
+class EndpointPool:
+    """
+    Several Fetch API endpoints, among which each request is sent to one, selected with
+    one of the following strategies:
+
+    * round_robin: each endpoint in turn
+    * least_outstanding: the endpoint with the fewest requests being downloaded
+    * latency: the endpoint with the lowest latency (exponentially weighted moving
+      average), multiplied by its number of outstanding requests plus one
+
+    After "max_errors" consecutive errors an endpoint is considered unhealthy and it is
+    not selected for "cooldown" seconds, unless all the endpoints are unhealthy.
+    """
+
+    def __init__(
+        self,
+        urls: List[str],
+        stats: StatsCollector,
+        strategy: EndpointStrategy = EndpointStrategy.RoundRobin,
+        max_errors: int = 3,
+        cooldown: float = 30.0,
+        ewma_weight: float = 0.3,
+    ) -> None:
+        if not urls:
+            raise ValueError("At least one endpoint is required")
+        self.endpoints = [Endpoint(url) for url in urls]
+        self.by_url = {endpoint.url: endpoint for endpoint in self.endpoints}
+        self.stats = stats
+        self.strategy = strategy
+        self.max_errors = max_errors
+        self.cooldown = cooldown
+        self.ewma_weight = ewma_weight
+        self.next_index = 0
+
+    def __len__(self) -> int:
+        return len(self.endpoints)
+
+    def select(self, now: float, exclude: Container[str] = ()) -> Endpoint:
+        """
+        Select the endpoint for a new request, among the healthy endpoints whose URL is
+        not excluded (or among all of them, if there are none)
+        """
+        candidates = [
+            endpoint
+            for endpoint in self.endpoints
+            if endpoint.url not in exclude and endpoint.unhealthy_until <= now
+        ]
+        if not candidates:
+            candidates = [e for e in self.endpoints if e.url not in exclude] or self.endpoints
+
+        if self.strategy == EndpointStrategy.LeastOutstanding:
+            endpoint = min(candidates, key=lambda e: e.outstanding)
+        elif self.strategy == EndpointStrategy.Latency:
+            endpoint = min(candidates, key=lambda e: e.ewma * (e.outstanding + 1))
+        else:
+            endpoint = candidates[self.next_index % len(candidates)]
+            self.next_index += 1
+
+        endpoint.outstanding += 1
+        self.stats.inc_value("crawlera_fetch/endpoint/{}/request_count".format(endpoint.name))
+        return endpoint
+
+    def get(self, url: str) -> Optional[Endpoint]:
+        return self.by_url.get(url)
+
+    def record(self, endpoint: Endpoint, latency: float, error: bool, now: float) -> None:
+        endpoint.outstanding = max(0, endpoint.outstanding - 1)
+        endpoint.response_count += 1
+        endpoint.latency.add(latency)
+        if endpoint.response_count == 1:
+            endpoint.ewma = latency
+        else:
+            endpoint.ewma += self.ewma_weight * (latency - endpoint.ewma)
+        if not error:
+            endpoint.consecutive_errors = 0
+            return
+        endpoint.error_count += 1
+        endpoint.consecutive_errors += 1
+        if endpoint.consecutive_errors >= self.max_errors and endpoint.unhealthy_until <= now:
+            endpoint.unhealthy_until = now + self.cooldown
+            self.stats.inc_value("crawlera_fetch/endpoint/{}/unhealthy".format(endpoint.name))
+            logger.warning(
+                "Fetch API endpoint %s failed %d times in a row, not using it for %d seconds",
+                endpoint.url,
+                endpoint.consecutive_errors,
+                self.cooldown,
+            )
+
+    def set_stats(self) -> None:
+        for endpoint in self.endpoints:
+            prefix = "crawlera_fetch/endpoint/{}/".format(endpoint.name)
+            self.stats.set_value(prefix + "response_count", endpoint.response_count)
+            self.stats.set_value(prefix + "error_count", endpoint.error_count)
+            for name, latency in endpoint.latency.named_percentiles().items():
+                self.stats.set_value(prefix + "latency_" + name, latency)
@@ -0,0 +1,109 @@
+import re
+from typing import Iterable, Set
+
+from scrapy.statscollectors import StatsCollector
+
+from .apikeys import DEFAULT_APIKEY_ERROR_CODES
+from .breaker import DEFAULT_BREAKER_ERROR_CODES
+from .ratelimit import DEFAULT_RATE_LIMIT_CODES
+from .retry import DEFAULT_RETRY_BACKOFF_CODES, DEFAULT_RETRY_CODES
+from .throttle import DEFAULT_BACKOFF_CODES
+from .topk import SpaceSaving
+
+
+# error codes of the Fetch API and the middleware, counted in their own stats key
+KNOWN_ERROR_CODES = frozenset(
+    DEFAULT_APIKEY_ERROR_CODES
+    + DEFAULT_BREAKER_ERROR_CODES
+    + DEFAULT_RATE_LIMIT_CODES
+    + DEFAULT_RETRY_CODES
+    + DEFAULT_RETRY_BACKOFF_CODES
+    + DEFAULT_BACKOFF_CODES
+)
+
+# stats key for the errors which are not reported on their own
+OTHER_ERRORS = "other"
+
+MAX_ERROR_CODE_LENGTH = 40
+
+URL_RE = re.compile(r"\w+://\S+")
+ID_RE = re.compile(r"\b(?=[0-9a-f-]*[0-9])[0-9a-f-]{8,}\b")
+NUMBER_RE = re.compile(r"\d+(\.\d+)?")
+SEPARATORS_RE = re.compile(r"[\W_]+")
+
+
+def normalize_error(message: str) -> str:
+    """
+    Reduce a free-form error message to a short code, with URLs, ids and numbers masked,
+    e.g. "Timeout after 30.5s (https://example.org)" becomes "timeout_after_ns_url"
+    """
+    code = URL_RE.sub(" url ", message.lower())
+    code = ID_RE.sub(" id ", code)
+    code = NUMBER_RE.sub("n", code)
+    code = SEPARATORS_RE.sub("_", code).strip("_")
+    return code[:MAX_ERROR_CODE_LENGTH].rstrip("_") or "unknown"
+
+
+class ErrorStats:
+    """
+    Error counters by code with a bounded number of stats keys. Known error codes are
+    counted in their own key. Other error messages are normalized (see normalize_error)
+    and only the "max_codes" most frequent codes are reported, with approximate counts
+    (see SpaceSaving), the rest of them being counted in the "other" key.
+    """
+
+    def __init__(
+        self,
+        stats: StatsCollector,
+        known_codes: Iterable[str] = KNOWN_ERROR_CODES,
+        max_codes: int = 20,
+        prefix: str = "crawlera_fetch/response_error",
+    ) -> None:
+        self.stats = stats
+        self.known_codes = frozenset(known_codes)
+        self.max_codes = max_codes
+        self.prefix = prefix
+        # twice as many codes are tracked, so that the reported ones are more accurate
+        self.codes = SpaceSaving(2 * max_codes)
+        self.unknown_count = 0
+        self.reported = set()  # type: Set[str]
+
+    def code(self, message: str) -> str:
+        """Return the code of an error: known codes as is, normalized messages otherwise"""
+        if message in self.known_codes:
+            return message
+        return normalize_error(message)
+
+    def record(self, message: str) -> str:
+        """Count an error and return its code"""
+        code = self.code(message)
+        if code in self.known_codes:
+            self.stats.inc_value("{}/{}".format(self.prefix, code))
+            return code
+        self.unknown_count += 1
+        self.codes.add(code)
+        return code
+
+    def set_stats(self) -> None:
+        if not self.unknown_count:
+            return
+        reported = set()
+        reported_count = 0
+        for code, count, error, _ in self.codes.top(self.max_codes):
+            # only the guaranteed part of the count, the rest is counted as "other"
+            if code == OTHER_ERRORS or count == error:
+                continue
+            key = "{}/{}".format(self.prefix, code)
+            self.stats.set_value(key, count - error)
+            reported.add(key)
+            reported_count += count - error
+        # codes which are no longer among the most frequent ones are removed
+        stats = self.stats.get_stats()
+        for key in self.reported - reported:
+            stats.pop(key, None)
+        self.reported = reported
+        self.stats.set_value(
+            "{}/{}".format(self.prefix, OTHER_ERRORS), self.unknown_count - reported_count
+        )
+        if self.codes.evicted:
+            self.stats.set_value(self.prefix + "_evicted", self.codes.evicted)
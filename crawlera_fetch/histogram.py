@@ -0,0 +1,111 @@
+from array import array
+from bisect import bisect_left
+from typing import Dict, Iterable, List, Sequence
+
+
+# Values are recorded in microseconds. The first LINEAR_BUCKETS values have a bucket
+# of their own, larger values are grouped in buckets whose width doubles every
+# SUB_BUCKETS buckets, which keeps the relative error below 1 / SUB_BUCKETS.
+SUB_BITS = 4
+LINEAR_BUCKETS = 1 << SUB_BITS
+SUB_BUCKETS = LINEAR_BUCKETS >> 1
+MAX_SHIFT = 40  # values above ~2^44 microseconds (~200 days) share the last bucket
+
+PERCENTILES = (50, 90, 95, 99, 99.9)
+
+
+class LatencyHistogram:
+    """
+    Fixed-size, log-linear histogram of latencies (in seconds).
+
+    Recording a value is O(1) and does not allocate, the approximate percentiles
+    are computed by walking the (small, fixed) list of buckets.
+    """
+
+    __slots__ = ("counts", "count", "total", "min", "max")
+
+    def __init__(self) -> None:
+        self.counts = array("Q", [0] * (LINEAR_BUCKETS + MAX_SHIFT * SUB_BUCKETS))
+        self.count = 0
+        self.total = 0.0
+        self.min = 0.0
+        self.max = 0.0
+
+    @staticmethod
+    def _index(value: int) -> int:
+        if value < LINEAR_BUCKETS:
+            return value
+        shift = value.bit_length() - SUB_BITS
+        if shift > MAX_SHIFT:
+            return LINEAR_BUCKETS + MAX_SHIFT * SUB_BUCKETS - 1
+        return shift * SUB_BUCKETS + (value >> shift)
+
+    @staticmethod
+    def _bounds(index: int) -> tuple:
+        if index < LINEAR_BUCKETS:
+            return index, index + 1
+        shift, top = divmod(index - LINEAR_BUCKETS, SUB_BUCKETS)
+        shift += 1
+        top += SUB_BUCKETS
+        return top << shift, (top + 1) << shift
+
+    def add(self, latency: float) -> None:
+        latency = max(latency, 0.0)
+        self.counts[self._index(int(latency * 1000000))] += 1
+        if not self.count or latency < self.min:
+            self.min = latency
+        if latency > self.max:
+            self.max = latency
+        self.count += 1
+        self.total += latency
+
+    def percentiles(self, percentiles: Iterable[float] = PERCENTILES) -> Dict[float, float]:
+        """
+        Return a dict mapping each of the given percentiles to the approximate latency
+        (in seconds), or an empty dict if no values have been recorded.
+        """
+        if not self.count:
+            return {}
+        targets = sorted(percentiles)
+        result = {}
+        seen = 0
+        position = 0
+        for index, bucket_count in enumerate(self.counts):
+            if not bucket_count:
+                continue
+            seen += bucket_count
+            while position < len(targets) and seen >= targets[position] / 100 * self.count:
+                low, high = self._bounds(index)
+                value = (low + high) / 2 / 1000000
+                result[targets[position]] = min(max(value, self.min), self.max)
+                position += 1
+            if position == len(targets):
+                break
+        for percentile in targets[position:]:
+            result[percentile] = self.max
+        return result
+
+    def named_percentiles(self) -> Dict[str, float]:
+        """Same as percentiles, with keys named after the percentiles ("p50", ..., "p999")"""
+        return {
+            "p" + str(percentile).replace(".", ""): value
+            for percentile, value in self.percentiles().items()
+        }
+
+    def cumulative_counts(self, bounds: Sequence[float]) -> List[int]:
+        """
+        Return the approximate number of values lower than or equal to each of the given
+        (sorted) bounds, in seconds, e.g. for the buckets of a Prometheus histogram
+        """
+        counts = [0] * len(bounds)
+        for index, bucket_count in enumerate(self.counts):
+            if not bucket_count:
+                continue
+            low, high = self._bounds(index)
+            value = min(max((low + high) / 2 / 1000000, self.min), self.max)
+            position = bisect_left(bounds, value)
+            if position < len(bounds):
+                counts[position] += bucket_count
+        for position in range(1, len(counts)):
+            counts[position] += counts[position - 1]
+        return counts
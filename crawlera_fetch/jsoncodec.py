@@ -0,0 +1,126 @@
+import json
+import logging
+import sys
+from collections import OrderedDict
+from typing import Any
+
+
+logger = logging.getLogger("crawlera-fetch-middleware")
+
+
+def _stdlib_loads(data: bytes) -> Any:
+    if sys.version_info < (3, 6):
+        return json.loads(data.decode("utf8"))
+    return json.loads(data)
+
+
+class JsonCodec:
+    """
+    Encode and decode JSON documents to and from bytes using the standard library.
+
+    Decoding errors are always raised as json.JSONDecodeError (or UnicodeDecodeError
+    for documents which are not UTF-8): alternative codecs parse the document again
+    with the standard library upon failure, in order to report the same errors
+    regardless of the selected codec.
+    """
+
+    name = "json"
+
+    def dumps(self, obj: Any) -> bytes:
+        return json.dumps(obj).encode("utf8")
+
+    def loads(self, data: bytes) -> Any:
+        return _stdlib_loads(data)
+
+
+class OrjsonCodec(JsonCodec):
+    name = "orjson"
+
+    def __init__(self) -> None:
+        import orjson
+
+        self._dumps = orjson.dumps
+        self._loads = orjson.loads
+
+    def dumps(self, obj: Any) -> bytes:
+        return self._dumps(obj)
+
+    def loads(self, data: bytes) -> Any:
+        try:
+            return self._loads(data)
+        except ValueError:
+            return _stdlib_loads(data)
+
+
+class MsgspecCodec(JsonCodec):
+    name = "msgspec"
+
+    def __init__(self) -> None:
+        import msgspec
+
+        self._encoder = msgspec.json.Encoder()
+        self._decoder = msgspec.json.Decoder()
+        self._decode_error = msgspec.DecodeError
+
+    def dumps(self, obj: Any) -> bytes:
+        return self._encoder.encode(obj)
+
+    def loads(self, data: bytes) -> Any:
+        try:
+            return self._decoder.decode(data)
+        except self._decode_error:
+            return _stdlib_loads(data)
+
+
+class UjsonCodec(JsonCodec):
+    name = "ujson"
+
+    def __init__(self) -> None:
+        import ujson
+
+        self._dumps = ujson.dumps
+        self._loads = ujson.loads
+
+    def dumps(self, obj: Any) -> bytes:
+        return self._dumps(obj).encode("utf8")
+
+    def loads(self, data: bytes) -> Any:
+        try:
+            return self._loads(data)
+        except ValueError:
+            return _stdlib_loads(data)
+
+
+# candidates for the "auto" codec, in order of preference
+CODECS = OrderedDict(
+    [
+        (OrjsonCodec.name, OrjsonCodec),
+        (MsgspecCodec.name, MsgspecCodec),
+        (UjsonCodec.name, UjsonCodec),
+        (JsonCodec.name, JsonCodec),
+    ]
+)
+
+
+def get_codec(name: str = "json") -> JsonCodec:
+    """
+    Return an instance of the codec with the given name, or the fastest available one
+    if the name is "auto". Fall back to the standard library codec if the requested
+    one is unknown or its underlying library is not installed.
+    """
+    if name == "auto":
+        for codec_cls in CODECS.values():
+            try:
+                return codec_cls()
+            except ImportError:
+                continue
+    try:
+        codec_cls = CODECS[name]
+    except KeyError:
+        logger.warning("Unknown JSON codec '%s', using the standard library codec" % name)
+        return JsonCodec()
+    try:
+        return codec_cls()
+    except ImportError:
+        logger.warning("Could not import the '%s' JSON codec, using the standard library" % name)
+        return JsonCodec()
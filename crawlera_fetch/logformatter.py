@@ -1,5 +1,3 @@
-import json
-from contextlib import suppress
 from typing import Optional
 
 from scrapy.http.request import Request
@@ -8,6 +6,8 @@ from scrapy.logformatter import LogFormatter
 from scrapy.spiders import Spider
 from twisted.python.failure import Failure
 
+from .middleware import META_KEY, OriginalRequest
+
 
 class CrawleraFetchLogFormatter(LogFormatter):
     """
@@ -23,9 +23,18 @@ class CrawleraFetchLogFormatter(LogFormatter):
     """
 
     def _set_target_url(self, result: dict, request: Request) -> dict:
-        with suppress(json.decoder.JSONDecodeError):
-            payload = json.loads(request.body.decode(request.encoding))
-            result["args"]["request"] = "<%s %s>" % (payload.get("method", "GET"), payload["url"])
+        """
+        Show the original request, taken from the "crawlera_fetch.original_request" meta
+        key set by the middleware
+        """
+        original_request = (request.meta.get(META_KEY) or {}).get("original_request")
+        if isinstance(original_request, OriginalRequest):
+            method, url = original_request.request.method, original_request.request.url
+        elif original_request:
+            method, url = original_request["method"], original_request["url"]
+        else:
+            return result
+        result["args"]["request"] = "<%s %s>" % (method, url)
         return result
 
     def crawled(self, request: Request, response: Response, spider: Spider) -> dict:
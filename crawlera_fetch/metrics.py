@@ -0,0 +1,267 @@
+import logging
+import os
+import re
+import time
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from scrapy.statscollectors import StatsCollector
+from twisted.internet.interfaces import IListeningPort
+from twisted.internet.task import LoopingCall
+from twisted.internet.threads import deferToThread
+from twisted.web.resource import Resource
+from twisted.web.server import Site
+
+from .histogram import LatencyHistogram
+
+
+logger = logging.getLogger("crawlera-fetch-middleware")
+
+
+CONTENT_TYPE = b"application/openmetrics-text; version=1.0.0; charset=utf-8"
+
+STATS_PREFIX = "crawlera_fetch/"
+
+# upper bounds (in seconds) of the buckets of the exported latency histogram
+DEFAULT_LATENCY_BUCKETS = (0.5, 1.0, 2.5, 5.0, 10.0, 15.0, 20.0, 30.0, 45.0, 60.0, 120.0)
+
+# stats about an entity ("<prefix><entity>/<stat>"), exported with the entity as a label
+ENTITY_PREFIXES = (
+    ("endpoint/", "endpoint"),
+    ("apikey/", "apikey"),
+    ("domain/", "domain"),
+    ("timing/", "phase"),
+    ("profile/", "section"),
+)
+
+# stats whose last path component is a value ("<prefix><value>"), exported as a single
+# metric with the value as a label (a different name is used if there is a total already)
+LABEL_PREFIXES = (
+    ("api_status_count/", "api_status_count", "status"),
+    ("response_status_count/", "response_status_count", "status"),
+    ("request_method_count/", "request_method_count", "method"),
+    ("response_error/", "response_error_by_code", "code"),
+    ("retry/reason/", "retry_reason", "reason"),
+    ("breaker/state_change/", "breaker_state_change", "state"),
+    ("throttle/decrease/", "throttle_decrease_by_code", "code"),
+    ("error/", "error_by_code", "code"),
+)
+
+# stats which are not monotonically increasing, every other stat is exported as a counter
+GAUGE_STATS = frozenset(
+    [
+        "max_latency",
+        "rate_limit_rate",
+        "rate_limit_max_wait",
+        "decode_pool_max_decode_time",
+        "body_size_max",
+        "throttle_max_concurrency",
+        "throttle_min_concurrency",
+        "domain_error_rate",
+    ]
+)
+GAUGE_RE = re.compile(r"(^|_)(avg_latency|avg_cpu_time|latency_p\d+)$")
+
+INVALID_NAME_CHARS_RE = re.compile(r"[^a-zA-Z0-9_]")
+
+
+def parse_stat_key(key: str) -> Tuple[str, Tuple[Tuple[str, str], ...]]:
+    """
+    Return the metric name and labels for a stat, e.g. "crawlera_fetch/response_error/banned"
+    is exported as ("crawlera_fetch_response_error_by_code", (("code", "banned"),))
+    """
+    start = len(STATS_PREFIX)
+    name = key[start:]
+    labels = []  # type: List[Tuple[str, str]]
+    entity_prefix = ""
+    for prefix, label in ENTITY_PREFIXES:
+        start = len(prefix)
+        if name.startswith(prefix) and "/" in name[start:]:
+            entity, name = name[start:].split("/", 1)
+            labels.append((label, entity))
+            entity_prefix = prefix
+            break
+    for prefix, metric, label in LABEL_PREFIXES:
+        start = len(prefix)
+        if name.startswith(prefix) and len(name) > start:
+            labels.append((label, name[start:]))
+            name = metric
+            break
+    name = INVALID_NAME_CHARS_RE.sub("_", entity_prefix + name)
+    return "crawlera_fetch_" + name, tuple(labels)
+
+
+def _format_labels(labels: Sequence[Tuple[str, str]]) -> str:
+    if not labels:
+        return ""
+    escaped = (
+        (name, value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for name, value in labels
+    )
+    return "{" + ",".join('%s="%s"' % label for label in escaped) + "}"
+
+
+def _format_value(value: float) -> str:
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def render_metrics(
+    stats: dict,
+    histogram: Optional[LatencyHistogram] = None,
+    latency_buckets: Sequence[float] = DEFAULT_LATENCY_BUCKETS,
+    gauges: Optional[Dict[str, float]] = None,
+) -> str:
+    """
+    Return the numeric "crawlera_fetch/*" stats, the latency histogram and the given
+    additional gauges (metric name -> value) in the OpenMetrics text format
+    """
+    families = {}  # type: Dict[str, Tuple[str, List[str]]]
+    for key, value in stats.items():
+        if not key.startswith(STATS_PREFIX) or isinstance(value, bool):
+            continue
+        if not isinstance(value, (int, float)):
+            continue
+        name, labels = parse_stat_key(key)
+        start = len("crawlera_fetch_")
+        short_name = name[start:]
+        if short_name in GAUGE_STATS or GAUGE_RE.search(short_name):
+            metric_type, sample_name = "gauge", name
+        else:
+            metric_type, sample_name = "counter", name + "_total"
+        _, samples = families.setdefault(name, (metric_type, []))
+        samples.append(sample_name + _format_labels(labels) + " " + _format_value(value))
+
+    for name, value in (gauges or {}).items():
+        families[name] = ("gauge", [name + " " + _format_value(value)])
+
+    if histogram is not None:
+        name = "crawlera_fetch_latency_seconds"
+        samples = []
+        counts = histogram.cumulative_counts(latency_buckets)
+        for bound, count in zip(latency_buckets, counts):
+            samples.append('%s_bucket{le="%s"} %d' % (name, _format_value(bound), count))
+        samples.append('%s_bucket{le="+Inf"} %d' % (name, histogram.count))
+        samples.append("%s_count %d" % (name, histogram.count))
+        samples.append("%s_sum %s" % (name, _format_value(histogram.total)))
+        families[name] = ("histogram", samples)
+
+    lines = []
+    for name in sorted(families):
+        metric_type, samples = families[name]
+        lines.append("# TYPE %s %s" % (name, metric_type))
+        lines.extend(sorted(samples) if metric_type != "histogram" else samples)
+    lines.append("# EOF")
+    return "\n".join(lines) + "\n"
+
+
+def write_file(path: str, data: bytes) -> None:
+    """Replace the file atomically, so that readers never see a partial snapshot"""
+    temp_path = path + ".tmp"
+    with open(temp_path, "wb") as f:
+        f.write(data)
+    os.replace(temp_path, path)
+
+
+class MetricsResource(Resource):
+    isLeaf = True
+
+    def __init__(self, exporter: "MetricsExporter") -> None:
+        Resource.__init__(self)
+        self.exporter = exporter
+
+    def render_GET(self, request):
+        request.setHeader(b"Content-Type", CONTENT_TYPE)
+        return self.exporter.body
+
+
+class MetricsExporter:
+    """
+    Periodic snapshots of the stats in the OpenMetrics text format, served over HTTP
+    and/or written to a file. Snapshots are taken every "interval" seconds in the
+    reactor thread (after calling "update", to refresh the computed stats), the HTTP
+    server returns the last snapshot and files are written in a thread.
+    """
+
+    def __init__(
+        self,
+        stats: StatsCollector,
+        histogram: LatencyHistogram,
+        update: Callable[[], None],
+        interval: float = 15.0,
+        port: Optional[int] = None,
+        host: str = "127.0.0.1",
+        path: Optional[str] = None,
+        latency_buckets: Sequence[float] = DEFAULT_LATENCY_BUCKETS,
+    ) -> None:
+        self.stats = stats
+        self.histogram = histogram
+        self.update = update
+        self.interval = interval
+        self.port = port
+        self.host = host
+        self.path = path
+        self.latency_buckets = latency_buckets
+        self.body = b"# EOF\n"
+        self.writing = False
+        self.last_counts = (0, 0)
+        self.loop = None  # type: Optional[LoopingCall]
+        self.listener = None  # type: Optional[IListeningPort]
+
+    def start(self) -> None:
+        from twisted.internet import reactor
+
+        if self.port is not None:
+            self.listener = reactor.listenTCP(
+                self.port, Site(MetricsResource(self)), interface=self.host
+            )
+            logger.info(
+                "Serving Crawlera Fetch metrics at http://%s:%d/",
+                self.host,
+                self.listener.getHost().port,
+            )
+        self.loop = LoopingCall(self.snapshot)
+        self.loop.start(self.interval, now=True)
+
+    def stop(self) -> None:
+        if self.loop is not None and self.loop.running:
+            self.loop.stop()
+        self.snapshot(write=False)
+        if self.path:
+            write_file(self.path, self.body)
+        if self.listener is not None:
+            self.listener.stopListening()
+            self.listener = None
+
+    def snapshot(self, write: bool = True) -> None:
+        try:
+            self.update()
+            stats = self.stats.get_stats()
+            response_count = stats.get("crawlera_fetch/response_count", 0)
+            error_count = stats.get("crawlera_fetch/response_error", 0)
+            last_response_count, last_error_count = self.last_counts
+            self.last_counts = (response_count, error_count)
+            interval_responses = response_count - last_response_count
+            gauges = {
+                "crawlera_fetch_snapshot_timestamp_seconds": time.time(),
+                "crawlera_fetch_interval_error_ratio": (
+                    (error_count - last_error_count) / interval_responses
+                    if interval_responses > 0
+                    else 0.0
+                ),
+            }
+            body = render_metrics(stats, self.histogram, self.latency_buckets, gauges)
+            self.body = body.encode("utf-8")
+        except Exception:
+            logger.exception("Error taking a Crawlera Fetch metrics snapshot")
+            return
+        if write and self.path and not self.writing:
+            self.writing = True
+            deferred = deferToThread(write_file, self.path, self.body)
+            deferred.addErrback(
+                lambda failure: logger.error(
+                    "Error writing Crawlera Fetch metrics to %s: %s", self.path, failure.value
+                )
+            )
+            deferred.addBoth(self._write_finished)
+
+    def _write_finished(self, _) -> None:
+        self.writing = False
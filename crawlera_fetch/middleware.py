@@ -2,22 +2,57 @@ import base64
 import binascii
 import json
 import logging
+import mmap
 import os
+import tempfile
 import time
+from collections import deque, namedtuple
+from collections.abc import Mapping
 from enum import Enum
-from typing import Optional, Type, TypeVar
+from typing import Dict, Iterator, List, Optional, Tuple, Type, TypeVar, Union
 
 import scrapy
 from scrapy.crawler import Crawler
+from scrapy.exceptions import IgnoreRequest, NotConfigured
 from scrapy.http.request import Request
 from scrapy.http.response import Response
 from scrapy.responsetypes import responsetypes
 from scrapy.settings import BaseSettings
 from scrapy.spiders import Spider
 from scrapy.statscollectors import StatsCollector
+from scrapy.utils.httpobj import urlparse_cached
+from scrapy.utils.project import data_path
 from scrapy.utils.reqser import request_from_dict, request_to_dict
+from twisted.internet.base import DelayedCall
+from twisted.internet.defer import Deferred
+from twisted.internet.task import deferLater
+from twisted.internet.threads import deferToThreadPool
+from twisted.python.failure import Failure
+from twisted.python.threadpool import ThreadPool
 from w3lib.http import basic_auth_header
 
+from .apikeys import DEFAULT_APIKEY_ERROR_CODES, ApiKey, ApiKeyPool
+from .breaker import DEFAULT_BREAKER_ERROR_CODES, BreakerState, CircuitBreaker
+from .cache import CachedResponse, FetchCache, cache_key
+from .compression import (
+    DEFAULT_ENCODINGS,
+    available_encodings,
+    compress,
+    decompress,
+    http_compression_encodings,
+)
+from .domains import DomainStatsCollector
+from .endpoints import EndpointPool, EndpointStrategy
+from .errors import KNOWN_ERROR_CODES, ErrorStats
+from .histogram import LatencyHistogram
+from .jsoncodec import JsonCodec, get_codec
+from .metrics import DEFAULT_LATENCY_BUCKETS, MetricsExporter
+from .profiler import PROFILED_METHODS, Profiler
+from .ratelimit import DEFAULT_RATE_LIMIT_CODES, RateLimiter
+from .retry import DEFAULT_RETRY_BACKOFF_CODES, DEFAULT_RETRY_CODES, RetryPolicy
+from .throttle import DEFAULT_BACKOFF_CODES, AdaptiveConcurrency
+from .timing import TimingStats, parse_server_timing
+
 
 logger = logging.getLogger("crawlera-fetch-middleware")
 
@@ -27,6 +62,126 @@ MiddlewareTypeVar = TypeVar("MiddlewareTypeVar", bound="CrawleraFetchMiddleware"
 
 META_KEY = "crawlera_fetch"
 
+# keys set under META_KEY while processing a request, not carried over to retries
+PROCESSING_META_KEYS = frozenset(
+    [
+        "original_request",
+        "timing",
+        "upstream_response",
+        "cache_key",
+        "coalesce_key",
+        "breaker_probe",
+        "endpoint",
+        "apikey_index",
+        "body_buffer",
+    ]
+)
+
+# settings with lists of error codes, which are counted in their own stats key
+ERROR_CODES_SETTINGS = (
+    "CRAWLERA_FETCH_ERROR_STATS_CODES",
+    "CRAWLERA_FETCH_APIKEY_ERROR_CODES",
+    "CRAWLERA_FETCH_BREAKER_ERROR_CODES",
+    "CRAWLERA_FETCH_ENDPOINT_ERROR_CODES",
+    "CRAWLERA_FETCH_RATE_LIMIT_CODES",
+    "CRAWLERA_FETCH_RETRY_CODES",
+    "CRAWLERA_FETCH_RETRY_BACKOFF_CODES",
+    "CRAWLERA_FETCH_THROTTLE_BACKOFF_CODES",
+)
+
+# the Fetch API response is a JSON envelope around the page body: base64 bodies are 4/3
+# of the decoded size and JSON escapes make plain bodies up to a few times bigger, the
+# download size limits for the envelope are set accordingly (see _envelope_size)
+ENVELOPE_SIZE_RATIO = 3
+ENVELOPE_OVERHEAD = 1024 * 1024
+
+# size (in characters) of the slices of the response body decoded at a time when a body
+# is spilled to a file, a multiple of 4 so that base64 slices can be decoded separately
+SPILL_CHUNK_SIZE = 1024 * 1024
+
+
+# Per-spider data to build outgoing requests: fixed headers (already encoded), default
+# arguments (including the job id) and the same arguments encoded as a JSON fragment
+# ("key": value pairs without braces), or None if they need to be merged on each request
+RequestTemplate = namedtuple("RequestTemplate", ["headers", "default_args", "default_args_json"])
+
+# Result of decoding a Fetch API response (see CrawleraFetchMiddleware._decode_response):
+# the decompression error or the decompressed size, the envelope or the JSON decoding
+# error, the decoded body of successful responses (a memory map if it was spilled to a
+# file, see _spill_body) and the time spent decoding
+DecodedResponse = namedtuple(
+    "DecodedResponse",
+    [
+        "decompress_error",
+        "decompressed_size",
+        "json_response",
+        "json_error",
+        "body",
+        "body_encoding",
+        "decode_time",
+    ],
+)
+
+
+def _decode_body(json_response: dict) -> Tuple[bytes, str]:
+    """
+    Decode the body of a Fetch API response according to its "body_encoding" field,
+    falling back to detecting base64 bodies for responses which do not include it.
+    Return the decoded body and the encoding it had in the response.
+    """
+    body = json_response["body"]
+    body_encoding = json_response.get("body_encoding")
+    if body_encoding == "base64":
+        return binascii.a2b_base64(body), "base64"
+    if body_encoding == "plain":
+        return body.encode("utf8"), "plain"
+    try:
+        return base64.b64decode(body, validate=True), "base64"
+    except (binascii.Error, ValueError):
+        return body.encode("utf8"), "plain"
+
+
+def _spill_body(
+    json_response: dict, directory: Optional[str] = None
+) -> Tuple[Union[bytes, mmap.mmap], str]:
+    """
+    Like _decode_body, but the body is decoded in slices into an anonymous temporary file
+    which is memory-mapped (read-only), so that the decoded body is not held in memory
+    (unless the base64 body cannot be decoded in slices). Return the memory map (or b""
+    for empty bodies) and the encoding of the body.
+    """
+    body = json_response["body"]
+    body_encoding = json_response.get("body_encoding")
+    with tempfile.TemporaryFile(dir=directory) as spill_file:
+        try:
+            for start in range(0, len(body), SPILL_CHUNK_SIZE):
+                end = start + SPILL_CHUNK_SIZE
+                chunk = body[start:end]
+                if body_encoding == "plain":
+                    spill_file.write(chunk.encode("utf8"))
+                else:
+                    spill_file.write(base64.b64decode(chunk, validate=True))
+        except (binascii.Error, ValueError):
+            # not base64 or not split on a 4 characters boundary (e.g. line breaks)
+            spill_file.seek(0)
+            spill_file.truncate()
+            decoded_body, body_encoding = _decode_body(json_response)
+            spill_file.write(decoded_body)
+            del decoded_body
+        else:
+            body_encoding = body_encoding or "base64"
+        spill_file.flush()
+        if not spill_file.tell():
+            return b"", body_encoding
+        return mmap.mmap(spill_file.fileno(), 0, access=mmap.ACCESS_READ), body_encoding
+
+
+def _envelope_size(body_size: int) -> int:
+    """Maximum expected size of a Fetch API response for a body of the given size"""
+    if body_size <= 0:
+        return 0
+    return body_size * ENVELOPE_SIZE_RATIO + ENVELOPE_OVERHEAD
+
 
 class DownloadSlotPolicy(Enum):
     Domain = "domain"
@@ -34,40 +189,205 @@ class DownloadSlotPolicy(Enum):
     Default = "default"
 
 
+class UpstreamBodyPolicy(Enum):
+    Full = "full"
+    Lazy = "lazy"
+    Metadata = "metadata"
+
+
 class CrawleraFetchException(Exception):
     pass
 
 
+class OriginalRequest(Mapping):
+    """
+    Lightweight handle to the original request, stored under the
+    "crawlera_fetch.original_request" meta key if CRAWLERA_FETCH_LAZY_ORIGINAL_REQUEST
+    is enabled. The request is given back as is when processing the response, while
+    reading the handle as a mapping builds (only once) the request_to_dict representation.
+    """
+
+    __slots__ = ("request", "spider", "_dict")
+
+    def __init__(self, request: Request, spider: Optional[Spider] = None) -> None:
+        self.request = request
+        self.spider = spider
+        self._dict = None  # type: Optional[dict]
+
+    def _as_dict(self) -> dict:
+        if self._dict is None:
+            self._dict = request_to_dict(self.request, spider=self.spider)
+        return self._dict
+
+    def __getitem__(self, key: str):
+        return self._as_dict()[key]
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._as_dict())
+
+    def __len__(self) -> int:
+        return len(self._as_dict())
+
+    def __bool__(self) -> bool:
+        return True
+
+    def __reduce__(self):
+        return (dict, (self._as_dict(),))
+
+    def __repr__(self) -> str:
+        return "<OriginalRequest %r>" % self.request
+
+
+class UpstreamResponseBody(Mapping):
+    """
+    Parsed Fetch API response stored under "crawlera_fetch.upstream_response.body"
+    with the UpstreamBodyPolicy.Lazy policy. Only the envelope metadata and the
+    decoded body (shared with the returned response) are kept, the encoded "body"
+    field is built again on access.
+    """
+
+    __slots__ = ("envelope", "_body", "_body_encoding")
+
+    def __init__(self, envelope: dict, body: Union[bytes, mmap.mmap], body_encoding: str) -> None:
+        self.envelope = envelope
+        self._body = body
+        self._body_encoding = body_encoding
+
+    def __getitem__(self, key: str):
+        if key != "body":
+            return self.envelope[key]
+        if self._body_encoding == "base64":
+            return base64.b64encode(self._body).decode("ascii")
+        return str(self._body, "utf8")
+
+    def __contains__(self, key: object) -> bool:
+        return key == "body" or key in self.envelope
+
+    def __iter__(self) -> Iterator[str]:
+        yield from self.envelope
+        yield "body"
+
+    def __len__(self) -> int:
+        return len(self.envelope) + 1
+
+    def __reduce__(self):
+        return (dict, (dict(self.items()),))
+
+    def __repr__(self) -> str:
+        return "<UpstreamResponseBody %r>" % self.envelope
+
+
 class CrawleraFetchMiddleware:
     url = "http://fetch.crawlera.com:8010/fetch/v2/"
     apikey = ""
     enabled = False
 
+    json_codec = JsonCodec()
+
     crawler = None  # type: Crawler
     stats = None  # type: StatsCollector
     total_latency = None  # type: int
+    latency_histogram = None  # type: LatencyHistogram
+    timing_stats = None  # type: TimingStats
+    profiler = None  # type: Optional[Profiler]
+
+    # exposed as a method to be timed in profile mode
+    _decode_body = staticmethod(_decode_body)
+    _spill_body = staticmethod(_spill_body)
 
     @classmethod
     def from_crawler(cls: Type[MiddlewareTypeVar], crawler: Crawler) -> MiddlewareTypeVar:
+        if scrapy.version_info < (2, 0, 0):
+            deferred_features = cls._deferred_features(crawler.settings)
+            if deferred_features:
+                raise NotConfigured(
+                    "{} require(s) Scrapy 2.0+, downloader middlewares cannot return "
+                    "Deferreds with Scrapy {}".format(
+                        ", ".join(deferred_features), scrapy.__version__
+                    )
+                )
         middleware = cls()
         crawler.signals.connect(middleware.spider_opened, signal=scrapy.signals.spider_opened)
         crawler.signals.connect(middleware.spider_closed, signal=scrapy.signals.spider_closed)
+        crawler.signals.connect(
+            middleware.response_downloaded, signal=scrapy.signals.response_downloaded
+        )
+        if hasattr(scrapy.signals, "headers_received"):  # Scrapy >= 2.5
+            crawler.signals.connect(
+                middleware.headers_received, signal=scrapy.signals.headers_received
+            )
         middleware.crawler = crawler
         middleware.stats = crawler.stats
         middleware.total_latency = 0
+        middleware.latency_histogram = LatencyHistogram()
+        middleware.timing_stats = TimingStats()
+        settings = crawler.settings
+        if settings.getbool("CRAWLERA_FETCH_PROFILE"):
+            middleware.profiler = Profiler(
+                stats=crawler.stats,
+                path=settings.get("CRAWLERA_FETCH_PROFILE_FILE", "crawlera_fetch.prof"),
+                window=settings.getfloat("CRAWLERA_FETCH_PROFILE_WINDOW", 30.0),
+                signal_name=settings.get("CRAWLERA_FETCH_PROFILE_SIGNAL", "SIGUSR1"),
+                trigger_stat=settings.get("CRAWLERA_FETCH_PROFILE_TRIGGER_STAT"),
+                trigger_value=settings.getfloat("CRAWLERA_FETCH_PROFILE_TRIGGER_VALUE", 0.0),
+            )
+            # replace the methods before they are registered by the middleware manager
+            for section, method_name in PROFILED_METHODS:
+                method = getattr(middleware, method_name)
+                setattr(middleware, method_name, middleware.profiler.wrap(section, method))
         return middleware
 
+    @staticmethod
+    def _deferred_features(settings: BaseSettings) -> List[str]:
+        """
+        Settings of the enabled features which return Deferreds from process_request or
+        process_response (to delay requests or responses), not supported by Scrapy < 2.0
+        """
+        features = []
+        if settings.getbool("CRAWLERA_FETCH_RETRY_ENABLED") and settings.getlist(
+            "CRAWLERA_FETCH_RETRY_BACKOFF_CODES", DEFAULT_RETRY_BACKOFF_CODES
+        ):
+            features.append("CRAWLERA_FETCH_RETRY_BACKOFF_CODES")
+        if settings.getbool("CRAWLERA_FETCH_COALESCE_ENABLED"):
+            features.append("CRAWLERA_FETCH_COALESCE_ENABLED")
+        if settings.getbool("CRAWLERA_FETCH_BREAKER_ENABLED"):
+            features.append("CRAWLERA_FETCH_BREAKER_ENABLED")
+        if settings.getfloat("CRAWLERA_FETCH_RATE_LIMIT", 0.0) > 0:
+            features.append("CRAWLERA_FETCH_RATE_LIMIT")
+        if settings.getlist("CRAWLERA_FETCH_APIKEYS") and settings.getint(
+            "CRAWLERA_FETCH_APIKEY_MAX_CONCURRENCY", 0
+        ):
+            features.append("CRAWLERA_FETCH_APIKEY_MAX_CONCURRENCY")
+        if settings.getint("CRAWLERA_FETCH_DECODE_POOL_MIN_SIZE", 0) > 0:
+            features.append("CRAWLERA_FETCH_DECODE_POOL_MIN_SIZE")
+        return features
+
     def _read_settings(self, spider: Spider) -> None:
         settings = spider.crawler.settings
-        if not settings.get("CRAWLERA_FETCH_APIKEY"):
+        apikeys = settings.getlist("CRAWLERA_FETCH_APIKEYS")
+        if not settings.get("CRAWLERA_FETCH_APIKEY") and not apikeys:
             self.enabled = False
             logger.info("Crawlera Fetch API cannot be used without an apikey")
             return
 
-        self.apikey = settings["CRAWLERA_FETCH_APIKEY"]
+        self.apikey = settings.get("CRAWLERA_FETCH_APIKEY") or apikeys[0]
         self.apipass = settings.get("CRAWLERA_FETCH_APIPASS", "")
         self.auth_header = basic_auth_header(self.apikey, self.apipass)
 
+        self.apikeys = None  # type: Optional[ApiKeyPool]
+        self.apikey_waiters = deque()  # type: deque
+        if apikeys:
+            self.apikeys = ApiKeyPool(
+                keys=apikeys,
+                stats=self.stats,
+                password=self.apipass,
+                max_concurrency=settings.getint("CRAWLERA_FETCH_APIKEY_MAX_CONCURRENCY", 0),
+                cooldown=settings.getfloat("CRAWLERA_FETCH_APIKEY_COOLDOWN", 300.0),
+            )
+            self.apikey_error_codes = set(
+                settings.getlist("CRAWLERA_FETCH_APIKEY_ERROR_CODES", DEFAULT_APIKEY_ERROR_CODES)
+            )
+
         if settings.get("CRAWLERA_FETCH_URL"):
             self.url = settings["CRAWLERA_FETCH_URL"]
 
@@ -79,6 +399,173 @@ class CrawleraFetchMiddleware:
 
         self.default_args = settings.getdict("CRAWLERA_FETCH_DEFAULT_ARGS", {})
 
+        self.lazy_original_request = settings.getbool("CRAWLERA_FETCH_LAZY_ORIGINAL_REQUEST")
+
+        self.upstream_body_policy = UpstreamBodyPolicy(
+            settings.get("CRAWLERA_FETCH_UPSTREAM_BODY_POLICY", UpstreamBodyPolicy.Full)
+        )
+
+        self.json_codec = get_codec(settings.get("CRAWLERA_FETCH_JSON_CODEC", "json"))
+        if self.profiler is not None:
+            loads = self.profiler.wrap("json_decode", self.json_codec.loads)
+            setattr(self.json_codec, "loads", loads)
+
+        self.accept_encodings = available_encodings(
+            settings.getlist("CRAWLERA_FETCH_COMPRESSION_ENCODINGS", DEFAULT_ENCODINGS)
+        )
+        http_compression = http_compression_encodings(settings)
+        if http_compression is not None:
+            # responses go through HttpCompressionMiddleware first (priority 590)
+            self.accept_encodings = [e for e in self.accept_encodings if e in http_compression]
+        self.request_compression_min_size = settings.getint(
+            "CRAWLERA_FETCH_REQUEST_COMPRESSION_MIN_SIZE", 0
+        )
+
+        self.request_template = self._build_request_template()
+
+        self.decode_pool = None  # type: Optional[ThreadPool]
+        self.decode_pool_min_size = settings.getint("CRAWLERA_FETCH_DECODE_POOL_MIN_SIZE", 0)
+        if self.decode_pool_min_size > 0:
+            self.decode_pool = ThreadPool(
+                minthreads=0,
+                maxthreads=settings.getint("CRAWLERA_FETCH_DECODE_POOL_THREADS", 2),
+                name="crawlera-fetch-decode",
+            )
+
+        self.max_body_size = settings.getint(
+            "CRAWLERA_FETCH_MAX_BODY_SIZE", settings.getint("DOWNLOAD_MAXSIZE", 0)
+        )
+        self.warn_body_size = settings.getint(
+            "CRAWLERA_FETCH_WARN_BODY_SIZE", settings.getint("DOWNLOAD_WARNSIZE", 0)
+        )
+        self.spill_body_size = settings.getint("CRAWLERA_FETCH_SPILL_BODY_SIZE", 0)
+        self.spill_dir = settings.get("CRAWLERA_FETCH_SPILL_DIR")
+
+        known_error_codes = set(KNOWN_ERROR_CODES)
+        for name in ERROR_CODES_SETTINGS:
+            known_error_codes.update(settings.getlist(name))
+        self.error_stats = ErrorStats(
+            stats=self.stats,
+            known_codes=known_error_codes,
+            max_codes=settings.getint("CRAWLERA_FETCH_ERROR_STATS_MAX_CODES", 20),
+        )
+
+        max_domains = settings.getint("CRAWLERA_FETCH_DOMAIN_STATS_MAX_DOMAINS", 0)
+        self.domain_stats = DomainStatsCollector(max_domains) if max_domains > 0 else None
+
+        self.throttle = None  # type: Optional[AdaptiveConcurrency]
+        if settings.getbool("CRAWLERA_FETCH_THROTTLE_ENABLED"):
+            self.throttle = AdaptiveConcurrency(
+                stats=self.stats,
+                target_latency=settings.getfloat("CRAWLERA_FETCH_THROTTLE_TARGET_LATENCY", 30.0),
+                min_concurrency=settings.getint("CRAWLERA_FETCH_THROTTLE_MIN_CONCURRENCY", 1),
+                max_concurrency=settings.getint("CRAWLERA_FETCH_THROTTLE_MAX_CONCURRENCY", 32),
+                max_delay=settings.getfloat("CRAWLERA_FETCH_THROTTLE_MAX_DELAY", 60.0),
+                backoff_codes=settings.getlist(
+                    "CRAWLERA_FETCH_THROTTLE_BACKOFF_CODES", DEFAULT_BACKOFF_CODES
+                ),
+            )
+
+        self.cache = None  # type: Optional[FetchCache]
+        if settings.getbool("CRAWLERA_FETCH_CACHE_ENABLED"):
+            self.cache = FetchCache(
+                path=data_path(
+                    settings.get("CRAWLERA_FETCH_CACHE_DIR", "crawlera_fetch_cache"),
+                    createdir=True,
+                ),
+                stats=self.stats,
+                max_size=settings.getint("CRAWLERA_FETCH_CACHE_MAX_SIZE", 1024 * 1024 * 1024),
+                ttl=settings.getint("CRAWLERA_FETCH_CACHE_TTL", 0),
+            )
+            self.cache_ignore_args = set(
+                settings.getlist("CRAWLERA_FETCH_CACHE_IGNORE_ARGS", ["job_id"])
+            )
+
+        self.in_flight = None  # type: Optional[Dict[str, List[Tuple[Deferred, Request]]]]
+        if settings.getbool("CRAWLERA_FETCH_COALESCE_ENABLED"):
+            self.in_flight = {}
+
+        self.breaker = None  # type: Optional[CircuitBreaker]
+        self.held_requests = []  # type: List[Tuple[Deferred, Request]]
+        self.breaker_timer = None  # type: Optional[DelayedCall]
+        if settings.getbool("CRAWLERA_FETCH_BREAKER_ENABLED"):
+            self.breaker = CircuitBreaker(
+                stats=self.stats,
+                window=settings.getfloat("CRAWLERA_FETCH_BREAKER_WINDOW", 60.0),
+                min_requests=settings.getint("CRAWLERA_FETCH_BREAKER_MIN_REQUESTS", 20),
+                failure_ratio=settings.getfloat("CRAWLERA_FETCH_BREAKER_FAILURE_RATIO", 0.5),
+                open_time=settings.getfloat("CRAWLERA_FETCH_BREAKER_OPEN_TIME", 30.0),
+                probes=settings.getint("CRAWLERA_FETCH_BREAKER_PROBES", 1),
+            )
+            self.breaker_error_codes = set(
+                settings.getlist("CRAWLERA_FETCH_BREAKER_ERROR_CODES", DEFAULT_BREAKER_ERROR_CODES)
+            )
+
+        self.endpoints = None  # type: Optional[EndpointPool]
+        endpoint_urls = settings.getlist("CRAWLERA_FETCH_URLS")
+        if endpoint_urls:
+            self.url = endpoint_urls[0]
+            self.endpoints = EndpointPool(
+                urls=endpoint_urls,
+                stats=self.stats,
+                strategy=EndpointStrategy(
+                    settings.get("CRAWLERA_FETCH_ENDPOINT_STRATEGY", EndpointStrategy.RoundRobin)
+                ),
+                max_errors=settings.getint("CRAWLERA_FETCH_ENDPOINT_MAX_ERRORS", 3),
+                cooldown=settings.getfloat("CRAWLERA_FETCH_ENDPOINT_COOLDOWN", 30.0),
+            )
+            self.endpoint_error_codes = set(
+                settings.getlist(
+                    "CRAWLERA_FETCH_ENDPOINT_ERROR_CODES", DEFAULT_BREAKER_ERROR_CODES
+                )
+            )
+
+        self.rate_limiter = None  # type: Optional[RateLimiter]
+        rate_limit = settings.getfloat("CRAWLERA_FETCH_RATE_LIMIT", 0.0)
+        if rate_limit > 0:
+            self.rate_limiter = RateLimiter(
+                stats=self.stats,
+                rate=rate_limit,
+                burst=settings.getfloat("CRAWLERA_FETCH_RATE_LIMIT_BURST", 0.0),
+                domain_rate=settings.getfloat("CRAWLERA_FETCH_RATE_LIMIT_PER_DOMAIN", 0.0),
+                limit_codes=settings.getlist(
+                    "CRAWLERA_FETCH_RATE_LIMIT_CODES", DEFAULT_RATE_LIMIT_CODES
+                ),
+            )
+
+        self.metrics = None  # type: Optional[MetricsExporter]
+        if settings.getbool("CRAWLERA_FETCH_METRICS_ENABLED"):
+            port = settings.get("CRAWLERA_FETCH_METRICS_PORT")
+            self.metrics = MetricsExporter(
+                stats=self.stats,
+                histogram=self.latency_histogram,
+                update=self.update_stats,
+                interval=settings.getfloat("CRAWLERA_FETCH_METRICS_INTERVAL", 15.0),
+                port=int(port) if port is not None else None,
+                host=settings.get("CRAWLERA_FETCH_METRICS_HOST", "127.0.0.1"),
+                path=settings.get("CRAWLERA_FETCH_METRICS_FILE"),
+                latency_buckets=sorted(
+                    float(bound)
+                    for bound in settings.getlist(
+                        "CRAWLERA_FETCH_METRICS_LATENCY_BUCKETS", DEFAULT_LATENCY_BUCKETS
+                    )
+                ),
+            )
+
+        self.retry_policy = None  # type: Optional[RetryPolicy]
+        if settings.getbool("CRAWLERA_FETCH_RETRY_ENABLED"):
+            self.retry_policy = RetryPolicy(
+                stats=self.stats,
+                max_retry_times=settings.getint("CRAWLERA_FETCH_RETRY_TIMES", 3),
+                retry_codes=settings.getlist("CRAWLERA_FETCH_RETRY_CODES", DEFAULT_RETRY_CODES),
+                backoff_codes=settings.getlist(
+                    "CRAWLERA_FETCH_RETRY_BACKOFF_CODES", DEFAULT_RETRY_BACKOFF_CODES
+                ),
+                backoff_base=settings.getfloat("CRAWLERA_FETCH_RETRY_BACKOFF_BASE", 1.0),
+                backoff_max=settings.getfloat("CRAWLERA_FETCH_RETRY_BACKOFF_MAX", 60.0),
+                budget_ratio=settings.getfloat("CRAWLERA_FETCH_RETRY_BUDGET_RATIO", 0.2),
+            )
+
     def spider_opened(self, spider):
         try:
             spider_attr = getattr(spider, "crawlera_fetch_enabled")
@@ -96,19 +583,80 @@ class CrawleraFetchMiddleware:
         self.enabled = True
         self._read_settings(spider)
         if self.enabled:
+            url = self.url
+            if self.endpoints is not None:
+                url = ", ".join(endpoint.url for endpoint in self.endpoints.endpoints)
             logger.info(
-                "Using Crawlera Fetch API at %s with apikey %s***" % (self.url, self.apikey[:5])
+                "Using Crawlera Fetch API at %s with apikey %s***" % (url, self.apikey[:5])
             )
+            if self.metrics is not None:
+                self.metrics.start()
+            if self.profiler is not None:
+                self.profiler.start()
+            if self.decode_pool is not None:
+                self.decode_pool.start()
 
     def spider_closed(self, spider: Spider, reason: str) -> None:
         if self.enabled:
-            self.stats.set_value("crawlera_fetch/total_latency", self.total_latency)
-            response_count = self.stats.get_value("crawlera_fetch/response_count")
-            if response_count:
-                avg_latency = self.total_latency / response_count
-                self.stats.set_value("crawlera_fetch/avg_latency", avg_latency)
+            self.update_stats()
+            if self.breaker_timer is not None and self.breaker_timer.active():
+                self.breaker_timer.cancel()
+            if self.metrics is not None:
+                self.metrics.stop()
+            if self.profiler is not None:
+                self.profiler.stop()
+            if self.decode_pool is not None:
+                self.decode_pool.stop()
+
+    def update_stats(self) -> None:
+        """
+        Set the stats which are computed from the state of the middleware (average
+        latency, latency percentiles, per-domain and per-endpoint stats, etc). Called when
+        the spider is closed and before each metrics snapshot.
+        """
+        self.stats.set_value("crawlera_fetch/total_latency", self.total_latency)
+        response_count = self.stats.get_value("crawlera_fetch/response_count")
+        if response_count:
+            avg_latency = self.total_latency / response_count
+            self.stats.set_value("crawlera_fetch/avg_latency", avg_latency)
+        self.update_latency_stats()
+        self.timing_stats.set_stats(self.stats)
+        self.error_stats.set_stats()
+        if self.domain_stats is not None:
+            self.domain_stats.set_stats(self.stats)
+        if self.throttle is not None:
+            self.throttle.set_stats()
+        if self.endpoints is not None:
+            self.endpoints.set_stats()
+        if self.rate_limiter is not None:
+            self.rate_limiter.set_stats()
+        if self.breaker is not None:
+            self.breaker.set_stats(time.time())
+        if self.profiler is not None:
+            self.profiler.set_stats()
 
-    def process_request(self, request: Request, spider: Spider) -> Optional[Request]:
+    def update_latency_stats(self) -> None:
+        """
+        Set the approximate latency percentiles (crawlera_fetch/latency_p50, ...,
+        crawlera_fetch/latency_p999) in the stats. Called when the spider is closed,
+        it can also be called at any moment during the crawl.
+        """
+        for name, latency in self.latency_histogram.named_percentiles().items():
+            self.stats.set_value("crawlera_fetch/latency_" + name, latency)
+
+    def headers_received(self, request: Request) -> None:
+        timing = (request.meta.get(META_KEY) or {}).get("timing")
+        if timing is not None:
+            timing["headers_ts"] = time.time()
+
+    def response_downloaded(self, request: Request) -> None:
+        timing = (request.meta.get(META_KEY) or {}).get("timing")
+        if timing is not None:
+            timing["downloaded_ts"] = time.time()
+
+    def process_request(
+        self, request: Request, spider: Spider
+    ) -> Union[Request, Response, Deferred, None]:
         if not self.enabled:
             return None
 
@@ -120,50 +668,138 @@ class CrawleraFetchMiddleware:
         if crawlera_meta.get("skip") or crawlera_meta.get("original_request"):
             return None
 
+        if self.cache is not None and not request.meta.get("dont_cache"):
+            crawlera_meta["cache_key"] = self._cache_key(request, crawlera_meta)
+            cached = self.cache.get(crawlera_meta["cache_key"])
+            if cached is not None:
+                return self._build_cached_response(request, cached)
+
+        if self.breaker is not None:
+            now = time.time()
+            if not self.breaker.allow_request(now):
+                return self._hold_request(request, self.breaker.retry_after(now))
+            if self.breaker.state == BreakerState.HalfOpen:
+                crawlera_meta["breaker_probe"] = True
+
+        if self.in_flight is not None and not crawlera_meta.get("dont_coalesce"):
+            coalesce_key = cache_key(
+                url=request.url,
+                method=request.method,
+                body=request.body.decode(request.encoding),
+                args=crawlera_meta.get("args") or {},
+                ignore_args=(),
+            )
+            if coalesce_key in self.in_flight:
+                # an identical request is being downloaded, wait for its response
+                deferred = Deferred()
+                self.in_flight[coalesce_key].append((deferred, request))
+                self.stats.inc_value("crawlera_fetch/coalesced")
+                return deferred
+            self.in_flight[coalesce_key] = []
+            crawlera_meta["coalesce_key"] = coalesce_key
+
+        if self.rate_limiter is not None:
+            domain = urlparse_cached(request).hostname or ""
+            wait = self.rate_limiter.reserve(domain, time.time())
+            if wait:
+                from twisted.internet import reactor
+
+                return deferLater(
+                    reactor, wait, self._send_request, request, spider, crawlera_meta
+                )
+
+        return self._send_request(request, spider, crawlera_meta)
+
+    def _send_request(
+        self, request: Request, spider: Spider, crawlera_meta: dict
+    ) -> Union[Request, Deferred]:
+        """
+        Build the request to the Fetch API, once an API key is available if there are
+        several of them (see _release_apikey)
+        """
+        apikey = None
+        if self.apikeys is not None:
+            apikey = self.apikeys.acquire(time.time())
+            if apikey is None:
+                deferred = Deferred()
+                self.apikey_waiters.append((deferred, request, spider, crawlera_meta))
+                self.stats.inc_value("crawlera_fetch/apikey/waiting")
+                return deferred
+        return self._build_fetch_request(request, spider, crawlera_meta, apikey)
+
+    def _build_fetch_request(
+        self,
+        request: Request,
+        spider: Spider,
+        crawlera_meta: dict,
+        apikey: Optional[ApiKey] = None,
+    ) -> Request:
+        """Build the request to the Fetch API for the given original request"""
         self._set_download_slot(request, spider)
 
         self.stats.inc_value("crawlera_fetch/request_count")
         self.stats.inc_value("crawlera_fetch/request_method_count/{}".format(request.method))
-
-        shub_jobkey = os.environ.get("SHUB_JOBKEY")
-        if shub_jobkey:
-            self.default_args["job_id"] = shub_jobkey
+        if self.domain_stats is not None:
+            self.domain_stats.record_request(urlparse_cached(request).hostname or "")
 
         # assemble JSON payload
         original_body_text = request.body.decode(request.encoding)
         body = {"url": request.url, "body": original_body_text}
         if request.method != "GET":
             body["method"] = request.method
-        body.update(self.default_args)
-        body.update(crawlera_meta.get("args") or {})
-        body_json = json.dumps(body)
+        body_json = self._encode_payload(body, crawlera_meta.get("args") or {})
+
+        url = self.url
+        if self.endpoints is not None:
+            failed_endpoints = crawlera_meta.get("failed_endpoints") or ()
+            endpoint = self.endpoints.select(time.time(), exclude=failed_endpoints)
+            url = crawlera_meta["endpoint"] = endpoint.url
 
+        if self.lazy_original_request:
+            original_request = OriginalRequest(request, spider=spider)  # type: Mapping
+        else:
+            original_request = request_to_dict(request, spider=spider)
         additional_meta = {
-            "original_request": request_to_dict(request, spider=spider),
+            "original_request": original_request,
             "timing": {"start_ts": time.time()},
         }
         crawlera_meta.update(additional_meta)
 
-        additional_headers = {
-            "Content-Type": "application/json",
-            "Accept": "application/json",
-        }
-        if self.apikey:
-            additional_headers["Authorization"] = self.auth_header
-        request.headers.update(additional_headers)
-
-        if shub_jobkey:
-            request.headers["X-Crawlera-JobId"] = shub_jobkey
+        # the original request is left untouched, it might be given back as is
+        headers = request.headers.copy()
+        headers.update(self.request_template.headers)
+        if apikey is not None:
+            headers[b"Authorization"] = apikey.auth_header
+            crawlera_meta["apikey_index"] = apikey.index
+        min_size = self.request_compression_min_size
+        if min_size and len(body_json) >= min_size:
+            body_json = compress(body_json, "gzip")
+            headers[b"Content-Encoding"] = b"gzip"
+            self.stats.inc_value("crawlera_fetch/compression/compressed_requests")
 
+        flags = list(request.flags)
         if scrapy.version_info < (2, 0, 0):
             original_url_flag = "original url: {}".format(request.url)
-            if original_url_flag not in request.flags:
-                request.flags.append(original_url_flag)
+            if original_url_flag not in flags:
+                flags.append(original_url_flag)
 
         request.meta[META_KEY] = crawlera_meta
-        return request.replace(url=self.url, method="POST", body=body_json)
+        fetch_request = request.replace(
+            url=url, method="POST", body=body_json, headers=headers, flags=flags
+        )
+        # the download size limits of the original request apply to the page body,
+        # the Fetch API response is only bounded by the matching envelope size
+        fetch_request.meta["download_maxsize"] = _envelope_size(
+            request.meta.get("download_maxsize", self.max_body_size)
+        )
+        fetch_request.meta["download_warnsize"] = _envelope_size(
+            request.meta.get("download_warnsize", self.warn_body_size)
+        )
+        return fetch_request
 
-    def process_response(self, request: Request, response: Response, spider: Spider) -> Response:
+    def process_response(
+        self, request: Request, response: Response, spider: Spider
+    ) -> Union[Response, Request, Deferred]:
         if not self.enabled:
             return response
 
@@ -175,17 +811,178 @@ class CrawleraFetchMiddleware:
         if crawlera_meta.get("skip") or not crawlera_meta.get("original_request"):
             return response
 
-        original_request = request_from_dict(crawlera_meta["original_request"], spider=spider)
+        # set for every response, retried requests share the meta of the previous attempt,
+        # and the latency does not include the time spent in the decode thread pool
+        crawlera_meta["timing"]["end_ts"] = time.time()
+        if (
+            self.decode_pool is not None
+            and len(response.body) >= self.decode_pool_min_size
+            and not response.headers.get("X-Crawlera-Error")
+        ):
+            deferred = self._decode_in_pool(response)
+            deferred.addCallback(
+                lambda decoded: self._process_decoded_response(
+                    request, response, spider, crawlera_meta, decoded
+                )
+            )
+            return deferred
+        return self._process_decoded_response(request, response, spider, crawlera_meta)
+
+    def _process_decoded_response(
+        self,
+        request: Request,
+        response: Response,
+        spider: Spider,
+        crawlera_meta: dict,
+        decoded: Optional[DecodedResponse] = None,
+    ) -> Union[Response, Request, Deferred]:
+        coalesce_key = crawlera_meta.get("coalesce_key")
+        if self.in_flight is None or coalesce_key is None:
+            return self._process_fetch_response(request, response, spider, crawlera_meta, decoded)
+
+        waiters = self.in_flight.pop(coalesce_key, [])
+        try:
+            result = self._process_fetch_response(
+                request, response, spider, crawlera_meta, decoded
+            )
+        except Exception:
+            failure = Failure()
+            self._release_waiters(waiters, failure, crawlera_meta)
+            raise
+        self._release_waiters(waiters, result, crawlera_meta)
+        return result
+
+    def _decode_in_pool(self, response: Response) -> Deferred:
+        """Decode a large response in the thread pool, without blocking the reactor"""
+        from twisted.internet import reactor
+
+        submitted = time.perf_counter()
+
+        def _decoded(decoded: DecodedResponse) -> DecodedResponse:
+            wait_time = time.perf_counter() - submitted - decoded.decode_time
+            self.stats.inc_value("crawlera_fetch/decode_pool/response_count")
+            self.stats.inc_value("crawlera_fetch/decode_pool/response_bytes", len(response.body))
+            self.stats.inc_value("crawlera_fetch/decode_pool/wait_time", max(0.0, wait_time))
+            self.stats.inc_value("crawlera_fetch/decode_pool/decode_time", decoded.decode_time)
+            self.stats.max_value("crawlera_fetch/decode_pool/max_decode_time", decoded.decode_time)
+            return decoded
+
+        deferred = deferToThreadPool(reactor, self.decode_pool, self._decode_response, response)
+        return deferred.addCallback(_decoded)
+
+    def process_exception(
+        self, request: Request, exception: Exception, spider: Spider
+    ) -> Optional[Request]:
+        if not self.enabled:
+            return None
+        crawlera_meta = request.meta.get(META_KEY) or {}
+        if not crawlera_meta.get("original_request"):
+            return None
+        self._record_breaker(crawlera_meta, success=False)
+        self._release_apikey(crawlera_meta, error=False)
+        failover = None
+        if self.endpoints is not None:
+            now = time.time()
+            latency = now - crawlera_meta["timing"]["start_ts"]
+            self._record_endpoint(crawlera_meta, latency, True, now)
+            original_request = self._get_original_request(crawlera_meta, spider)
+            failover = self._failover(request, original_request, exception.__class__.__name__)
+        coalesce_key = crawlera_meta.get("coalesce_key")
+        if self.in_flight is not None and coalesce_key is not None:
+            self._release_waiters(self.in_flight.pop(coalesce_key, []), None, crawlera_meta)
+        return failover
+
+    def _hold_request(self, request: Request, delay: float) -> Deferred:
+        """
+        Keep a request while the circuit breaker is open, it is scheduled again when
+        the breaker allows new requests (see _release_held_requests)
+        """
+        deferred = Deferred()
+        self.held_requests.append((deferred, request))
+        self.stats.inc_value("crawlera_fetch/breaker/held")
+        self._schedule_release(delay)
+        return deferred
+
+    def _schedule_release(self, delay: float) -> None:
+        from twisted.internet import reactor
+
+        if self.breaker_timer is None or not self.breaker_timer.active():
+            self.breaker_timer = reactor.callLater(delay, self._release_held_requests)
+
+    def _release_held_requests(self) -> None:
+        """
+        Schedule again the requests held by the circuit breaker: all of them if it
+        is closed, otherwise only as many as the probes which might be sent, and check
+        again later if the probes do not close it.
+        """
+        from twisted.internet import reactor
+
+        if self.breaker is None:
+            return
+        if self.breaker.state == BreakerState.Closed:
+            released, self.held_requests = self.held_requests, []
+        else:
+            count = self.breaker.probes
+            released, self.held_requests = self.held_requests[:count], self.held_requests[count:]
+            if self.held_requests:
+                self._schedule_release(self.breaker.open_time)
+        for deferred, request in released:
+            reactor.callLater(0, deferred.callback, request.replace(dont_filter=True))
+
+    def _record_breaker(self, crawlera_meta: dict, success: bool) -> None:
+        if self.breaker is None:
+            return
+        self.breaker.record(success, time.time(), probe=crawlera_meta.get("breaker_probe", False))
+        if self.held_requests and self.breaker.state == BreakerState.Closed:
+            self._release_held_requests()
+
+    def _release_waiters(
+        self,
+        waiters: List[Tuple[Deferred, Request]],
+        result: Union[Response, Request, Deferred, Failure, None],
+        crawlera_meta: dict,
+    ) -> None:
+        """
+        Give the outcome of a request to the identical requests waiting for it: the same
+        response or failure. If there is no outcome (the request failed or is being
+        retried), the waiting requests are scheduled again to be downloaded on their own.
+        """
+        from twisted.internet import reactor
+
+        for deferred, waiter in waiters:
+            if isinstance(result, Response):
+                for key in ("upstream_response", "body_buffer"):
+                    if key in crawlera_meta:
+                        waiter.meta.setdefault(META_KEY, {})[key] = crawlera_meta[key]
+                reactor.callLater(0, deferred.callback, result.replace(request=waiter))
+            elif isinstance(result, Failure):
+                reactor.callLater(0, deferred.errback, result)
+            else:
+                reactor.callLater(0, deferred.callback, waiter.replace(dont_filter=True))
+
+    def _process_fetch_response(
+        self,
+        request: Request,
+        response: Response,
+        spider: Spider,
+        crawlera_meta: dict,
+        decoded: Optional[DecodedResponse] = None,
+    ) -> Union[Response, Request, Deferred]:
+        original_request = self._get_original_request(crawlera_meta, spider)
 
         self.stats.inc_value("crawlera_fetch/response_count")
-        self._calculate_latency(request)
+        self._calculate_latency(request, response)
 
         self.stats.inc_value("crawlera_fetch/api_status_count/{}".format(response.status))
 
         if response.headers.get("X-Crawlera-Error"):
             message = response.headers["X-Crawlera-Error"].decode("utf8")
             self.stats.inc_value("crawlera_fetch/response_error")
-            self.stats.inc_value("crawlera_fetch/response_error/{}".format(message))
+            self.error_stats.record(message)
+            self._record_response(request, original_request, spider, message)
+            retry = self._retry(request, original_request, message)
+            if retry is not None:
+                return retry
             log_msg = "Error downloading <{} {}> (status: {}, X-Crawlera-Error header: {})"
             log_msg = log_msg.format(
                 original_request.method,
@@ -199,11 +996,17 @@ class CrawleraFetchMiddleware:
                 logger.warning(log_msg)
                 return response
 
-        try:
-            json_response = json.loads(response.text)
-        except json.JSONDecodeError as exc:
+        if decoded is None:
+            decoded = self._decode_response(response)
+        self._record_decompression(response, decoded)
+        if decoded.json_error is not None:
+            exc = decoded.json_error
             self.stats.inc_value("crawlera_fetch/response_error")
-            self.stats.inc_value("crawlera_fetch/response_error/JSONDecodeError")
+            self.error_stats.record("JSONDecodeError")
+            self._record_response(request, original_request, spider, "JSONDecodeError")
+            retry = self._retry(request, original_request, "JSONDecodeError")
+            if retry is not None:
+                return retry
             log_msg = "Error decoding <{} {}> (status: {}, message: {}, lineno: {}, colno: {})"
             log_msg = log_msg.format(
                 original_request.method,
@@ -219,13 +1022,18 @@ class CrawleraFetchMiddleware:
                 logger.warning(log_msg)
                 return response
 
+        json_response = decoded.json_response
         server_error = json_response.get("crawlera_error") or json_response.get("error_code")
         original_status = json_response.get("original_status")
         request_id = json_response.get("id") or json_response.get("uncork_id")
         if server_error:
             message = json_response.get("body") or json_response.get("message")
             self.stats.inc_value("crawlera_fetch/response_error")
-            self.stats.inc_value("crawlera_fetch/response_error/{}".format(server_error))
+            self.error_stats.record(server_error)
+            self._record_response(request, original_request, spider, server_error)
+            retry = self._retry(request, original_request, server_error)
+            if retry is not None:
+                return retry
             log_msg = (
                 "Error downloading <{} {}> (Original status: {}, "
                 "Fetch API error message: {}, Request ID: {})"
@@ -244,16 +1052,36 @@ class CrawleraFetchMiddleware:
                 return response
 
         self.stats.inc_value("crawlera_fetch/response_status_count/{}".format(original_status))
+        self._record_response(request, original_request, spider)
 
+        resp_body, body_encoding = decoded.body, decoded.body_encoding
+        crawlera_meta["timing"]["decode"] = decoded.decode_time
+        self.timing_stats.add("decode", decoded.decode_time)
+        self._check_body_size(original_request, resp_body)
+        if isinstance(resp_body, mmap.mmap):
+            self.stats.inc_value("crawlera_fetch/body_size/spilled")
+            self.stats.inc_value("crawlera_fetch/body_size/spilled_bytes", len(resp_body))
+            crawlera_meta["body_buffer"] = resp_body
+        upstream_body = json_response  # type: Mapping
+        if self.upstream_body_policy != UpstreamBodyPolicy.Full:
+            del json_response["body"]
+            if self.upstream_body_policy == UpstreamBodyPolicy.Lazy:
+                upstream_body = UpstreamResponseBody(json_response, resp_body, body_encoding)
         crawlera_meta["upstream_response"] = {
             "status": response.status,
             "headers": response.headers,
-            "body": json_response,
+            "body": upstream_body,
         }
-        try:
-            resp_body = base64.b64decode(json_response["body"], validate=True)
-        except (binascii.Error, ValueError):
-            resp_body = json_response["body"]
+
+        if self.cache is not None and crawlera_meta.get("cache_key"):
+            self.cache.store(
+                key=crawlera_meta["cache_key"],
+                url=json_response["url"],
+                status=original_status or 200,
+                headers=json_response["headers"],
+                body=resp_body,
+                ttl=crawlera_meta.get("cache_ttl"),
+            )
 
         respcls = responsetypes.from_args(
             headers=json_response["headers"],
@@ -265,10 +1093,170 @@ class CrawleraFetchMiddleware:
             request=original_request,
             headers=json_response["headers"],
             url=json_response["url"],
-            body=resp_body,
+            body=resp_body if isinstance(resp_body, bytes) else b"",
             status=original_status or 200,
         )
 
+    def _decode_response(self, response: Response) -> DecodedResponse:
+        """
+        Decompress and parse a Fetch API response, and decode the body of successful
+        responses. No state is modified (errors are reported by the caller), so that it
+        can be called from a thread.
+        """
+        start = time.perf_counter()
+        decompress_error = None  # type: Optional[ValueError]
+        decompressed_size = None  # type: Optional[int]
+        try:
+            body = self._decompress_body(response)
+        except ValueError as exc:
+            decompress_error = exc
+            body = response.body
+        else:
+            if body is not response.body:
+                decompressed_size = len(body)
+        try:
+            try:
+                json_response = self.json_codec.loads(body)
+            except UnicodeDecodeError:
+                # not UTF-8, decoded with the encoding of the response instead
+                if body is not response.body:
+                    response = response.replace(body=body)
+                json_response = json.loads(response.text)
+        except json.JSONDecodeError as exc:
+            return DecodedResponse(
+                decompress_error=decompress_error,
+                decompressed_size=decompressed_size,
+                json_response=None,
+                json_error=exc,
+                body=None,
+                body_encoding=None,
+                decode_time=time.perf_counter() - start,
+            )
+        resp_body, body_encoding = None, None
+        if not (json_response.get("crawlera_error") or json_response.get("error_code")):
+            if self.spill_body_size and len(json_response["body"]) >= self.spill_body_size:
+                try:
+                    resp_body, body_encoding = self._spill_body(json_response, self.spill_dir)
+                except OSError as exc:
+                    logger.warning("Could not spill a Fetch API response body: %s", exc)
+            if resp_body is None:
+                resp_body, body_encoding = self._decode_body(json_response)
+        return DecodedResponse(
+            decompress_error=decompress_error,
+            decompressed_size=decompressed_size,
+            json_response=json_response,
+            json_error=None,
+            body=resp_body,
+            body_encoding=body_encoding,
+            decode_time=time.perf_counter() - start,
+        )
+
+    def _check_body_size(self, request: Request, body: Union[bytes, mmap.mmap]) -> None:
+        """
+        Check the size of the decoded body against the download size limits of the original
+        request (download_maxsize and download_warnsize meta keys, CRAWLERA_FETCH_MAX_BODY_SIZE
+        and CRAWLERA_FETCH_WARN_BODY_SIZE settings). Raise IgnoreRequest if it is too large.
+        """
+        body_size = len(body)
+        self.stats.max_value("crawlera_fetch/body_size/max", body_size)
+        max_size = request.meta.get("download_maxsize", self.max_body_size)
+        if max_size and body_size > max_size:
+            if isinstance(body, mmap.mmap):
+                body.close()
+            self.stats.inc_value("crawlera_fetch/body_size/dropped")
+            log_msg = "Dropping <{} {}>: body size ({}) larger than the maximum size ({})"
+            log_msg = log_msg.format(request.method, request.url, body_size, max_size)
+            logger.error(log_msg)
+            raise IgnoreRequest(log_msg)
+        warn_size = request.meta.get("download_warnsize", self.warn_body_size)
+        if warn_size and body_size > warn_size:
+            self.stats.inc_value("crawlera_fetch/body_size/warning")
+            logger.warning(
+                "Received <%s %s> with a body size (%d) larger than the warning size (%d)",
+                request.method,
+                request.url,
+                body_size,
+                warn_size,
+            )
+
+    def _decompress_body(self, response: Response) -> bytes:
+        """
+        Decompress the Fetch API response body, unless it was already done by
+        HttpCompressionMiddleware (which removes the Content-Encoding header).
+        Raise ValueError if the body cannot be decompressed.
+        """
+        content_encoding = response.headers.get("Content-Encoding")
+        if not content_encoding:
+            return response.body
+        return decompress(response.body, content_encoding)
+
+    def _record_decompression(self, response: Response, decoded: DecodedResponse) -> None:
+        if decoded.decompress_error is not None:
+            self.stats.inc_value("crawlera_fetch/compression/error")
+            logger.warning("Error decompressing Fetch API response: %s" % decoded.decompress_error)
+        elif decoded.decompressed_size is not None:
+            self.stats.inc_value("crawlera_fetch/compression/compressed_bytes", len(response.body))
+            self.stats.inc_value(
+                "crawlera_fetch/compression/decompressed_bytes", decoded.decompressed_size
+            )
+
+    def _get_original_request(self, crawlera_meta: dict, spider: Spider) -> Request:
+        if isinstance(crawlera_meta["original_request"], OriginalRequest):
+            return crawlera_meta["original_request"].request
+        return request_from_dict(crawlera_meta["original_request"], spider=spider)
+
+    def _cache_key(self, request: Request, crawlera_meta: dict) -> str:
+        args = dict(self.request_template.default_args)
+        args.update(crawlera_meta.get("args") or {})
+        return cache_key(
+            url=request.url,
+            method=request.method,
+            body=request.body.decode(request.encoding),
+            args=args,
+            ignore_args=self.cache_ignore_args,
+        )
+
+    def _build_cached_response(self, request: Request, cached: CachedResponse) -> Response:
+        respcls = responsetypes.from_args(headers=cached.headers, url=cached.url, body=cached.body)
+        return respcls(
+            url=cached.url,
+            status=cached.status,
+            headers=cached.headers,
+            body=cached.body,
+            request=request,
+            flags=["crawlera_fetch_cache"],
+        )
+
+    def _build_request_template(self) -> RequestTemplate:
+        headers = {
+            b"Content-Type": b"application/json",
+            b"Accept": b"application/json",
+        }
+        if self.apikey:
+            headers[b"Authorization"] = self.auth_header
+        if self.accept_encodings:
+            headers[b"Accept-Encoding"] = ", ".join(self.accept_encodings).encode("ascii")
+        default_args = dict(self.default_args)
+        shub_jobkey = os.environ.get("SHUB_JOBKEY")
+        if shub_jobkey:
+            default_args["job_id"] = shub_jobkey
+            headers[b"X-Crawlera-JobId"] = shub_jobkey.encode("utf8")
+        default_args_json = None
+        if default_args and not default_args.keys() & {"url", "body", "method"}:
+            default_args_json = self.json_codec.dumps(default_args)[1:-1]
+        return RequestTemplate(headers, default_args, default_args_json)
+
+    def _encode_payload(self, body: dict, args: dict) -> bytes:
+        template = self.request_template
+        if template.default_args_json is None or not args.keys().isdisjoint(template.default_args):
+            body.update(template.default_args)
+            body.update(args)
+            return self.json_codec.dumps(body)
+        # only the per-request fields are encoded, the default arguments are appended
+        body.update(args)
+        encoded = self.json_codec.dumps(body)
+        return b"".join((memoryview(encoded)[:-1], b",", template.default_args_json, b"}"))
+
     def _set_download_slot(self, request: Request, spider: Spider) -> None:
         if self.download_slot_policy == DownloadSlotPolicy.Domain:
             slot = self.crawler.engine.downloader._get_slot_key(request, spider)
@@ -277,10 +1265,180 @@ class CrawleraFetchMiddleware:
             request.meta["download_slot"] = "__crawlera_fetch__"
         # Otherwise use Scrapy default policy
 
-    def _calculate_latency(self, request: Request) -> None:
+    def _record_response(
+        self,
+        request: Request,
+        original_request: Request,
+        spider: Spider,
+        error: Optional[str] = None,
+    ) -> None:
+        timing = request.meta[META_KEY]["timing"]
+        if self.rate_limiter is not None:
+            self.rate_limiter.record(error, timing["end_ts"])
+        if self.apikeys is not None:
+            self._release_apikey(request.meta[META_KEY], error in self.apikey_error_codes)
+        if self.breaker is not None:
+            success = error not in self.breaker_error_codes
+            self._record_breaker(request.meta[META_KEY], success)
+        if self.endpoints is not None:
+            failed = error in self.endpoint_error_codes
+            self._record_endpoint(
+                request.meta[META_KEY], timing["latency"], failed, timing["end_ts"]
+            )
+        if self.domain_stats is not None:
+            self.domain_stats.record_response(
+                domain=urlparse_cached(original_request).hostname or "",
+                latency=timing["latency"],
+                error=self.error_stats.code(error) if error is not None else None,
+            )
+        self._adjust_download_slot(request, spider, timing, error)
+
+    def _adjust_download_slot(
+        self, request: Request, spider: Spider, timing: dict, error: Optional[str]
+    ) -> None:
+        if self.throttle is None:
+            return
+        downloader = self.crawler.engine.downloader
+        key = downloader._get_slot_key(request, spider)
+        slot = downloader.slots.get(key)
+        if slot is None:
+            return
+        self.throttle.update(key, slot, timing["latency"], error, timing["end_ts"])
+        if len(self.throttle.slots) > len(downloader.slots):
+            self.throttle.prune(downloader.slots)
+
+    def _release_apikey(self, crawlera_meta: dict, error: bool) -> None:
+        """
+        Release the API key used by a request, and give the available keys to the
+        requests waiting for one
+        """
+        index = crawlera_meta.pop("apikey_index", None)
+        if self.apikeys is None or index is None:
+            return
+        from twisted.internet import reactor
+
+        now = time.time()
+        self.apikeys.release(index, error, now)
+        while self.apikey_waiters:
+            apikey = self.apikeys.acquire(now)
+            if apikey is None:
+                break
+            deferred, request, spider, waiter_meta = self.apikey_waiters.popleft()
+            fetch_request = self._build_fetch_request(request, spider, waiter_meta, apikey)
+            reactor.callLater(0, deferred.callback, fetch_request)
+
+    def _record_endpoint(
+        self, crawlera_meta: dict, latency: float, error: bool, now: float
+    ) -> None:
+        if self.endpoints is None:
+            return
+        endpoint = self.endpoints.get(crawlera_meta.get("endpoint", ""))
+        if endpoint is not None:
+            self.endpoints.record(endpoint, latency, error, now)
+
+    def _failover(
+        self, request: Request, original_request: Request, error: str
+    ) -> Optional[Request]:
+        """
+        Send the request again to another endpoint, unless all of them have been tried
+        """
+        if self.endpoints is None or len(self.endpoints) < 2:
+            return None
+        crawlera_meta = request.meta[META_KEY]
+        failed_endpoints = list(crawlera_meta.get("failed_endpoints") or [])
+        failed_endpoints.append(crawlera_meta["endpoint"])
+        if len(failed_endpoints) >= len(self.endpoints):
+            return None
+        self.stats.inc_value("crawlera_fetch/endpoint/failover")
+        logger.debug(
+            "Sending <%s %s> to another endpoint, %s failed: %s",
+            original_request.method,
+            original_request.url,
+            crawlera_meta["endpoint"],
+            error,
+        )
+        return self._build_retry_request(
+            crawlera_meta, original_request, failed_endpoints=failed_endpoints
+        )
+
+    def _build_retry_request(
+        self, crawlera_meta: dict, original_request: Request, **meta_updates
+    ) -> Request:
+        retry_meta = {
+            key: value for key, value in crawlera_meta.items() if key not in PROCESSING_META_KEYS
+        }
+        retry_meta.update(meta_updates)
+        meta = dict(original_request.meta)
+        meta[META_KEY] = retry_meta
+        return original_request.replace(meta=meta, dont_filter=True)
+
+    def _retry(
+        self, request: Request, original_request: Request, error: str
+    ) -> Union[Request, Deferred, None]:
+        if self.endpoints is not None and error in self.endpoint_error_codes:
+            failover = self._failover(request, original_request, error)
+            if failover is not None:
+                return failover
+        if self.retry_policy is None:
+            return None
+        crawlera_meta = request.meta[META_KEY]
+        retry_times = crawlera_meta.get("retry_times", 0)
+        delay = self.retry_policy.get_retry_delay(
+            error=error,
+            retry_times=retry_times,
+            latency=crawlera_meta["timing"]["latency"],
+            max_retry_times=crawlera_meta.get("max_retry_times"),
+        )
+        if delay is None:
+            return None
+
+        retry_request = self._build_retry_request(
+            crawlera_meta, original_request, retry_times=retry_times + 1
+        )
+        logger.debug(
+            "Retrying <%s %s> in %.2f seconds (failed %d times): %s",
+            original_request.method,
+            original_request.url,
+            delay,
+            retry_times + 1,
+            error,
+        )
+        if delay:
+            from twisted.internet import reactor
+
+            return deferLater(reactor, delay, lambda: retry_request)
+        return retry_request
+
+    def _calculate_latency(self, request: Request, response: Response) -> None:
         timing = request.meta[META_KEY]["timing"]
-        timing["end_ts"] = time.time()
         timing["latency"] = timing["end_ts"] - timing["start_ts"]
         self.total_latency += timing["latency"]
+        self.latency_histogram.add(timing["latency"])
         max_latency = max(self.stats.get_value("crawlera_fetch/max_latency", 0), timing["latency"])
         self.stats.set_value("crawlera_fetch/max_latency", max_latency)
+        self._calculate_timing(request, response, timing)
+
+    def _calculate_timing(self, request: Request, response: Response, timing: dict) -> None:
+        """
+        Split the latency of a request into the phases described in timing.TIMING_PHASES.
+        The time until the response headers are received is measured by Scrapy
+        ("download_latency" meta key), the time when they are received is only known with
+        Scrapy >= 2.5, otherwise the body transfer time is included in the queue time.
+        """
+        download_latency = request.meta.get("download_latency")
+        if download_latency is not None:
+            downloaded_ts = timing.get("downloaded_ts", timing["end_ts"])
+            headers_ts = timing.get("headers_ts", downloaded_ts)
+            timing["queue"] = max(0.0, headers_ts - download_latency - timing["start_ts"])
+            timing["wire"] = download_latency
+            self.timing_stats.add("queue", timing["queue"])
+            self.timing_stats.add("wire", timing["wire"])
+            if "headers_ts" in timing:
+                timing["transfer"] = max(0.0, downloaded_ts - headers_ts)
+                self.timing_stats.add("transfer", timing["transfer"])
+        server_timing = response.headers.get("Server-Timing")
+        if server_timing:
+            durations = parse_server_timing(server_timing.decode("latin1"))
+            if durations:
+                timing["api"] = durations.get("total", sum(durations.values()))
+                self.timing_stats.add("api", timing["api"])
@@ -0,0 +1,157 @@
+import cProfile
+import logging
+import signal
+import threading
+import time
+from collections import defaultdict
+from functools import wraps
+from typing import Any, Callable, Dict, Optional
+
+from scrapy.statscollectors import StatsCollector
+from twisted.internet.base import DelayedCall
+from twisted.internet.task import LoopingCall
+
+
+logger = logging.getLogger("crawlera-fetch-middleware")
+
+
+# CPU time of the calling thread, the reactor thread for the middleware code
+cpu_time = getattr(time, "thread_time", time.process_time)  # Python >= 3.7
+
+# middleware methods timed in profile mode, by section name. Sections are nested:
+# "build_request" is part of "process_request" and "decompress", "json_decode",
+# "body_decode" and "body_spill" are part of "process_response"
+PROFILED_METHODS = (
+    ("process_request", "process_request"),
+    ("build_request", "_build_fetch_request"),
+    ("json_encode", "_encode_payload"),
+    ("process_response", "process_response"),
+    ("decompress", "_decompress_body"),
+    ("body_decode", "_decode_body"),
+    ("body_spill", "_spill_body"),
+)
+
+# seconds between checks of the stats threshold which starts a cProfile window
+TRIGGER_CHECK_INTERVAL = 5.0
+
+
+class Profiler:
+    """
+    Low-overhead timers for the sections of the middleware hot path (CPU time and
+    number of calls), and cProfile windows of "window" seconds, started when the
+    process receives the given signal or when the "trigger_stat" stat reaches
+    "trigger_value". Each window is written to "path", in the pstats format.
+
+    Only the sections run in the thread which created the profiler (the reactor thread)
+    are timed, not the ones run in the decode thread pool.
+    """
+
+    def __init__(
+        self,
+        stats: StatsCollector,
+        path: str = "crawlera_fetch.prof",
+        window: float = 30.0,
+        signal_name: Optional[str] = None,
+        trigger_stat: Optional[str] = None,
+        trigger_value: float = 0.0,
+    ) -> None:
+        self.stats = stats
+        self.path = path
+        self.window = window
+        self.signal_name = signal_name
+        self.trigger_stat = trigger_stat
+        self.trigger_value = trigger_value
+        self.cpu_time = defaultdict(float)  # type: Dict[str, float]
+        self.calls = defaultdict(int)  # type: Dict[str, int]
+        self.profile = None  # type: Optional[cProfile.Profile]
+        self.window_timer = None  # type: Optional[DelayedCall]
+        self.trigger_loop = None  # type: Optional[LoopingCall]
+        self.previous_handler = None  # type: Any
+        self.thread_id = threading.get_ident()
+
+    def wrap(self, section: str, func: Callable) -> Callable:
+        cpu_times = self.cpu_time
+        calls = self.calls
+        thread_id = self.thread_id
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            # the counters are not updated from other threads, without locking
+            if threading.get_ident() != thread_id:
+                return func(*args, **kwargs)
+            start = cpu_time()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                cpu_times[section] += cpu_time() - start
+                calls[section] += 1
+
+        return wrapper
+
+    def start(self) -> None:
+        if self.signal_name:
+            try:
+                self.previous_handler = signal.signal(
+                    getattr(signal, self.signal_name), self._signal_received
+                )
+            except (AttributeError, ValueError) as exc:
+                logger.warning("Cannot handle the %s signal: %s", self.signal_name, exc)
+                self.signal_name = None
+        if self.trigger_stat:
+            self.trigger_loop = LoopingCall(self._check_trigger)
+            self.trigger_loop.start(TRIGGER_CHECK_INTERVAL, now=False)
+
+    def stop(self) -> None:
+        if self.signal_name:
+            previous_handler = self.previous_handler
+            if previous_handler is None:
+                previous_handler = signal.SIG_DFL
+            signal.signal(getattr(signal, self.signal_name), previous_handler)
+        if self.trigger_loop is not None and self.trigger_loop.running:
+            self.trigger_loop.stop()
+        if self.window_timer is not None and self.window_timer.active():
+            self.window_timer.cancel()
+        self.stop_window()
+
+    def _signal_received(self, signum, frame) -> None:
+        from twisted.internet import reactor
+
+        reactor.callFromThread(self.start_window)
+
+    def _check_trigger(self) -> None:
+        value = self.stats.get_value(self.trigger_stat)
+        if value is not None and value >= self.trigger_value:
+            logger.info("%s reached %s, profiling the middleware", self.trigger_stat, value)
+            if self.trigger_loop is not None and self.trigger_loop.running:
+                self.trigger_loop.stop()
+            self.start_window()
+
+    def start_window(self) -> None:
+        if self.profile is not None:
+            return
+        from twisted.internet import reactor
+
+        logger.info("Profiling the middleware for %d seconds", self.window)
+        self.profile = cProfile.Profile()
+        self.profile.enable()
+        self.window_timer = reactor.callLater(self.window, self.stop_window)
+
+    def stop_window(self) -> None:
+        if self.profile is None:
+            return
+        self.profile.disable()
+        try:
+            self.profile.dump_stats(self.path)
+        except OSError as exc:
+            logger.error("Could not write the middleware profile to %s: %s", self.path, exc)
+        else:
+            logger.info("Middleware profile written to %s", self.path)
+        self.profile = None
+        self.stats.inc_value("crawlera_fetch/profile/windows")
+
+    def set_stats(self, prefix: str = "crawlera_fetch/profile") -> None:
+        for section, calls in self.calls.items():
+            key = "{}/{}/".format(prefix, section)
+            self.stats.set_value(key + "cpu_time", self.cpu_time[section])
+            self.stats.set_value(key + "calls", calls)
+            self.stats.set_value(key + "avg_cpu_time", self.cpu_time[section] / calls)
@@ -0,0 +1,108 @@
+from typing import Dict, Iterable, Optional
+
+from scrapy.statscollectors import StatsCollector
+
+
+# Fetch API errors returned when the account limits are exceeded
+DEFAULT_RATE_LIMIT_CODES = ("too_many_conns", "user_session_limit")
+
+# per-domain buckets kept before forgetting the idle ones
+MAX_DOMAIN_BUCKETS = 1000
+
+
+class TokenBucket:
+    """
+    Token bucket where tokens can be reserved in advance: the number of tokens can be
+    negative, meaning that the next token will be available after the previous
+    reservations are served. Each reservation returns the time to wait until its token
+    is available, so that requests are spaced at the bucket rate after a burst.
+    """
+
+    __slots__ = ("rate", "capacity", "tokens", "updated")
+
+    def __init__(self, rate: float, capacity: float, now: float) -> None:
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = now
+
+    def reserve(self, now: float) -> float:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        self.tokens -= 1
+        return -self.tokens / self.rate if self.tokens < 0 else 0.0
+
+    def is_idle(self, now: float) -> bool:
+        return self.tokens + (now - self.updated) * self.rate >= self.capacity
+
+
+class RateLimiter:
+    """
+    Client-side request rate limit: a global token bucket and, optionally, one token
+    bucket per target domain. The global rate is halved (at most once per second)
+    when responses report that the account limits were exceeded, and it recovers
+    gradually, by 1% of the configured rate per successful response.
+    """
+
+    def __init__(
+        self,
+        stats: StatsCollector,
+        rate: float,
+        burst: Optional[float] = None,
+        domain_rate: float = 0.0,
+        limit_codes: Iterable[str] = DEFAULT_RATE_LIMIT_CODES,
+        min_rate: Optional[float] = None,
+    ) -> None:
+        self.stats = stats
+        self.max_rate = rate
+        self.min_rate = min_rate if min_rate is not None else rate / 16
+        self.burst = burst if burst else max(1.0, rate)
+        self.domain_rate = domain_rate
+        self.limit_codes = frozenset(limit_codes)
+        self.bucket = TokenBucket(rate, self.burst, 0.0)
+        self.domain_buckets = {}  # type: Dict[str, TokenBucket]
+        self.last_decrease = 0.0
+
+    @property
+    def rate(self) -> float:
+        return self.bucket.rate
+
+    def reserve(self, domain: str, now: float) -> float:
+        """
+        Reserve a token for a request to the given domain, return the number of seconds
+        to wait before sending it
+        """
+        wait = self.bucket.reserve(now)
+        if self.domain_rate:
+            bucket = self.domain_buckets.get(domain)
+            if bucket is None:
+                if len(self.domain_buckets) >= MAX_DOMAIN_BUCKETS:
+                    self._prune(now)
+                bucket = self.domain_buckets[domain] = TokenBucket(
+                    self.domain_rate, max(1.0, self.domain_rate), now
+                )
+            wait = max(wait, bucket.reserve(now))
+        if wait:
+            self.stats.inc_value("crawlera_fetch/rate_limit/delayed")
+            self.stats.inc_value("crawlera_fetch/rate_limit/wait_time", wait)
+            max_wait = self.stats.get_value("crawlera_fetch/rate_limit/max_wait", 0)
+            self.stats.set_value("crawlera_fetch/rate_limit/max_wait", max(max_wait, wait))
+        return wait
+
+    def _prune(self, now: float) -> None:
+        for domain, bucket in list(self.domain_buckets.items()):
+            if bucket.is_idle(now):
+                del self.domain_buckets[domain]
+
+    def record(self, error: Optional[str], now: float) -> None:
+        """Adjust the global rate after receiving a response"""
+        if error in self.limit_codes:
+            if now - self.last_decrease >= 1.0:
+                self.last_decrease = now
+                self.bucket.rate = max(self.min_rate, self.bucket.rate / 2)
+                self.stats.inc_value("crawlera_fetch/rate_limit/decrease")
+        elif error is None and self.bucket.rate < self.max_rate:
+            self.bucket.rate = min(self.max_rate, self.bucket.rate + self.max_rate / 100)
+
+    def set_stats(self) -> None:
+        self.stats.set_value("crawlera_fetch/rate_limit/rate", self.rate)
@@ -0,0 +1,94 @@
+import random
+from enum import Enum
+from typing import Iterable, Optional
+
+from scrapy.statscollectors import StatsCollector
+
+
+DEFAULT_RETRY_CODES = ("banned", "noslaves", "slavebanned", "timeout")
+DEFAULT_RETRY_BACKOFF_CODES = ("serverbusy", "too_many_conns", "user_session_limit")
+
+
+class RetryAction(Enum):
+    Now = "now"
+    Backoff = "backoff"
+    GiveUp = "give_up"
+
+
+class RetryPolicy:
+    """
+    Decide whether a request which failed with a given Fetch API error code should be
+    retried, and how long to wait before doing it.
+
+    Error codes are classified as retryable immediately, retryable with exponential
+    backoff (with full jitter) or permanent. Retries are limited per request, and
+    globally to a fraction of the total number of requests (plus a fixed allowance),
+    so that an API incident does not multiply the load on the service.
+    """
+
+    def __init__(
+        self,
+        stats: StatsCollector,
+        max_retry_times: int = 3,
+        retry_codes: Iterable[str] = DEFAULT_RETRY_CODES,
+        backoff_codes: Iterable[str] = DEFAULT_RETRY_BACKOFF_CODES,
+        backoff_base: float = 1.0,
+        backoff_max: float = 60.0,
+        budget_ratio: float = 0.2,
+        budget_min: int = 10,
+    ) -> None:
+        self.stats = stats
+        self.max_retry_times = max_retry_times
+        self.retry_codes = frozenset(retry_codes)
+        self.backoff_codes = frozenset(backoff_codes)
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.budget_ratio = budget_ratio
+        self.budget_min = budget_min
+
+    def classify(self, error: str) -> RetryAction:
+        if error in self.retry_codes:
+            return RetryAction.Now
+        if error in self.backoff_codes:
+            return RetryAction.Backoff
+        return RetryAction.GiveUp
+
+    def get_delay(self, retry_times: int) -> float:
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** retry_times))
+
+    def _budget_available(self) -> bool:
+        retry_count = self.stats.get_value("crawlera_fetch/retry/count", 0)
+        request_count = self.stats.get_value("crawlera_fetch/request_count", 0)
+        return retry_count < self.budget_ratio * request_count + self.budget_min
+
+    def get_retry_delay(
+        self,
+        error: str,
+        retry_times: int,
+        latency: float,
+        max_retry_times: Optional[int] = None,
+    ) -> Optional[float]:
+        """
+        Return the number of seconds to wait before retrying a request which failed
+        with the given error after having been retried "retry_times" times, or None
+        if it should not be retried. Update the retry stats accordingly.
+        """
+        action = self.classify(error)
+        if action == RetryAction.GiveUp:
+            return None
+        if max_retry_times is None:
+            max_retry_times = self.max_retry_times
+        if retry_times >= max_retry_times:
+            self.stats.inc_value("crawlera_fetch/retry/max_reached")
+            return None
+        if not self._budget_available():
+            self.stats.inc_value("crawlera_fetch/retry/budget_exhausted")
+            return None
+
+        delay = self.get_delay(retry_times) if action == RetryAction.Backoff else 0.0
+        self.stats.inc_value("crawlera_fetch/retry/count")
+        self.stats.inc_value("crawlera_fetch/retry/reason/{}".format(error))
+        self.stats.inc_value("crawlera_fetch/retry/wasted_latency", latency)
+        if delay:
+            self.stats.inc_value("crawlera_fetch/retry/backoff_time", delay)
+        return delay
@@ -0,0 +1,102 @@
+from typing import Dict, Iterable, Optional
+
+from scrapy.statscollectors import StatsCollector
+
+
+DEFAULT_BACKOFF_CODES = (
+    "banned",
+    "noslaves",
+    "serverbusy",
+    "slavebanned",
+    "timeout",
+    "too_many_conns",
+    "user_session_limit",
+)
+
+
+class SlotState:
+    __slots__ = ("concurrency", "delay", "base_delay", "last_decrease")
+
+    def __init__(self, concurrency: int, delay: float) -> None:
+        self.concurrency = float(concurrency)
+        self.delay = delay
+        self.base_delay = delay
+        self.last_decrease = 0.0
+
+
+class AdaptiveConcurrency:
+    """
+    AIMD (additive increase, multiplicative decrease) controller for the concurrency
+    and delay of downloader slots, based on the latency and the errors reported by
+    the Fetch API for each response.
+
+    While responses arrive below the target latency and without errors, the slot
+    concurrency grows by about one request per round trip. Responses above the target
+    latency halve it, as well as responses with one of the back-off error codes, which
+    also double the slot delay. The concurrency is decreased at most once per round
+    trip, to avoid reacting many times to the same congestion episode.
+    """
+
+    def __init__(
+        self,
+        stats: StatsCollector,
+        target_latency: float,
+        min_concurrency: int = 1,
+        max_concurrency: int = 32,
+        max_delay: float = 60.0,
+        backoff_codes: Iterable[str] = DEFAULT_BACKOFF_CODES,
+    ) -> None:
+        self.stats = stats
+        self.target_latency = target_latency
+        self.min_concurrency = min_concurrency
+        self.max_concurrency = max_concurrency
+        self.max_delay = max_delay
+        self.backoff_codes = frozenset(backoff_codes)
+        self.slots = {}  # type: Dict[str, SlotState]
+
+    def update(self, key: str, slot, latency: float, error: Optional[str], now: float) -> None:
+        """
+        Adjust the "concurrency" and "delay" attributes of the given downloader slot
+        after receiving a response.
+        """
+        state = self.slots.get(key)
+        if state is None:
+            state = self.slots[key] = SlotState(slot.concurrency, slot.delay)
+
+        if error in self.backoff_codes:
+            reason = error  # type: Optional[str]
+        elif latency > self.target_latency:
+            reason = "latency"
+        else:
+            reason = None
+
+        previous = int(state.concurrency)
+        if reason is None:
+            increased = state.concurrency + 1 / state.concurrency
+            state.concurrency = min(self.max_concurrency, increased)
+            state.delay = max(state.base_delay, state.delay * 0.9)
+            if int(state.concurrency) > previous:
+                self.stats.inc_value("crawlera_fetch/throttle/increase")
+        elif now - state.last_decrease >= latency:
+            state.last_decrease = now
+            state.concurrency = max(self.min_concurrency, state.concurrency / 2)
+            if reason != "latency":
+                state.delay = min(self.max_delay, max(state.delay * 2, 0.5))
+            self.stats.inc_value("crawlera_fetch/throttle/decrease")
+            self.stats.inc_value("crawlera_fetch/throttle/decrease/{}".format(reason))
+
+        slot.concurrency = int(state.concurrency)
+        slot.delay = state.delay
+
+    def prune(self, active_keys: Iterable[str]) -> None:
+        """Forget the state of the slots which are no longer used by the downloader"""
+        active_keys = set(active_keys)
+        for key in list(self.slots):
+            if key not in active_keys:
+                del self.slots[key]
+
+    def set_stats(self) -> None:
+        if self.slots:
+            concurrency = [int(state.concurrency) for state in self.slots.values()]
+            self.stats.set_value("crawlera_fetch/throttle/min_concurrency", min(concurrency))
+            self.stats.set_value("crawlera_fetch/throttle/max_concurrency", max(concurrency))
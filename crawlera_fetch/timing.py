@@ -0,0 +1,54 @@
+from typing import Dict
+
+from scrapy.statscollectors import StatsCollector
+
+from .histogram import LatencyHistogram
+
+
+# Phases of a Fetch API request, in seconds:
+#   queue: from process_request until the download starts (downloader slot queue)
+#   wire: from the start of the download until the response headers are received
+#   transfer: from the response headers until the response body is received
+#   api: processing time reported by the Fetch API (part of "wire")
+#   decode: middleware time spent decoding the response (decompression, JSON, base64)
+TIMING_PHASES = ("queue", "wire", "transfer", "api", "decode")
+
+
+def parse_server_timing(value: str) -> Dict[str, float]:
+    """
+    Parse a Server-Timing header ("total;dur=123.4, render;dur=100;desc=...") into a dict
+    mapping each metric to its duration in seconds (metrics without duration are ignored)
+    """
+    durations = {}
+    for metric in value.split(","):
+        name, _, params = metric.partition(";")
+        for param in params.split(";"):
+            key, _, param_value = param.partition("=")
+            if key.strip().lower() != "dur":
+                continue
+            try:
+                durations[name.strip()] = float(param_value.strip().strip('"')) / 1000
+            except ValueError:
+                pass
+            break
+    return durations
+
+
+class TimingStats:
+    """Histograms of the time spent by requests in each phase (see TIMING_PHASES)"""
+
+    def __init__(self) -> None:
+        self.histograms = {phase: LatencyHistogram() for phase in TIMING_PHASES}
+
+    def add(self, phase: str, seconds: float) -> None:
+        self.histograms[phase].add(seconds)
+
+    def set_stats(self, stats: StatsCollector, prefix: str = "crawlera_fetch/timing") -> None:
+        for phase, histogram in self.histograms.items():
+            if not histogram.count:
+                continue
+            key = "{}/{}/".format(prefix, phase)
+            stats.set_value(key + "total_latency", histogram.total)
+            stats.set_value(key + "avg_latency", histogram.total / histogram.count)
+            for name, latency in histogram.named_percentiles().items():
+                stats.set_value(key + "latency_" + name, latency)
@@ -0,0 +1,125 @@
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, List, Optional, Tuple
+
+
+class _Bucket:
+    """Tracked keys with the same count, in order of arrival, linked by increasing count"""
+
+    __slots__ = ("count", "keys", "prev", "next")
+
+    def __init__(self, count: int) -> None:
+        self.count = count
+        self.keys = OrderedDict()  # type: Dict[Hashable, None]
+        self.prev = None  # type: Optional[_Bucket]
+        self.next = None  # type: Optional[_Bucket]
+
+
+class SpaceSaving:
+    """
+    Approximate top-K counter with bounded memory (Metwally et al. "space-saving").
+
+    At most "capacity" keys are tracked. When a new key arrives and the counter is
+    full, the key with the lowest count is evicted and the new one takes its place,
+    inheriting its count: counts are overestimated by at most the "error" reported
+    for each key. Optionally, each tracked key has some data attached, created with
+    "factory" and discarded upon eviction.
+
+    Keys are grouped in buckets of equal count, in a linked list sorted by count (the
+    "stream-summary" of the paper), so that evicting a key and increasing a count by one
+    are O(1). Increasing a count by n is O(n) at most.
+    """
+
+    __slots__ = ("capacity", "factory", "entries", "evicted", "head")
+
+    def __init__(self, capacity: int, factory: Optional[Callable[[], Any]] = None) -> None:
+        self.capacity = capacity
+        self.factory = factory
+        # key -> [count, error, data, bucket]
+        self.entries = {}  # type: Dict[Hashable, list]
+        self.evicted = 0
+        self.head = None  # type: Optional[_Bucket]
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self.entries
+
+    def add(self, key: Hashable, count: int = 1) -> Any:
+        """
+        Increase the count for the given key and return its attached data,
+        or None if the key cannot be tracked (zero capacity).
+        """
+        try:
+            entry = self.entries[key]
+        except KeyError:
+            if self.capacity <= 0:
+                return None
+            error = 0
+            if len(self.entries) >= self.capacity:
+                error = self._evict()
+            data = self.factory() if self.factory is not None else None
+            entry = self.entries[key] = [error, error, data, None]
+        self._increment(key, entry, count)
+        return entry[2]
+
+    def _evict(self) -> int:
+        """Stop tracking the oldest key with the lowest count, and return its count"""
+        bucket = self.head
+        min_key = next(iter(bucket.keys))
+        self._remove(min_key, bucket)
+        self.evicted += 1
+        return self.entries.pop(min_key)[0]
+
+    def _increment(self, key: Hashable, entry: list, count: int) -> None:
+        bucket = entry[3]
+        new_count = entry[0] + count
+        if bucket is not None and bucket.count == new_count:
+            return
+        if bucket is None:
+            prev, node = None, self.head
+        else:
+            prev, node = bucket, bucket.next
+        while node is not None and node.count < new_count:
+            prev, node = node, node.next
+        if node is None or node.count != new_count:
+            node, node.next = _Bucket(new_count), node
+            node.prev = prev
+            if node.next is not None:
+                node.next.prev = node
+            if prev is not None:
+                prev.next = node
+            else:
+                self.head = node
+        node.keys[key] = None
+        entry[0], entry[3] = new_count, node
+        if bucket is not None:
+            self._remove(key, bucket)
+
+    def _remove(self, key: Hashable, bucket: _Bucket) -> None:
+        del bucket.keys[key]
+        if bucket.keys:
+            return
+        if bucket.prev is not None:
+            bucket.prev.next = bucket.next
+        else:
+            self.head = bucket.next
+        if bucket.next is not None:
+            bucket.next.prev = bucket.prev
+
+    def get(self, key: Hashable) -> Any:
+        """Return the data attached to the given key, or None if it is not tracked"""
+        entry = self.entries.get(key)
+        return entry[2] if entry is not None else None
+
+    def count(self, key: Hashable) -> int:
+        entry = self.entries.get(key)
+        return entry[0] if entry is not None else 0
+
+    def top(self, k: Optional[int] = None) -> List[Tuple[Hashable, int, int, Any]]:
+        """
+        Return a list of (key, count, error, data) tuples for the tracked keys,
+        sorted by descending count.
+        """
+        items = sorted(self.entries.items(), key=lambda item: item[1][0], reverse=True)
+        return [(key, entry[0], entry[1], entry[2]) for key, entry in items[:k]]
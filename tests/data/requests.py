@@ -4,10 +4,19 @@ from scrapy import Request, FormRequest
 from scrapy.utils.reqser import request_to_dict
 from w3lib.http import basic_auth_header
 
+from crawlera_fetch.compression import DEFAULT_ENCODINGS, available_encodings
+
 from tests.data import SETTINGS
 from tests.utils import foo_spider, mocked_time
 
 
+ACCEPT_ENCODING = ", ".join(available_encodings(DEFAULT_ENCODINGS))
+
+# envelope size limits for the default DOWNLOAD_MAXSIZE (1 GB) and DOWNLOAD_WARNSIZE (32 MB)
+ENVELOPE_MAXSIZE = 3 * 1024 * 1024 * 1024 + 1024 * 1024
+ENVELOPE_WARNSIZE = 3 * 32 * 1024 * 1024 + 1024 * 1024
+
+
 def get_test_requests():
     test_requests = []
 
@@ -35,6 +44,7 @@ def get_test_requests():
             ),
             "Content-Type": "application/json",
             "Accept": "application/json",
+            "Accept-Encoding": ACCEPT_ENCODING,
             "X-Crawlera-JobId": "1/2/3",
         },
         meta={
@@ -49,6 +59,8 @@ def get_test_requests():
                 "timing": {"start_ts": mocked_time()},
             },
             "download_slot": "httpbin.org",
+            "download_maxsize": ENVELOPE_MAXSIZE,
+            "download_warnsize": ENVELOPE_WARNSIZE,
         },
         body=json.dumps(
             {
@@ -84,6 +96,7 @@ def get_test_requests():
             ),
             "Content-Type": "application/json",
             "Accept": "application/json",
+            "Accept-Encoding": ACCEPT_ENCODING,
             "X-Crawlera-JobId": "1/2/3",
         },
         meta={
@@ -93,6 +106,8 @@ def get_test_requests():
                 "timing": {"start_ts": mocked_time()},
             },
             "download_slot": "httpbin.org",
+            "download_maxsize": ENVELOPE_MAXSIZE,
+            "download_warnsize": ENVELOPE_WARNSIZE,
         },
         body=json.dumps(
             {
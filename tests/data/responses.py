@@ -210,3 +210,84 @@ test_responses.append(
         ),
     }
 )
+
+# "body_encoding" is honoured, plain bodies which look like base64 are not decoded
+test_responses.append(
+    {
+        "original": HtmlResponse(
+            url=SETTINGS["CRAWLERA_FETCH_URL"],
+            status=200,
+            headers={
+                "Content-Type": "application/json",
+                "Date": "Fri, 24 Apr 2020 18:22:10 GMT",
+            },
+            request=Request(
+                url=SETTINGS["CRAWLERA_FETCH_URL"],
+                meta={
+                    "crawlera_fetch": {
+                        "timing": {"start_ts": mocked_time()},
+                        "original_request": request_to_dict(
+                            Request("http://httpbin.org/base64/Zm9vYmFy"),
+                            spider=foo_spider,
+                        ),
+                    }
+                },
+            ),
+            body=json.dumps(
+                {
+                    "body": "Zm9vYmFy",
+                    "body_encoding": "plain",
+                    "original_status": 200,
+                    "url": "http://httpbin.org/base64/Zm9vYmFy",
+                    "headers": {"Content-Type": "text/plain"},
+                }
+            ).encode(),
+        ),
+        "expected": TextResponse(
+            url="http://httpbin.org/base64/Zm9vYmFy",
+            status=200,
+            headers={"content-type": "text/plain"},
+            body=b"Zm9vYmFy",
+        ),
+    }
+)
+
+test_responses.append(
+    {
+        "original": HtmlResponse(
+            url=SETTINGS["CRAWLERA_FETCH_URL"],
+            status=200,
+            headers={
+                "Content-Type": "application/json",
+                "Date": "Fri, 24 Apr 2020 18:22:10 GMT",
+            },
+            request=Request(
+                url=SETTINGS["CRAWLERA_FETCH_URL"],
+                meta={
+                    "crawlera_fetch": {
+                        "timing": {"start_ts": mocked_time()},
+                        "original_request": request_to_dict(
+                            Request("http://httpbin.org/ip"),
+                            spider=foo_spider,
+                        ),
+                    }
+                },
+            ),
+            body=json.dumps(
+                {
+                    "body": base64.b64encode(response_body_test).decode(),
+                    "body_encoding": "base64",
+                    "original_status": 200,
+                    "url": "http://httpbin.org/ip",
+                    "headers": {"Content-Type": "text/html"},
+                }
+            ).encode(),
+        ),
+        "expected": HtmlResponse(
+            url="http://httpbin.org/ip",
+            status=200,
+            headers={"content-type": "text/html"},
+            body=response_body_test,
+        ),
+    }
+)
@@ -0,0 +1,76 @@
+import json
+from unittest.mock import patch
+
+from scrapy import Request
+from scrapy.http.response.text import TextResponse
+from scrapy.statscollectors import MemoryStatsCollector
+from scrapy.utils.test import get_crawler
+from twisted.internet.defer import Deferred
+from w3lib.http import basic_auth_header
+
+from crawlera_fetch.apikeys import ApiKeyPool
+
+from tests.utils import foo_spider, get_test_middleware
+
+
+def get_pool(**kwargs):
+    stats = MemoryStatsCollector(get_crawler())
+    return ApiKeyPool(["key-a", "key-b"], stats, password="pass", **kwargs)
+
+
+def test_apikey_pool():
+    pool = get_pool(max_concurrency=2)
+    assert pool.keys[0].auth_header == basic_auth_header("key-a", "pass")
+    acquired = [pool.acquire(now=0) for _ in range(5)]
+    assert [apikey.key for apikey in acquired[:4]] == ["key-a", "key-b", "key-a", "key-b"]
+    assert acquired[4] is None
+
+    pool.release(1, error=False, now=0)
+    assert pool.acquire(now=0).key == "key-b"
+    assert pool.stats.get_value("crawlera_fetch/apikey/1/request_count") == 3
+
+
+def test_apikey_pool_rotation():
+    pool = get_pool(cooldown=60)
+    pool.acquire(now=0)
+    pool.release(0, error=True, now=0)
+    assert [pool.acquire(now=10).key for _ in range(3)] == ["key-b"] * 3
+    # all the keys are out of rotation
+    pool.release(1, error=True, now=10)
+    assert pool.acquire(now=20).key == "key-a"
+    assert pool.acquire(now=61).key == "key-a"
+    assert pool.stats.get_value("crawlera_fetch/apikey/0/disabled") == 1
+    assert pool.stats.get_value("crawlera_fetch/apikey/1/error_count") == 1
+
+
+def call_now(delay, func, *args, **kwargs):
+    func(*args, **kwargs)
+
+
+@patch("twisted.internet.reactor.callLater", call_now)
+def test_apikey_pool_middleware():
+    middleware = get_test_middleware(
+        settings={
+            "CRAWLERA_FETCH_APIKEY": None,
+            "CRAWLERA_FETCH_APIKEYS": ["key-a", "key-b"],
+            "CRAWLERA_FETCH_APIKEY_MAX_CONCURRENCY": 1,
+        }
+    )
+    assert middleware.enabled
+    first = middleware.process_request(Request("https://example.org/1"), foo_spider)
+    second = middleware.process_request(Request("https://example.org/2"), foo_spider)
+    assert first.headers["Authorization"] == basic_auth_header("key-a", "secret-pass")
+    assert second.headers["Authorization"] == basic_auth_header("key-b", "secret-pass")
+
+    waiting = middleware.process_request(Request("https://example.org/3"), foo_spider)
+    assert isinstance(waiting, Deferred)
+    assert middleware.stats.get_value("crawlera_fetch/apikey/waiting") == 1
+
+    payload = {"url": "https://example.org/1", "original_status": 200, "headers": {}, "body": ""}
+    response = TextResponse(url=first.url, request=first, body=json.dumps(payload).encode())
+    middleware.process_response(first, response, foo_spider)
+
+    results = []
+    waiting.addCallback(results.append)
+    assert results[0].headers["Authorization"] == basic_auth_header("key-a", "secret-pass")
+    assert results[0].meta["crawlera_fetch"]["original_request"]["url"] == "https://example.org/3"
@@ -0,0 +1,118 @@
+import base64
+import json
+import mmap
+
+import pytest
+from scrapy import Request
+from scrapy.exceptions import IgnoreRequest
+from scrapy.http.response.html import HtmlResponse
+from scrapy.http.response.text import TextResponse
+
+from crawlera_fetch.middleware import _spill_body
+
+from tests.utils import foo_spider, get_test_middleware
+
+
+def get_response(request, body, **payload_updates):
+    payload = {
+        "url": "https://example.org",
+        "original_status": 200,
+        "headers": {"Content-Type": "text/html"},
+        "body_encoding": "base64",
+        "body": base64.b64encode(body).decode("ascii"),
+    }
+    payload.update(payload_updates)
+    return TextResponse(url=request.url, request=request, body=json.dumps(payload).encode())
+
+
+def test_fetch_request_size_limits():
+    middleware = get_test_middleware(
+        settings={"CRAWLERA_FETCH_MAX_BODY_SIZE": 1000, "CRAWLERA_FETCH_WARN_BODY_SIZE": 0}
+    )
+    request = middleware.process_request(Request("https://example.org"), foo_spider)
+    assert request.meta["download_maxsize"] == 3000 + 1024 * 1024
+    assert request.meta["download_warnsize"] == 0
+
+    original = Request("https://example.org", meta={"download_maxsize": 10})
+    request = middleware.process_request(original, foo_spider)
+    assert request.meta["download_maxsize"] == 30 + 1024 * 1024
+    assert original.meta["download_maxsize"] == 10
+
+
+def test_max_body_size():
+    middleware = get_test_middleware(
+        settings={"CRAWLERA_FETCH_MAX_BODY_SIZE": 100, "CRAWLERA_FETCH_WARN_BODY_SIZE": 10}
+    )
+    request = middleware.process_request(Request("https://example.org"), foo_spider)
+    processed = middleware.process_response(request, get_response(request, b"x" * 50), foo_spider)
+    assert processed.body == b"x" * 50
+
+    request = middleware.process_request(Request("https://example.org"), foo_spider)
+    with pytest.raises(IgnoreRequest):
+        middleware.process_response(request, get_response(request, b"x" * 101), foo_spider)
+
+    # per-request limits
+    original = Request("https://example.org", meta={"download_maxsize": 200})
+    request = middleware.process_request(original, foo_spider)
+    processed = middleware.process_response(request, get_response(request, b"x" * 101), foo_spider)
+    assert processed.body == b"x" * 101
+
+    assert middleware.stats.get_value("crawlera_fetch/body_size/dropped") == 1
+    assert middleware.stats.get_value("crawlera_fetch/body_size/warning") == 2
+    assert middleware.stats.get_value("crawlera_fetch/body_size/max") == 101
+
+
+def test_spill_body(tmpdir):
+    middleware = get_test_middleware(
+        settings={
+            "CRAWLERA_FETCH_SPILL_BODY_SIZE": 100,
+            "CRAWLERA_FETCH_SPILL_DIR": str(tmpdir),
+            "CRAWLERA_FETCH_MAX_BODY_SIZE": 1000,
+        }
+    )
+    request = middleware.process_request(Request("https://example.org"), foo_spider)
+    processed = middleware.process_response(request, get_response(request, b"<html>"), foo_spider)
+    assert processed.body == b"<html>"
+    assert "body_buffer" not in processed.meta["crawlera_fetch"]
+
+    body = b"<html>" + b"foo" * 100 + b"</html>"
+    request = middleware.process_request(Request("https://example.org"), foo_spider)
+    processed = middleware.process_response(request, get_response(request, body), foo_spider)
+    assert isinstance(processed, HtmlResponse)
+    assert processed.body == b""
+    buffer = processed.meta["crawlera_fetch"]["body_buffer"]
+    assert isinstance(buffer, mmap.mmap)
+    assert buffer[:] == body
+    upstream_body = processed.meta["crawlera_fetch"]["upstream_response"]["body"]
+    assert upstream_body["body"] == base64.b64encode(body).decode("ascii")
+    # the temporary file is not visible in the directory
+    assert tmpdir.listdir() == []
+
+    request = middleware.process_request(Request("https://example.org"), foo_spider)
+    with pytest.raises(IgnoreRequest):
+        middleware.process_response(request, get_response(request, b"x" * 1001), foo_spider)
+
+    assert middleware.stats.get_value("crawlera_fetch/body_size/spilled") == 1
+    assert middleware.stats.get_value("crawlera_fetch/body_size/spilled_bytes") == len(body)
+
+
+def test_spill_body_encodings():
+    body = bytes(range(256)) * 10
+    for body_encoding in ("base64", None):
+        buffer, encoding = _spill_body(
+            {"body": base64.b64encode(body).decode("ascii"), "body_encoding": body_encoding}
+        )
+        assert buffer[:] == body
+        assert encoding == "base64"
+
+    # line breaks in base64 bodies
+    buffer, encoding = _spill_body({"body": "aGVsbG8g\nd29ybGQ=", "body_encoding": "base64"})
+    assert (buffer[:], encoding) == (b"hello world", "base64")
+
+    text = "<html>é</html>" * 1000
+    for body_encoding in ("plain", None):
+        buffer, encoding = _spill_body({"body": text, "body_encoding": body_encoding})
+        assert buffer[:] == text.encode("utf8")
+        assert encoding == "plain"
+
+    assert _spill_body({"body": "", "body_encoding": "plain"}) == (b"", "plain")
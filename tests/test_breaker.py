@@ -0,0 +1,113 @@
+import json
+from unittest.mock import patch
+
+from scrapy import Request
+from scrapy.http.response.text import TextResponse
+from scrapy.statscollectors import MemoryStatsCollector
+from scrapy.utils.test import get_crawler
+from twisted.internet.defer import Deferred
+
+from crawlera_fetch.breaker import BreakerState, CircuitBreaker
+
+from tests.utils import foo_spider, get_test_middleware
+
+
+def get_breaker(**kwargs):
+    stats = MemoryStatsCollector(get_crawler())
+    return CircuitBreaker(stats=stats, window=10, min_requests=4, open_time=30, **kwargs)
+
+
+def test_breaker_opens():
+    breaker = get_breaker()
+    for now in range(20):
+        breaker.record(success=now % 2 == 0, now=now)  # 50% in the last 10 seconds
+    assert breaker.state == BreakerState.Open
+    assert not breaker.allow_request(25)
+    assert breaker.retry_after(25) == 30 - (25 - 3)
+
+
+def test_breaker_sliding_window():
+    breaker = get_breaker(failure_ratio=0.5)
+    for now in range(3):
+        breaker.record(success=False, now=now)
+    for now in range(20, 30):
+        breaker.record(success=True, now=now)
+    # the failures are outside of the window
+    breaker.record(success=False, now=30)
+    assert breaker.state == BreakerState.Closed
+    assert breaker.total == 10
+
+
+def test_breaker_half_open():
+    breaker = get_breaker(probes=2)
+    for now in range(4):
+        breaker.record(success=False, now=100)
+    assert breaker.state == BreakerState.Open
+
+    assert breaker.allow_request(130)
+    assert breaker.state == BreakerState.HalfOpen
+    assert breaker.allow_request(130)
+    assert not breaker.allow_request(130)
+
+    # outcome of requests sent before opening are ignored
+    breaker.record(success=False, now=131)
+    breaker.record(success=True, now=131, probe=True)
+    assert breaker.state == BreakerState.HalfOpen
+    breaker.record(success=False, now=132, probe=True)
+    assert breaker.state == BreakerState.Open
+
+    assert breaker.allow_request(162)
+    assert breaker.allow_request(162)
+    breaker.record(success=True, now=163, probe=True)
+    breaker.record(success=True, now=163, probe=True)
+    assert breaker.state == BreakerState.Closed
+    assert breaker.allow_request(163)
+
+    assert breaker.stats.get_value("crawlera_fetch/breaker/open_time") == 63
+    assert breaker.stats.get_value("crawlera_fetch/breaker/state_change/open") == 2
+    assert breaker.stats.get_value("crawlera_fetch/breaker/state_change/half_open") == 2
+    assert breaker.stats.get_value("crawlera_fetch/breaker/state_change/closed") == 1
+
+
+def call_now(delay, func, *args, **kwargs):
+    func(*args, **kwargs)
+
+
+@patch("twisted.internet.reactor.callLater", call_now)
+def test_breaker_middleware():
+    middleware = get_test_middleware(
+        settings={
+            "CRAWLERA_FETCH_BREAKER_ENABLED": True,
+            "CRAWLERA_FETCH_BREAKER_MIN_REQUESTS": 2,
+            "CRAWLERA_FETCH_RAISE_ON_ERROR": False,
+        }
+    )
+    payload = {"url": "https://example.org", "crawlera_error": "serverbusy", "body": "busy"}
+    body = json.dumps(payload).encode()
+    for _ in range(2):
+        request = middleware.process_request(Request("https://example.org"), foo_spider)
+        response = TextResponse(url=request.url, request=request, body=body)
+        middleware.process_response(request, response, foo_spider)
+    assert middleware.breaker.state == BreakerState.Open
+
+    held = middleware.process_request(Request("https://example.org/held"), foo_spider)
+    assert isinstance(held, Deferred)
+    assert middleware.stats.get_value("crawlera_fetch/breaker/held") == 1
+    # callLater is patched, the request is released without waiting for the breaker
+    results = []
+    held.addCallback(results.append)
+    assert results[0].url == "https://example.org/held"
+    assert results[0].dont_filter
+
+    middleware.breaker.changed_at -= 30
+    probe = middleware.process_request(results[0], foo_spider)
+    assert probe.meta["crawlera_fetch"]["breaker_probe"]
+    payload = {
+        "url": "https://example.org/held",
+        "original_status": 200,
+        "headers": {},
+        "body": "foo",
+    }
+    response = TextResponse(url=probe.url, request=probe, body=json.dumps(payload).encode())
+    middleware.process_response(probe, response, foo_spider)
+    assert middleware.breaker.state == BreakerState.Closed
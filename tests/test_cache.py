@@ -0,0 +1,114 @@
+import json
+import os
+import time
+from unittest.mock import patch
+
+from scrapy import Request
+from scrapy.http.response.html import HtmlResponse
+from scrapy.http.response.text import TextResponse
+from scrapy.statscollectors import MemoryStatsCollector
+from scrapy.utils.test import get_crawler
+
+from crawlera_fetch.cache import FetchCache, cache_key
+
+from tests.utils import foo_spider, get_test_middleware
+
+
+def test_cache_key():
+    key = cache_key("https://example.org", "GET", "", {"render": "no"}, ignore_args=["job_id"])
+    same = cache_key(
+        "https://example.org", "GET", "", {"job_id": "1/2/3", "render": "no"}, ["job_id"]
+    )
+    assert key == same
+    assert key != cache_key("https://example.org", "GET", "", {"render": "yes"}, ["job_id"])
+    assert key != cache_key("https://example.org", "POST", "", {"render": "no"}, ["job_id"])
+
+
+def test_cache_store_get(tmpdir):
+    stats = MemoryStatsCollector(get_crawler())
+    cache = FetchCache(str(tmpdir), stats)
+    assert cache.get("a" * 40) is None
+    cache.store("a" * 40, "https://example.org", 200, {"Content-Type": "text/html"}, b"<html>")
+    cached = cache.get("a" * 40)
+    assert cached.url == "https://example.org"
+    assert cached.status == 200
+    assert cached.headers == {"Content-Type": "text/html"}
+    assert cached.body == b"<html>"
+
+    # the index is rebuilt from disk
+    cache = FetchCache(str(tmpdir), stats)
+    assert cache.get("a" * 40).body == b"<html>"
+    assert stats.get_value("crawlera_fetch/cache/hit") == 2
+    assert stats.get_value("crawlera_fetch/cache/miss") == 1
+    assert stats.get_value("crawlera_fetch/cache/store") == 1
+
+
+def test_cache_lru_eviction(tmpdir):
+    stats = MemoryStatsCollector(get_crawler())
+    cache = FetchCache(str(tmpdir), stats, max_size=400)
+    for key in ["a", "b", "c"]:
+        cache.store(key * 40, "https://example.org", 200, {}, b"x" * 50)
+    cache.get("a" * 40)
+    cache.store("d" * 40, "https://example.org", 200, {}, b"x" * 50)
+    assert cache.size <= 400
+    assert cache.get("b" * 40) is None
+    assert cache.get("a" * 40) is not None
+    assert cache.get("d" * 40) is not None
+    assert not os.path.exists(os.path.join(str(tmpdir), "bb", "b" * 40))
+    assert stats.get_value("crawlera_fetch/cache/evicted") >= 1
+
+
+def test_cache_ttl(tmpdir):
+    stats = MemoryStatsCollector(get_crawler())
+    cache = FetchCache(str(tmpdir), stats, ttl=10)
+    cache.store("a" * 40, "https://example.org", 200, {}, b"foo")
+    cache.store("b" * 40, "https://example.org", 200, {}, b"foo", ttl=0)
+    with patch("time.time", return_value=time.time() + 20):
+        assert cache.get("a" * 40) is None
+        assert cache.get("b" * 40) is not None
+    assert stats.get_value("crawlera_fetch/cache/expired") == 1
+
+
+def test_cache_middleware(tmpdir):
+    settings = {"CRAWLERA_FETCH_CACHE_ENABLED": True, "CRAWLERA_FETCH_CACHE_DIR": str(tmpdir)}
+    middleware = get_test_middleware(settings=settings)
+    url = "https://example.org/page"  # not the Fetch API URL
+
+    request = Request(url, meta={"crawlera_fetch": {"args": {"render": "no"}}})
+    processed = middleware.process_request(request, foo_spider)
+    assert processed.method == "POST"
+    assert processed.meta["crawlera_fetch"]["cache_key"]
+    assert middleware.stats.get_value("crawlera_fetch/cache/miss") == 1
+    response = TextResponse(
+        url=processed.url,
+        request=processed,
+        body=json.dumps(
+            {
+                "url": url,
+                "original_status": 200,
+                "headers": {"Content-Type": "text/html"},
+                "body_encoding": "plain",
+                "body": "<html>foo</html>",
+            }
+        ).encode(),
+    )
+    middleware.process_response(processed, response, foo_spider)
+
+    # same payload, different job
+    with patch.dict(os.environ, {"SHUB_JOBKEY": "4/5/6"}):
+        middleware = get_test_middleware(settings=settings)
+    request = Request(url, meta={"crawlera_fetch": {"args": {"render": "no"}}})
+    cached = middleware.process_request(request, foo_spider)
+    assert isinstance(cached, HtmlResponse)
+    assert cached.url == url
+    assert cached.body == b"<html>foo</html>"
+    assert cached.request is request
+    assert "crawlera_fetch_cache" in cached.flags
+    assert middleware.process_response(request, cached, foo_spider) is cached
+    assert middleware.stats.get_value("crawlera_fetch/cache/hit") == 1
+    assert middleware.stats.get_value("crawlera_fetch/request_count") is None
+
+    other = Request(url, meta={"crawlera_fetch": {"args": {"render": "yes"}}})
+    assert isinstance(middleware.process_request(other, foo_spider), Request)
+    dont_cache = Request(url, meta={"dont_cache": True})
+    assert isinstance(middleware.process_request(dont_cache, foo_spider), Request)
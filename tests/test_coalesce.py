@@ -0,0 +1,100 @@
+import json
+from unittest.mock import patch
+
+import pytest
+from scrapy import Request
+from scrapy.http.response.text import TextResponse
+from twisted.internet.defer import Deferred
+
+from crawlera_fetch.middleware import CrawleraFetchException
+
+from tests.utils import foo_spider, get_test_middleware
+
+
+def call_now(delay, func, *args, **kwargs):
+    return func(*args, **kwargs)
+
+
+def get_response(request, **kwargs):
+    payload = {
+        "url": "https://example.org",
+        "original_status": 200,
+        "headers": {"Content-Type": "text/html"},
+        "body_encoding": "plain",
+        "body": "<html>foo</html>",
+    }
+    payload.update(kwargs)
+    return TextResponse(url=request.url, request=request, body=json.dumps(payload).encode())
+
+
+def get_result(deferred):
+    results = []
+    deferred.addBoth(results.append)
+    return results[0]
+
+
+@patch("twisted.internet.reactor.callLater", call_now)
+def test_coalesce():
+    middleware = get_test_middleware(settings={"CRAWLERA_FETCH_COALESCE_ENABLED": True})
+
+    first = Request("https://example.org", meta={"crawlera_fetch": {"args": {"render": "no"}}})
+    second = Request(
+        "https://example.org",
+        callback=foo_spider.foo_callback,
+        meta={"foo": "bar", "crawlera_fetch": {"args": {"render": "no"}}},
+    )
+    other = Request("https://example.org", meta={"crawlera_fetch": {"args": {"render": "yes"}}})
+
+    processed = middleware.process_request(first, foo_spider)
+    assert isinstance(processed, Request)
+    waiting = middleware.process_request(second, foo_spider)
+    assert isinstance(waiting, Deferred)
+    assert isinstance(middleware.process_request(other, foo_spider), Request)
+
+    response = middleware.process_response(processed, get_response(processed), foo_spider)
+    assert response.body == b"<html>foo</html>"
+
+    coalesced = get_result(waiting)
+    assert coalesced.request is second
+    assert coalesced.body == b"<html>foo</html>"
+    assert coalesced.meta["foo"] == "bar"
+    assert "upstream_response" in coalesced.meta["crawlera_fetch"]
+    # coalesced responses are not processed again
+    assert middleware.process_response(second, coalesced, foo_spider) is coalesced
+
+    assert middleware.stats.get_value("crawlera_fetch/request_count") == 2
+    assert middleware.stats.get_value("crawlera_fetch/coalesced") == 1
+    assert len(middleware.in_flight) == 1  # "other" is still in flight
+
+
+@patch("twisted.internet.reactor.callLater", call_now)
+def test_coalesce_error():
+    middleware = get_test_middleware(settings={"CRAWLERA_FETCH_COALESCE_ENABLED": True})
+
+    processed = middleware.process_request(Request("https://example.org"), foo_spider)
+    waiting = middleware.process_request(Request("https://example.org"), foo_spider)
+    response = get_response(processed, crawlera_error="bad_uncork_url")
+    with pytest.raises(CrawleraFetchException):
+        middleware.process_response(processed, response, foo_spider)
+    failure = get_result(waiting)
+    assert failure.check(CrawleraFetchException)
+    assert not middleware.in_flight
+
+
+@patch("twisted.internet.reactor.callLater", call_now)
+def test_coalesce_exception():
+    middleware = get_test_middleware(settings={"CRAWLERA_FETCH_COALESCE_ENABLED": True})
+
+    processed = middleware.process_request(Request("https://example.org"), foo_spider)
+    waiting_request = Request("https://example.org", callback=foo_spider.foo_callback)
+    waiting = middleware.process_request(waiting_request, foo_spider)
+    middleware.process_exception(processed, ValueError(), foo_spider)
+
+    request = get_result(waiting)
+    assert isinstance(request, Request)
+    assert request.dont_filter
+    assert request.callback == foo_spider.foo_callback
+    assert not middleware.in_flight
+
+    # the request is downloaded on its own
+    assert isinstance(middleware.process_request(request, foo_spider), Request)
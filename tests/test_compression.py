@@ -0,0 +1,130 @@
+import gzip
+import json
+import zlib
+from unittest.mock import patch
+
+import pytest
+from scrapy import Request
+from scrapy.downloadermiddlewares.httpcompression import (
+    ACCEPTED_ENCODINGS,
+    HttpCompressionMiddleware,
+)
+from scrapy.http.response.text import TextResponse
+
+from crawlera_fetch.compression import available_encodings, compress, decompress
+from crawlera_fetch.logformatter import CrawleraFetchLogFormatter
+
+from tests.utils import foo_spider, get_test_middleware
+
+
+def test_decompress():
+    data = b"<html>" + b"foo" * 1000 + b"</html>"
+    assert decompress(gzip.compress(data), b"gzip") == data
+    assert decompress(zlib.compress(data), b"deflate") == data
+    assert decompress(zlib.compress(data)[2:-4], b"deflate") == data  # raw deflate
+    assert decompress(zlib.compress(gzip.compress(data)), b"gzip, Deflate") == data
+    assert decompress(data, b"identity") == data
+
+    with pytest.raises(ValueError):
+        decompress(data, b"unknown")
+    with pytest.raises(ValueError):
+        decompress(data, b"gzip")
+
+
+def test_available_encodings():
+    assert available_encodings(["GZIP", "foo", "deflate"]) == ["gzip", "deflate"]
+
+
+def test_process_response_compressed():
+    middleware = get_test_middleware()
+    request = middleware.process_request(Request("https://example.org"), foo_spider)
+    assert b"gzip" in request.headers["Accept-Encoding"]
+
+    payload = {
+        "url": "https://example.org",
+        "original_status": 200,
+        "headers": {"Content-Type": "text/html"},
+        "body_encoding": "plain",
+        "body": "<html>" + "foo" * 1000 + "</html>",
+    }
+    body = gzip.compress(json.dumps(payload).encode("utf8"))
+    response = TextResponse(
+        url=request.url, request=request, headers={"Content-Encoding": "gzip"}, body=body
+    )
+    processed = middleware.process_response(request, response, foo_spider)
+
+    assert processed.body == payload["body"].encode("utf8")
+    assert b"Content-Encoding" not in processed.headers
+    assert middleware.stats.get_value("crawlera_fetch/compression/compressed_bytes") == len(body)
+
+
+def test_process_request_compressed():
+    middleware = get_test_middleware(
+        settings={
+            "CRAWLERA_FETCH_COMPRESSION_ENCODINGS": [],
+            "CRAWLERA_FETCH_REQUEST_COMPRESSION_MIN_SIZE": 1000,
+        }
+    )
+    small = middleware.process_request(Request("https://example.org"), foo_spider)
+    assert b"Accept-Encoding" not in small.headers
+    assert b"Content-Encoding" not in small.headers
+
+    original = Request("https://example.org", method="POST", body=b"foo" * 1000)
+    large = middleware.process_request(original, foo_spider)
+    assert large.headers["Content-Encoding"] == b"gzip"
+    assert json.loads(gzip.decompress(large.body).decode("utf8"))["body"] == "foo" * 1000
+    assert middleware.stats.get_value("crawlera_fetch/compression/compressed_requests") == 1
+
+    logformatter = CrawleraFetchLogFormatter()
+    response = TextResponse(url=large.url, request=large, body=b"{}")
+    result = logformatter.crawled(large, response, foo_spider)
+    assert result["args"]["request"] == "<POST https://example.org>"
+
+
+def test_compress_roundtrip():
+    for encoding in available_encodings(["zstd", "br", "gzip", "deflate"]):
+        assert decompress(compress(b"foo" * 100, encoding), encoding.encode()) == b"foo" * 100
+
+
+@patch.dict("crawlera_fetch.compression.DECOMPRESSORS", {"zstd": bytes, "br": bytes})
+def test_accept_encodings_http_compression():
+    # HttpCompressionMiddleware removes the Content-Encoding header of the encodings
+    # it does not support, they are only accepted if it is disabled
+    accepted = [e for e in ["zstd", "br", "gzip"] if e.encode() in ACCEPTED_ENCODINGS]
+    middleware = get_test_middleware()
+    assert middleware.accept_encodings == accepted
+    request = middleware.process_request(Request("https://example.org"), foo_spider)
+    assert request.headers["Accept-Encoding"] == ", ".join(accepted).encode()
+
+    for settings in (
+        {"COMPRESSION_ENABLED": False},
+        {
+            "DOWNLOADER_MIDDLEWARES": {
+                "scrapy.downloadermiddlewares.httpcompression.HttpCompressionMiddleware": None
+            }
+        },
+    ):
+        middleware = get_test_middleware(settings=settings)
+        assert middleware.accept_encodings == ["zstd", "br", "gzip"]
+
+
+def test_process_response_http_compression():
+    middleware = get_test_middleware()
+    http_compression = HttpCompressionMiddleware.from_crawler(middleware.crawler)
+    request = middleware.process_request(Request("https://example.org"), foo_spider)
+    payload = {
+        "url": "https://example.org",
+        "original_status": 200,
+        "headers": {"Content-Type": "text/html"},
+        "body_encoding": "plain",
+        "body": "<html>" + "foo" * 1000 + "</html>",
+    }
+    for encoding in middleware.accept_encodings:
+        body = compress(json.dumps(payload).encode("utf8"), encoding)
+        response = TextResponse(
+            url=request.url, request=request, headers={"Content-Encoding": encoding}, body=body
+        )
+        response = http_compression.process_response(request, response, foo_spider)
+        processed = middleware.process_response(request, response, foo_spider)
+        assert processed.body == payload["body"].encode("utf8")
+    assert middleware.stats.get_value("crawlera_fetch/compression/error") is None
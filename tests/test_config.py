@@ -1,4 +1,8 @@
+from unittest.mock import patch
+
+import pytest
 from scrapy import Spider
+from scrapy.exceptions import NotConfigured
 from scrapy.utils.test import get_crawler
 
 from crawlera_fetch import CrawleraFetchMiddleware
@@ -101,3 +105,35 @@ def test_config_without_apipass():
     assert middleware.apikey == SETTINGS["CRAWLERA_FETCH_APIKEY"]
     assert middleware.url == SETTINGS["CRAWLERA_FETCH_URL"]
     assert middleware.apipass == ""
+
+
+@patch("scrapy.version_info", (1, 8, 0))
+def test_deferred_features_old_scrapy():
+    settings = SETTINGS.copy()
+    settings["CRAWLERA_FETCH_RETRY_ENABLED"] = True
+    with pytest.raises(NotConfigured, match="CRAWLERA_FETCH_RETRY_BACKOFF_CODES"):
+        CrawleraFetchMiddleware.from_crawler(get_crawler(settings_dict=settings))
+
+    settings["CRAWLERA_FETCH_RETRY_BACKOFF_CODES"] = []
+    CrawleraFetchMiddleware.from_crawler(get_crawler(settings_dict=settings))
+
+    settings["CRAWLERA_FETCH_COALESCE_ENABLED"] = True
+    with pytest.raises(NotConfigured, match="CRAWLERA_FETCH_COALESCE_ENABLED"):
+        CrawleraFetchMiddleware.from_crawler(get_crawler(settings_dict=settings))
+
+    settings["CRAWLERA_FETCH_BREAKER_ENABLED"] = True
+    with pytest.raises(NotConfigured, match="CRAWLERA_FETCH_BREAKER_ENABLED"):
+        CrawleraFetchMiddleware.from_crawler(get_crawler(settings_dict=settings))
+
+    settings["CRAWLERA_FETCH_RATE_LIMIT"] = 2.5
+    with pytest.raises(NotConfigured, match="CRAWLERA_FETCH_RATE_LIMIT"):
+        CrawleraFetchMiddleware.from_crawler(get_crawler(settings_dict=settings))
+
+    settings["CRAWLERA_FETCH_APIKEYS"] = ["key1", "key2"]
+    settings["CRAWLERA_FETCH_APIKEY_MAX_CONCURRENCY"] = 2
+    with pytest.raises(NotConfigured, match="CRAWLERA_FETCH_APIKEY_MAX_CONCURRENCY"):
+        CrawleraFetchMiddleware.from_crawler(get_crawler(settings_dict=settings))
+
+    settings["CRAWLERA_FETCH_DECODE_POOL_MIN_SIZE"] = 1000
+    with pytest.raises(NotConfigured, match="CRAWLERA_FETCH_DECODE_POOL_MIN_SIZE"):
+        CrawleraFetchMiddleware.from_crawler(get_crawler(settings_dict=settings))
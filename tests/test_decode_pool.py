@@ -0,0 +1,95 @@
+import base64
+import json
+from unittest.mock import patch
+
+from scrapy import Request
+from scrapy.http.response.html import HtmlResponse
+from scrapy.http.response.text import TextResponse
+from twisted.internet.defer import Deferred, maybeDeferred
+
+from tests.utils import foo_spider, get_test_middleware
+
+
+def defer_to_thread_pool(reactor, pool, func, *args, **kwargs):
+    return maybeDeferred(func, *args, **kwargs)
+
+
+def get_response(request, body, **payload_updates):
+    payload = {
+        "url": "https://example.org",
+        "original_status": 200,
+        "headers": {"Content-Type": "text/html"},
+        "body_encoding": "base64",
+        "body": base64.b64encode(body).decode("ascii"),
+    }
+    payload.update(payload_updates)
+    return TextResponse(url=request.url, request=request, body=json.dumps(payload).encode())
+
+
+@patch("crawlera_fetch.middleware.deferToThreadPool", defer_to_thread_pool)
+def test_decode_pool():
+    middleware = get_test_middleware(settings={"CRAWLERA_FETCH_DECODE_POOL_MIN_SIZE": 1000})
+    assert middleware.decode_pool.max == 2
+
+    # small responses are decoded inline
+    request = middleware.process_request(Request("https://example.org"), foo_spider)
+    processed = middleware.process_response(request, get_response(request, b"<html>"), foo_spider)
+    assert isinstance(processed, HtmlResponse)
+    assert processed.body == b"<html>"
+
+    body = b"<html>" + b"foo" * 1000 + b"</html>"
+    request = middleware.process_request(Request("https://example.org"), foo_spider)
+    deferred = middleware.process_response(request, get_response(request, body), foo_spider)
+    assert isinstance(deferred, Deferred)
+    results = []
+    deferred.addCallback(results.append)
+    assert isinstance(results[0], HtmlResponse)
+    assert results[0].body == body
+    assert results[0].request.url == "https://example.org"
+    assert request.meta["crawlera_fetch"]["timing"]["decode"] >= 0
+
+    middleware.spider_closed(foo_spider, "finished")
+    assert middleware.stats.get_value("crawlera_fetch/decode_pool/response_count") == 1
+    assert middleware.stats.get_value("crawlera_fetch/decode_pool/decode_time") >= 0
+    assert middleware.stats.get_value("crawlera_fetch/response_count") == 2
+
+
+@patch("crawlera_fetch.middleware.deferToThreadPool", defer_to_thread_pool)
+def test_decode_pool_errors():
+    settings = {"CRAWLERA_FETCH_DECODE_POOL_MIN_SIZE": 10, "CRAWLERA_FETCH_RAISE_ON_ERROR": False}
+    middleware = get_test_middleware(settings=settings)
+    request = middleware.process_request(Request("https://example.org"), foo_spider)
+    response = TextResponse(url=request.url, request=request, body=b"{" * 100)
+    results = []
+    middleware.process_response(request, response, foo_spider).addCallback(results.append)
+    assert results == [response]
+
+    request = middleware.process_request(Request("https://example.org"), foo_spider)
+    response = get_response(request, b"Banned" * 10, crawlera_error="banned")
+    results = []
+    middleware.process_response(request, response, foo_spider).addCallback(results.append)
+    assert results == [response]
+    assert middleware.stats.get_value("crawlera_fetch/response_error/JSONDecodeError") == 1
+    assert middleware.stats.get_value("crawlera_fetch/response_error/banned") == 1
+    middleware.spider_closed(foo_spider, "finished")
+
+
+@patch("time.time")
+@patch("crawlera_fetch.middleware.deferToThreadPool", defer_to_thread_pool)
+def test_decode_pool_retried_request(mocked_time):
+    middleware = get_test_middleware(settings={"CRAWLERA_FETCH_DECODE_POOL_MIN_SIZE": 1000})
+    for body in (b"<html>", b"<html>" + b"foo" * 1000 + b"</html>"):
+        mocked_time.return_value = 100  # start_ts
+        request = middleware.process_request(Request("https://example.org"), foo_spider)
+        mocked_time.return_value = 102  # end_ts
+        response = get_response(request, body)
+        maybeDeferred(middleware.process_response, request, response, foo_spider)
+        assert request.meta["crawlera_fetch"]["timing"]["latency"] == 2
+
+        # retried requests (e.g. by RetryMiddleware) share the meta of the first attempt
+        retried = request.copy()
+        assert middleware.process_request(retried, foo_spider) is None
+        mocked_time.return_value = 110  # end_ts
+        response = get_response(retried, body)
+        maybeDeferred(middleware.process_response, retried, response, foo_spider)
+        assert retried.meta["crawlera_fetch"]["timing"]["latency"] == 10
@@ -0,0 +1,88 @@
+import json
+
+from scrapy import Request
+from scrapy.http.response.text import TextResponse
+from scrapy.statscollectors import MemoryStatsCollector
+from scrapy.utils.test import get_crawler
+from twisted.internet.error import ConnectionRefusedError
+
+from crawlera_fetch.endpoints import EndpointPool, EndpointStrategy
+
+from tests.utils import foo_spider, get_test_middleware
+
+
+URLS = ["http://eu.fetch.example:8010/fetch/v2/", "http://us.fetch.example:8010/fetch/v2/"]
+
+
+def get_pool(**kwargs):
+    stats = MemoryStatsCollector(get_crawler())
+    return EndpointPool(URLS, stats, **kwargs)
+
+
+def test_round_robin():
+    pool = get_pool()
+    selected = [pool.select(now=0).url for _ in range(4)]
+    assert selected == URLS + URLS
+    assert pool.stats.get_value("crawlera_fetch/endpoint/eu.fetch.example:8010/request_count") == 2
+
+
+def test_least_outstanding():
+    pool = get_pool(strategy=EndpointStrategy.LeastOutstanding)
+    eu = pool.select(now=0)
+    us = pool.select(now=0)
+    assert (eu.url, us.url) == tuple(URLS)
+    pool.record(us, latency=1, error=False, now=1)
+    assert pool.select(now=1) is us
+
+
+def test_latency():
+    pool = get_pool(strategy=EndpointStrategy.Latency)
+    eu, us = pool.endpoints
+    for latency in (10, 12):
+        pool.select(now=0, exclude=[us.url])
+        pool.record(eu, latency=latency, error=False, now=0)
+    pool.select(now=0, exclude=[eu.url])
+    pool.record(us, latency=2, error=False, now=0)
+    assert eu.ewma == 10.6
+    assert pool.select(now=0) is us
+
+
+def test_unhealthy():
+    pool = get_pool(max_errors=2, cooldown=30)
+    eu, us = pool.endpoints
+    for _ in range(2):
+        pool.record(eu, latency=1, error=True, now=100)
+    assert [pool.select(now=110).url for _ in range(2)] == [us.url, us.url]
+    assert pool.select(now=130, exclude=[us.url]) is eu
+    assert pool.stats.get_value("crawlera_fetch/endpoint/eu.fetch.example:8010/unhealthy") == 1
+
+
+def test_failover():
+    middleware = get_test_middleware(
+        settings={"CRAWLERA_FETCH_URLS": URLS, "CRAWLERA_FETCH_RAISE_ON_ERROR": False}
+    )
+    original = Request("https://example.org", meta={"crawlera_fetch": {"args": {"foo": "bar"}}})
+
+    first = middleware.process_request(original, foo_spider)
+    assert first.url == URLS[0]
+    payload = {"url": "https://example.org", "crawlera_error": "serverbusy", "body": "busy"}
+    response = TextResponse(url=first.url, request=first, body=json.dumps(payload).encode())
+    failover = middleware.process_response(first, response, foo_spider)
+    assert failover.url == "https://example.org"
+    assert failover.dont_filter
+    assert failover.meta["crawlera_fetch"] == {
+        "args": {"foo": "bar"},
+        "failed_endpoints": URLS[:1],
+    }
+
+    second = middleware.process_request(failover, foo_spider)
+    assert second.url == URLS[1]
+    # all the endpoints have been tried
+    exception = ConnectionRefusedError()
+    assert middleware.process_exception(second, exception, foo_spider) is None
+
+    assert middleware.stats.get_value("crawlera_fetch/endpoint/failover") == 1
+    middleware.spider_closed(foo_spider, "finished")
+    for url in URLS:
+        name = url.split("/")[2]
+        assert middleware.stats.get_value("crawlera_fetch/endpoint/%s/error_count" % name) == 1
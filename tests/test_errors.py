@@ -0,0 +1,76 @@
+import json
+
+from scrapy import Request
+from scrapy.http.response.text import TextResponse
+from scrapy.statscollectors import MemoryStatsCollector
+from scrapy.utils.test import get_crawler
+
+from crawlera_fetch.errors import ErrorStats, normalize_error
+
+from tests.utils import foo_spider, get_test_middleware
+
+
+def test_normalize_error():
+    assert normalize_error("Timeout after 30.5s (https://example.org/foo?bar=1)") == (
+        "timeout_after_ns_url"
+    )
+    assert normalize_error("Request 3f2a9c1e-77b0 failed: upstream_503") == (
+        "request_id_failed_upstream_n"
+    )
+    assert normalize_error("x" * 100) == "x" * 40
+    assert normalize_error(" !? ") == "unknown"
+
+
+def test_error_stats():
+    stats = MemoryStatsCollector(get_crawler())
+    error_stats = ErrorStats(stats, known_codes=["banned", "timeout"], max_codes=2)
+    assert error_stats.record("banned") == "banned"
+    assert error_stats.record("Timeout") == "timeout"
+    assert stats.get_value("crawlera_fetch/response_error/banned") == 1
+    assert stats.get_value("crawlera_fetch/response_error/timeout") == 1
+
+    for _ in range(5):
+        error_stats.record("Upstream error 500")
+    for _ in range(3):
+        error_stats.record("Upstream error 404 for https://example.org")
+    for letter in "abcdef":
+        error_stats.record("Unique message " + letter)
+    error_stats.set_stats()
+    assert stats.get_value("crawlera_fetch/response_error/upstream_error_n") == 5
+    assert stats.get_value("crawlera_fetch/response_error/upstream_error_n_for_url") == 3
+    assert stats.get_value("crawlera_fetch/response_error/other") == 6
+    assert stats.get_value("crawlera_fetch/response_error_evicted") > 0
+    assert len([key for key in stats.get_stats() if "unique" in key]) == 0
+
+    # codes which are no longer among the top ones are removed from the stats
+    for _ in range(10):
+        error_stats.record("Something else")
+    error_stats.set_stats()
+    assert stats.get_value("crawlera_fetch/response_error/something_else") == 10
+    assert stats.get_value("crawlera_fetch/response_error/upstream_error_n") == 5
+    assert "crawlera_fetch/response_error/upstream_error_n_for_url" not in stats.get_stats()
+    assert stats.get_value("crawlera_fetch/response_error/other") == 9
+
+
+def test_error_stats_middleware():
+    middleware = get_test_middleware(
+        settings={
+            "CRAWLERA_FETCH_RAISE_ON_ERROR": False,
+            "CRAWLERA_FETCH_ERROR_STATS_MAX_CODES": 1,
+            "CRAWLERA_FETCH_ERROR_STATS_CODES": ["custom_error"],
+        }
+    )
+    messages = ["custom_error", "banned", "Error 1", "Error 2", "Other error"]
+    for message in messages:
+        request = middleware.process_request(Request("https://example.org"), foo_spider)
+        payload = {"url": "https://example.org", "crawlera_error": message, "body": message}
+        body = json.dumps(payload).encode()
+        response = TextResponse(url=request.url, request=request, body=body)
+        assert middleware.process_response(request, response, foo_spider) is response
+    middleware.spider_closed(foo_spider, "finished")
+
+    assert middleware.stats.get_value("crawlera_fetch/response_error") == 5
+    assert middleware.stats.get_value("crawlera_fetch/response_error/custom_error") == 1
+    assert middleware.stats.get_value("crawlera_fetch/response_error/banned") == 1
+    assert middleware.stats.get_value("crawlera_fetch/response_error/error_n") == 2
+    assert middleware.stats.get_value("crawlera_fetch/response_error/other") == 1
@@ -0,0 +1,46 @@
+import random
+
+from crawlera_fetch.histogram import LatencyHistogram
+
+
+def test_histogram_empty():
+    histogram = LatencyHistogram()
+    assert histogram.count == 0
+    assert histogram.percentiles() == {}
+
+
+def test_histogram_percentiles():
+    histogram = LatencyHistogram()
+    latencies = [random.expovariate(1.0) for _ in range(10000)]
+    for latency in latencies:
+        histogram.add(latency)
+
+    assert histogram.count == len(latencies)
+    assert histogram.min == min(latencies)
+    assert histogram.max == max(latencies)
+    assert abs(histogram.total - sum(latencies)) < 1e-6
+
+    latencies.sort()
+    for percentile, value in histogram.percentiles((50, 90, 99)).items():
+        expected = latencies[int(len(latencies) * percentile / 100) - 1]
+        assert abs(value - expected) / expected < 0.1
+
+
+def test_histogram_bounds():
+    histogram = LatencyHistogram()
+    histogram.add(-1)
+    histogram.add(2 ** 60)
+    assert histogram.min == 0
+    assert histogram.max == 2 ** 60
+    percentiles = histogram.percentiles((0.1, 100))
+    assert percentiles[0.1] < 0.001
+    assert 0 < percentiles[100] <= 2 ** 60
+    assert len(histogram.counts) == len(LatencyHistogram().counts)
+
+
+def test_histogram_cumulative_counts():
+    histogram = LatencyHistogram()
+    for latency in (0.2, 0.7, 0.8, 3, 200):
+        histogram.add(latency)
+    assert histogram.cumulative_counts([0.5, 1, 10]) == [1, 3, 4]
+    assert LatencyHistogram().cumulative_counts([0.5, 1]) == [0, 0]
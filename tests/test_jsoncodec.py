@@ -0,0 +1,96 @@
+import json
+
+import pytest
+from scrapy import Request
+from scrapy.http.response.text import TextResponse
+from scrapy.utils.reqser import request_to_dict
+
+from crawlera_fetch.jsoncodec import CODECS, JsonCodec, get_codec
+from crawlera_fetch.middleware import CrawleraFetchException
+
+from tests.utils import foo_spider, get_test_middleware, mocked_time
+
+
+def available_codecs():
+    names = []
+    for name, codec_cls in CODECS.items():
+        try:
+            codec_cls()
+        except ImportError:
+            continue
+        names.append(name)
+    return names
+
+
+@pytest.mark.parametrize("name", available_codecs())
+def test_codec_roundtrip(name):
+    codec = get_codec(name)
+    assert codec.name == name
+    obj = {"url": "https://example.org", "body": "café", "args": {"render": "no"}}
+    encoded = codec.dumps(obj)
+    assert isinstance(encoded, bytes)
+    assert codec.loads(encoded) == obj
+    assert json.loads(encoded.decode("utf8")) == obj
+
+
+@pytest.mark.parametrize("name", available_codecs())
+def test_codec_decode_error(name):
+    codec = get_codec(name)
+    with pytest.raises(json.JSONDecodeError) as exc_info:
+        codec.loads(b'{"Bad": "JSON')
+    assert exc_info.value.msg == "Unterminated string starting at"
+    assert exc_info.value.lineno == 1
+    assert exc_info.value.colno == 9
+
+
+def test_codec_fallback():
+    assert type(get_codec("unknown")) is JsonCodec
+    assert get_codec("auto").name in available_codecs()
+
+
+@pytest.mark.parametrize("name", available_codecs())
+def test_codec_middleware_decode_error(name):
+    middleware = get_test_middleware(settings={"CRAWLERA_FETCH_JSON_CODEC": name})
+    assert middleware.json_codec.name == name
+    response = TextResponse(
+        url="https://crawlera.com/fake/api/endpoint",
+        request=Request(
+            url="https://crawlera.com/fake/api/endpoint",
+            meta={
+                "crawlera_fetch": {
+                    "timing": {"start_ts": mocked_time()},
+                    "original_request": request_to_dict(
+                        Request("https://example.org"),
+                        spider=foo_spider,
+                    ),
+                }
+            },
+        ),
+        body=b'{"Bad": "JSON',
+    )
+    with pytest.raises(CrawleraFetchException):
+        middleware.process_response(response.request, response, foo_spider)
+    assert middleware.stats.get_value("crawlera_fetch/response_error") == 1
+    assert middleware.stats.get_value("crawlera_fetch/response_error/JSONDecodeError") == 1
+
+
+@pytest.mark.parametrize("name", available_codecs())
+def test_codec_middleware_not_utf8(name, caplog):
+    middleware = get_test_middleware(
+        settings={"CRAWLERA_FETCH_JSON_CODEC": name, "CRAWLERA_FETCH_RAISE_ON_ERROR": False}
+    )
+    request = middleware.process_request(Request("https://example.org"), foo_spider)
+    payload = (
+        b'{"url": "https://example.org", "original_status": 200, "headers": {}, '
+        b'"body": "caf\xe9", "body_encoding": "plain"}'
+    )
+    response = TextResponse(url=request.url, request=request, body=payload, encoding="latin-1")
+    processed = middleware.process_response(request, response, foo_spider)
+    assert processed.body == "café".encode("utf8")
+
+    request = middleware.process_request(Request("https://example.org"), foo_spider)
+    body = b'{"caf\xe9'
+    response = TextResponse(url=request.url, request=request, body=body, encoding="latin-1")
+    assert middleware.process_response(request, response, foo_spider) is response
+    assert "Error decoding <GET https://example.org>" in caplog.text
+    assert middleware.stats.get_value("crawlera_fetch/response_error/JSONDecodeError") == 1
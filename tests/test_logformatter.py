@@ -1,6 +1,8 @@
+import logging
 import unittest
 from logging import LogRecord, Formatter
 
+from scrapy import Request
 from scrapy import version_info as scrapy_version
 from scrapy.http.response import Response
 from twisted.python.failure import Failure
@@ -78,3 +80,33 @@ def test_log_formatter_scrapy_2():
         record = LogRecord(name="logger", pathname="n/a", lineno=2, exc_info=None, **result)
         logstr = formatter.format(record)
         assert logstr == "Error downloading %s: error" % str(original)
+
+
+def test_log_formatter_original_request_meta():
+    logformatter = CrawleraFetchLogFormatter()
+    for settings in ({}, {"CRAWLERA_FETCH_LAZY_ORIGINAL_REQUEST": True}):
+        middleware = get_test_middleware(settings=settings)
+        original = Request("https://example.org", method="POST", body=b"x" * 10000)
+        processed = middleware.process_request(original, foo_spider)
+        result = logformatter.crawled(processed, Response(original.url), foo_spider)
+        assert result["args"]["request"] == "<POST https://example.org>"
+
+    # requests not processed by the middleware are left untouched
+    request = Request("https://example.org/skipped")
+    result = logformatter.crawled(request, Response(request.url), foo_spider)
+    assert result["args"]["request"] == request
+
+
+def test_log_formatter_level():
+    # the request is rewritten regardless of the log level, Scrapy drops disabled records
+    middleware = get_test_middleware()
+    logformatter = CrawleraFetchLogFormatter()
+    processed = middleware.process_request(Request("https://example.org"), foo_spider)
+    logger = logging.getLogger("scrapy.core.engine")
+    level = logger.level
+    logger.setLevel(logging.INFO)
+    try:
+        result = logformatter.crawled(processed, Response(processed.url), foo_spider)
+    finally:
+        logger.setLevel(level)
+    assert result["args"]["request"] == "<GET https://example.org>"
@@ -0,0 +1,127 @@
+import json
+from unittest.mock import patch
+
+from scrapy import Request
+from scrapy.http.response.text import TextResponse
+from scrapy.statscollectors import MemoryStatsCollector
+from scrapy.utils.test import get_crawler
+from twisted.internet.defer import maybeDeferred
+from twisted.web.test.requesthelper import DummyRequest
+
+from crawlera_fetch.histogram import LatencyHistogram
+from crawlera_fetch.metrics import MetricsExporter, MetricsResource, parse_stat_key, render_metrics
+
+from tests.utils import foo_spider, get_test_middleware
+
+
+def test_parse_stat_key():
+    assert parse_stat_key("crawlera_fetch/request_count") == ("crawlera_fetch_request_count", ())
+    assert parse_stat_key("crawlera_fetch/response_error/banned") == (
+        "crawlera_fetch_response_error_by_code",
+        (("code", "banned"),),
+    )
+    assert parse_stat_key("crawlera_fetch/endpoint/eu.fetch.example:8010/error_count") == (
+        "crawlera_fetch_endpoint_error_count",
+        (("endpoint", "eu.fetch.example:8010"),),
+    )
+    assert parse_stat_key("crawlera_fetch/domain/example.org/error/serverbusy") == (
+        "crawlera_fetch_domain_error_by_code",
+        (("domain", "example.org"), ("code", "serverbusy")),
+    )
+    assert parse_stat_key("crawlera_fetch/apikey/waiting") == ("crawlera_fetch_apikey_waiting", ())
+
+
+def test_render_metrics():
+    histogram = LatencyHistogram()
+    for latency in (0.2, 0.7, 3, 200):
+        histogram.add(latency)
+    stats = {
+        "crawlera_fetch/request_count": 4,
+        "crawlera_fetch/response_error": 2,
+        "crawlera_fetch/response_error/banned": 1,
+        'crawlera_fetch/response_error/bad "quote"': 1,
+        "crawlera_fetch/max_latency": 200.0,
+        "crawlera_fetch/latency_p50": 0.7,
+        "downloader/request_count": 4,
+    }
+    text = render_metrics(stats, histogram, latency_buckets=(0.5, 1, 10), gauges={"foo": 1})
+    assert text.splitlines() == [
+        "# TYPE crawlera_fetch_latency_p50 gauge",
+        "crawlera_fetch_latency_p50 0.7",
+        "# TYPE crawlera_fetch_latency_seconds histogram",
+        'crawlera_fetch_latency_seconds_bucket{le="0.5"} 1',
+        'crawlera_fetch_latency_seconds_bucket{le="1"} 2',
+        'crawlera_fetch_latency_seconds_bucket{le="10"} 3',
+        'crawlera_fetch_latency_seconds_bucket{le="+Inf"} 4',
+        "crawlera_fetch_latency_seconds_count 4",
+        "crawlera_fetch_latency_seconds_sum " + repr(histogram.total),
+        "# TYPE crawlera_fetch_max_latency gauge",
+        "crawlera_fetch_max_latency 200.0",
+        "# TYPE crawlera_fetch_request_count counter",
+        "crawlera_fetch_request_count_total 4",
+        "# TYPE crawlera_fetch_response_error counter",
+        "crawlera_fetch_response_error_total 2",
+        "# TYPE crawlera_fetch_response_error_by_code counter",
+        'crawlera_fetch_response_error_by_code_total{code="bad \\"quote\\""} 1',
+        'crawlera_fetch_response_error_by_code_total{code="banned"} 1',
+        "# TYPE foo gauge",
+        "foo 1",
+        "# EOF",
+    ]
+
+
+def test_exporter_snapshot(tmpdir):
+    stats = MemoryStatsCollector(get_crawler())
+    path = str(tmpdir.join("metrics.txt"))
+    exporter = MetricsExporter(stats, LatencyHistogram(), update=lambda: None, path=path)
+    stats.set_value("crawlera_fetch/response_count", 10)
+    stats.set_value("crawlera_fetch/response_error", 5)
+    exporter.snapshot(write=False)
+    stats.set_value("crawlera_fetch/response_count", 20)
+    stats.set_value("crawlera_fetch/response_error", 6)
+    exporter.stop()
+    with open(path, "rb") as f:
+        body = f.read()
+    assert body == exporter.body
+    assert b"\ncrawlera_fetch_interval_error_ratio 0.1\n" in body
+
+    request = DummyRequest([b""])
+    assert MetricsResource(exporter).render_GET(request) == body
+    assert request.responseHeaders.getRawHeaders(b"Content-Type") == [
+        b"application/openmetrics-text; version=1.0.0; charset=utf-8"
+    ]
+
+
+@patch("crawlera_fetch.metrics.deferToThread", maybeDeferred)
+def test_metrics_middleware(tmpdir):
+    path = str(tmpdir.join("metrics.txt"))
+    middleware = get_test_middleware(
+        settings={"CRAWLERA_FETCH_METRICS_ENABLED": True, "CRAWLERA_FETCH_METRICS_FILE": path}
+    )
+    assert middleware.metrics.loop.running
+    with open(path) as f:
+        assert "crawlera_fetch_request_count" not in f.read()
+
+    request = middleware.process_request(Request("https://example.org"), foo_spider)
+    payload = {"url": "https://example.org", "original_status": 200, "headers": {}, "body": ""}
+    response = TextResponse(url=request.url, request=request, body=json.dumps(payload).encode())
+    middleware.process_response(request, response, foo_spider)
+    middleware.metrics.snapshot()
+    with open(path) as f:
+        text = f.read()
+    assert "crawlera_fetch_request_count_total 1\n" in text
+    assert "crawlera_fetch_latency_seconds_count 1\n" in text
+    # computed stats are updated during the crawl
+    assert middleware.stats.get_value("crawlera_fetch/latency_p50") is not None
+
+    middleware.spider_closed(foo_spider, "finished")
+    assert not middleware.metrics.loop.running
+
+
+def test_parse_stat_key_timing():
+    assert parse_stat_key("crawlera_fetch/timing/queue/avg_latency") == (
+        "crawlera_fetch_timing_avg_latency",
+        (("phase", "queue"),),
+    )
+    text = render_metrics({"crawlera_fetch/timing/queue/avg_latency": 1.5})
+    assert "# TYPE crawlera_fetch_timing_avg_latency gauge\n" in text
@@ -0,0 +1,81 @@
+import json
+import pstats
+import threading
+
+from scrapy import Request
+from scrapy.http.response.text import TextResponse
+from scrapy.statscollectors import MemoryStatsCollector
+from scrapy.utils.test import get_crawler
+
+from crawlera_fetch.profiler import Profiler
+
+from tests.utils import foo_spider, get_test_middleware
+
+
+def get_profiler(**kwargs):
+    stats = MemoryStatsCollector(get_crawler())
+    return Profiler(stats, **kwargs)
+
+
+def test_profiler_sections():
+    profiler = get_profiler()
+    wrapped = profiler.wrap("section", lambda n: sum(range(n)))
+    assert wrapped(1000) == sum(range(1000))
+    wrapped(1000)
+    profiler.set_stats()
+    assert profiler.stats.get_value("crawlera_fetch/profile/section/calls") == 2
+    cpu_time = profiler.stats.get_value("crawlera_fetch/profile/section/cpu_time")
+    assert cpu_time >= 0
+    assert profiler.stats.get_value("crawlera_fetch/profile/section/avg_cpu_time") == cpu_time / 2
+
+
+def test_profiler_sections_threads():
+    profiler = get_profiler()
+    wrapped = profiler.wrap("section", lambda n: sum(range(n)))
+    results = []
+    thread = threading.Thread(target=lambda: results.append(wrapped(1000)))
+    thread.start()
+    thread.join()
+    # only the calls from the reactor thread are timed
+    assert results == [sum(range(1000))]
+    assert profiler.calls["section"] == 0
+    wrapped(1000)
+    assert profiler.calls["section"] == 1
+
+
+def test_profiler_window(tmpdir):
+    path = str(tmpdir.join("profile.prof"))
+    profiler = get_profiler(path=path, trigger_stat="crawlera_fetch/response_count")
+    profiler._check_trigger()
+    assert profiler.profile is None
+
+    profiler.stats.set_value("crawlera_fetch/response_count", 1)
+    profiler._check_trigger()
+    assert profiler.profile is not None
+    profiler.stop()
+    assert profiler.profile is None
+    assert not profiler.window_timer.active()
+    assert profiler.stats.get_value("crawlera_fetch/profile/windows") == 1
+    assert pstats.Stats(path).total_calls > 0
+
+
+def test_profiler_middleware():
+    middleware = get_test_middleware(
+        settings={"CRAWLERA_FETCH_PROFILE": True, "CRAWLERA_FETCH_PROFILE_SIGNAL": None}
+    )
+    request = middleware.process_request(Request("https://example.org"), foo_spider)
+    payload = {"url": "https://example.org", "original_status": 200, "headers": {}, "body": ""}
+    response = TextResponse(url=request.url, request=request, body=json.dumps(payload).encode())
+    middleware.process_response(request, response, foo_spider)
+    middleware.spider_closed(foo_spider, "finished")
+
+    for section in (
+        "process_request",
+        "build_request",
+        "json_encode",
+        "process_response",
+        "decompress",
+        "json_decode",
+        "body_decode",
+    ):
+        assert middleware.stats.get_value("crawlera_fetch/profile/%s/calls" % section) == 1
@@ -0,0 +1,68 @@
+import pytest
+from scrapy import Request
+from scrapy.statscollectors import MemoryStatsCollector
+from scrapy.utils.test import get_crawler
+from twisted.internet.defer import Deferred
+
+from crawlera_fetch.ratelimit import RateLimiter, TokenBucket
+
+from tests.utils import foo_spider, get_test_middleware
+
+
+def get_limiter(**kwargs):
+    stats = MemoryStatsCollector(get_crawler())
+    return RateLimiter(stats=stats, **kwargs)
+
+
+def test_token_bucket():
+    bucket = TokenBucket(rate=2, capacity=2, now=0)
+    assert [bucket.reserve(now=0) for _ in range(5)] == [0, 0, 0.5, 1, 1.5]
+    # tokens are refilled, up to the capacity
+    assert bucket.reserve(now=2) == 0
+    assert bucket.reserve(now=2) == 0.5
+    assert bucket.reserve(now=100) == 0
+    assert bucket.reserve(now=100) == 0
+    assert bucket.reserve(now=100) == 0.5
+
+
+def test_rate_limiter_domains():
+    limiter = get_limiter(rate=10, burst=10, domain_rate=1)
+    assert limiter.reserve("example.org", now=0) == 0
+    assert limiter.reserve("example.org", now=0) == 1
+    assert limiter.reserve("example.com", now=0) == 0
+    assert limiter.stats.get_value("crawlera_fetch/rate_limit/delayed") == 1
+    assert limiter.stats.get_value("crawlera_fetch/rate_limit/wait_time") == 1
+
+
+def test_rate_limiter_tuning():
+    limiter = get_limiter(rate=10)
+    limiter.record("too_many_conns", now=10)
+    limiter.record("user_session_limit", now=10.5)  # at most once per second
+    assert limiter.rate == 5
+    limiter.record("too_many_conns", now=11)
+    assert limiter.rate == 2.5
+    limiter.record("banned", now=12)
+    assert limiter.rate == 2.5
+    for _ in range(10):
+        limiter.record(None, now=12)
+    assert limiter.rate == pytest.approx(3.5)
+    for _ in range(100):
+        limiter.record(None, now=12)
+    assert limiter.rate == 10
+    assert limiter.stats.get_value("crawlera_fetch/rate_limit/decrease") == 2
+
+
+def test_rate_limiter_middleware():
+    middleware = get_test_middleware(
+        settings={"CRAWLERA_FETCH_RATE_LIMIT": 1, "CRAWLERA_FETCH_RATE_LIMIT_BURST": 1}
+    )
+    processed = middleware.process_request(Request("https://example.org"), foo_spider)
+    assert isinstance(processed, Request)
+    assert processed.url == middleware.url
+
+    delayed = middleware.process_request(Request("https://example.org"), foo_spider)
+    assert isinstance(delayed, Deferred)
+    delayed.addErrback(lambda failure: None)
+    delayed.cancel()
+    assert middleware.stats.get_value("crawlera_fetch/rate_limit/delayed") == 1
+    assert middleware.stats.get_value("crawlera_fetch/request_count") == 1
@@ -33,14 +33,14 @@ def test_process_request_disabled():
 
 @patch("time.time", mocked_time)
 def test_process_request():
-    middleware = get_test_middleware()
+    with shub_jobkey_env_variable():
+        middleware = get_test_middleware()
 
     for case in get_test_requests():
         original = case["original"]
         expected = case["expected"]
 
-        with shub_jobkey_env_variable():
-            processed = middleware.process_request(original, foo_spider)
+        processed = middleware.process_request(original, foo_spider)
 
         crawlera_meta = original.meta.get("crawlera_fetch")
         if crawlera_meta.get("skip"):
@@ -58,9 +58,10 @@ def test_process_request():
 
 @patch("time.time", mocked_time)
 def test_process_request_single_download_slot():
-    middleware = get_test_middleware(
-        settings={"CRAWLERA_FETCH_DOWNLOAD_SLOT_POLICY": DownloadSlotPolicy.Single}
-    )
+    with shub_jobkey_env_variable():
+        middleware = get_test_middleware(
+            settings={"CRAWLERA_FETCH_DOWNLOAD_SLOT_POLICY": DownloadSlotPolicy.Single}
+        )
 
     for case in get_test_requests():
         original = case["original"]
@@ -68,8 +69,7 @@ def test_process_request_single_download_slot():
         if expected:
             expected.meta["download_slot"] = "__crawlera_fetch__"
 
-        with shub_jobkey_env_variable():
-            processed = middleware.process_request(original, foo_spider)
+        processed = middleware.process_request(original, foo_spider)
 
         crawlera_meta = original.meta.get("crawlera_fetch")
         if crawlera_meta.get("skip"):
@@ -105,6 +105,28 @@ def test_process_request_default_args():
             assert processed_json["answer"] == "42"
 
 
+def test_process_request_default_args_override():
+    with shub_jobkey_env_variable():
+        middleware = get_test_middleware(
+            settings={"CRAWLERA_FETCH_DEFAULT_ARGS": {"device": "desktop", "region": "us"}}
+        )
+
+    args_list = [
+        {},
+        {"render": "no"},
+        {"device": "mobile"},
+        {"job_id": "4/5/6", "url": "https://example.com"},
+    ]
+    for args in args_list:
+        request = Request("https://example.org", meta={"crawlera_fetch": {"args": args}})
+        processed = middleware.process_request(request, foo_spider)
+        expected = {"url": "https://example.org", "body": ""}
+        expected.update({"device": "desktop", "region": "us", "job_id": "1/2/3"})
+        expected.update(args)
+        assert json.loads(processed.body.decode(processed.encoding)) == expected
+        assert processed.headers["X-Crawlera-JobId"] == b"1/2/3"
+
+
 @patch("scrapy.version_info", (1, 8, 0))
 def test_process_request_scrapy_1():
     from tests.utils import get_test_middleware
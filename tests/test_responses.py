@@ -6,7 +6,12 @@ from scrapy.http.response.text import TextResponse
 from scrapy.utils.reqser import request_to_dict
 from testfixtures import LogCapture
 
-from crawlera_fetch.middleware import CrawleraFetchException
+from crawlera_fetch.middleware import (
+    CrawleraFetchException,
+    OriginalRequest,
+    UpstreamBodyPolicy,
+    UpstreamResponseBody,
+)
 
 from tests.data.responses import test_responses
 from tests.utils import foo_spider, get_test_middleware, mocked_time
@@ -171,3 +176,60 @@ def test_process_response_error():
     assert middleware_log.stats.get_value("crawlera_fetch/response_error/bad_proxy_auth") == 1
     assert middleware_log.stats.get_value("crawlera_fetch/response_error/JSONDecodeError") == 1
     assert middleware_log.stats.get_value("crawlera_fetch/response_error/serverbusy") == 1
+
+
+def test_process_response_lazy_original_request():
+    middleware = get_test_middleware(settings={"CRAWLERA_FETCH_LAZY_ORIGINAL_REQUEST": True})
+    original = Request("https://example.org", callback=foo_spider.foo_callback)
+    processed_request = middleware.process_request(original, foo_spider)
+    assert "Authorization" not in original.headers
+
+    original_request = processed_request.meta["crawlera_fetch"]["original_request"]
+    assert isinstance(original_request, OriginalRequest)
+    assert original_request["url"] == "https://example.org"
+    assert original_request["method"] == "GET"
+    assert dict(original_request) == request_to_dict(original, spider=foo_spider)
+
+    response = TextResponse(
+        url="https://example.org",
+        request=processed_request,
+        body=json.dumps(
+            {"headers": {}, "original_status": 200, "body": "foobar", "url": "https://example.org"}
+        ).encode("utf-8"),
+    )
+    processed = middleware.process_response(processed_request, response, foo_spider)
+    assert processed.request is original
+    assert processed.body == b"foobar"
+
+
+def test_process_response_upstream_body_policy():
+    for policy in UpstreamBodyPolicy:
+        middleware = get_test_middleware(settings={"CRAWLERA_FETCH_UPSTREAM_BODY_POLICY": policy})
+        for case in test_responses:
+            original = case["original"]
+            processed = middleware.process_response(original.request, original, foo_spider)
+            crawlera_meta = processed.meta.get("crawlera_fetch") or {}
+            if not crawlera_meta.get("upstream_response"):
+                continue
+
+            upstream_body = crawlera_meta["upstream_response"]["body"]
+            expected_body = json.loads(original.text)
+            if policy == UpstreamBodyPolicy.Metadata:
+                assert "body" not in upstream_body
+                expected_body.pop("body")
+            elif policy == UpstreamBodyPolicy.Lazy:
+                assert isinstance(upstream_body, UpstreamResponseBody)
+                assert "body" not in upstream_body.envelope
+            assert upstream_body == expected_body
+
+
+def test_process_response_upstream_body_default_policy():
+    middleware = get_test_middleware()
+    for case in test_responses:
+        original = case["original"]
+        processed = middleware.process_response(original.request, original, foo_spider)
+        crawlera_meta = processed.meta.get("crawlera_fetch") or {}
+        if crawlera_meta.get("upstream_response"):
+            upstream_body = crawlera_meta["upstream_response"]["body"]
+            assert type(upstream_body) is dict
+            assert upstream_body == json.loads(original.text)
@@ -0,0 +1,112 @@
+import json
+
+import pytest
+from scrapy import Request
+from scrapy.http.response.text import TextResponse
+from scrapy.statscollectors import MemoryStatsCollector
+from scrapy.utils.test import get_crawler
+from twisted.internet.defer import Deferred
+
+from crawlera_fetch.middleware import CrawleraFetchException
+from crawlera_fetch.retry import RetryAction, RetryPolicy
+
+from tests.utils import foo_spider, get_test_middleware
+
+
+def test_retry_policy_classify():
+    policy = RetryPolicy(MemoryStatsCollector(get_crawler()))
+    assert policy.classify("timeout") == RetryAction.Now
+    assert policy.classify("serverbusy") == RetryAction.Backoff
+    assert policy.classify("bad_proxy_auth") == RetryAction.GiveUp
+
+
+def test_retry_policy_delay():
+    policy = RetryPolicy(MemoryStatsCollector(get_crawler()), backoff_base=2, backoff_max=10)
+    for retry_times, maximum in [(0, 2), (1, 4), (2, 8), (3, 10), (10, 10)]:
+        for _ in range(100):
+            assert 0 <= policy.get_delay(retry_times) <= maximum
+
+
+def test_retry_policy_limits():
+    stats = MemoryStatsCollector(get_crawler())
+    policy = RetryPolicy(stats, max_retry_times=2, budget_ratio=0.5, budget_min=1)
+
+    assert policy.get_retry_delay("bad_proxy_auth", 0, latency=1) is None
+    assert policy.get_retry_delay("timeout", 2, latency=1) is None
+    assert stats.get_value("crawlera_fetch/retry/max_reached") == 1
+    assert policy.get_retry_delay("timeout", 2, latency=1, max_retry_times=5) == 0
+    # budget: 0.5 * 0 requests + 1
+    assert policy.get_retry_delay("timeout", 0, latency=1) is None
+    assert stats.get_value("crawlera_fetch/retry/budget_exhausted") == 1
+    stats.set_value("crawlera_fetch/request_count", 10)
+    assert 0 <= policy.get_retry_delay("serverbusy", 0, latency=3) <= 1
+
+    assert stats.get_value("crawlera_fetch/retry/count") == 2
+    assert stats.get_value("crawlera_fetch/retry/reason/timeout") == 1
+    assert stats.get_value("crawlera_fetch/retry/reason/serverbusy") == 1
+    assert stats.get_value("crawlera_fetch/retry/wasted_latency") == 4
+
+
+def get_error_response(middleware, request, error):
+    processed = middleware.process_request(request, foo_spider)
+    return processed, TextResponse(
+        url=processed.url,
+        request=processed,
+        body=json.dumps(
+            {
+                "url": request.url,
+                "original_status": 503,
+                "headers": {},
+                "crawlera_error": error,
+                "body": "error message",
+            }
+        ).encode(),
+    )
+
+
+def test_retry_middleware():
+    middleware = get_test_middleware(
+        settings={"CRAWLERA_FETCH_RETRY_ENABLED": True, "CRAWLERA_FETCH_RETRY_TIMES": 1}
+    )
+    original = Request(
+        "https://example.org",
+        callback=foo_spider.foo_callback,
+        meta={"foo": "bar", "crawlera_fetch": {"args": {"render": "no"}}},
+    )
+
+    processed, response = get_error_response(middleware, original, "timeout")
+    retry_request = middleware.process_response(processed, response, foo_spider)
+    assert isinstance(retry_request, Request)
+    assert retry_request.url == "https://example.org"
+    assert retry_request.callback == foo_spider.foo_callback
+    assert retry_request.dont_filter
+    assert retry_request.meta["foo"] == "bar"
+    assert retry_request.meta["crawlera_fetch"] == {"args": {"render": "no"}, "retry_times": 1}
+
+    # the retried request goes through the middleware again, retries are exhausted
+    processed, response = get_error_response(middleware, retry_request, "timeout")
+    with pytest.raises(CrawleraFetchException):
+        middleware.process_response(processed, response, foo_spider)
+
+    processed, response = get_error_response(
+        middleware, Request("https://example.org"), "bad_proxy_auth"
+    )
+    with pytest.raises(CrawleraFetchException):
+        middleware.process_response(processed, response, foo_spider)
+
+    assert middleware.stats.get_value("crawlera_fetch/retry/count") == 1
+    assert middleware.stats.get_value("crawlera_fetch/retry/max_reached") == 1
+
+
+def test_retry_middleware_backoff():
+    middleware = get_test_middleware(
+        settings={"CRAWLERA_FETCH_RETRY_ENABLED": True, "CRAWLERA_FETCH_RETRY_BACKOFF_BASE": 10}
+    )
+    processed, response = get_error_response(
+        middleware, Request("https://example.org"), "serverbusy"
+    )
+    result = middleware.process_response(processed, response, foo_spider)
+    assert isinstance(result, Deferred)
+    result.addErrback(lambda failure: None)
+    result.cancel()
+    assert middleware.stats.get_value("crawlera_fetch/retry/reason/serverbusy") == 1
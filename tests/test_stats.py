@@ -2,8 +2,14 @@ import json
 import random
 from unittest.mock import patch
 
+import pytest
 from scrapy import Spider, Request
 from scrapy.http.response.text import TextResponse
+from scrapy.statscollectors import MemoryStatsCollector
+from scrapy.utils.test import get_crawler
+
+from crawlera_fetch.domains import DomainStatsCollector
+from crawlera_fetch.middleware import CrawleraFetchException
 
 from tests.utils import get_test_middleware
 
@@ -54,3 +60,130 @@ def test_stats(mocked_time):
     for method in set(method_list):
         mc = middleware.stats.get_value("crawlera_fetch/request_method_count/{}".format(method))
         assert mc == method_list.count(method)
+
+
+@patch("time.time")
+def test_stats_latency_percentiles(mocked_time):
+    middleware = get_test_middleware()
+    spider = Spider("foo")
+
+    rng = random.Random(1234)
+    latencies = [rng.uniform(0.5, 30) for _ in range(1000)]
+    for latency in latencies:
+        mocked_time.return_value = 0  # start_ts
+        processed_request = middleware.process_request(Request("https://example.org"), spider)
+        response = TextResponse(
+            url="https://example.org",
+            request=processed_request,
+            body=json.dumps(
+                {"headers": {}, "original_status": 200, "body": "", "url": "http://"}
+            ).encode("utf-8"),
+        )
+        mocked_time.return_value = latency  # end_ts
+        middleware.process_response(processed_request, response, spider)
+
+    assert middleware.stats.get_value("crawlera_fetch/latency_p50") is None
+    middleware.update_latency_stats()
+    p50 = middleware.stats.get_value("crawlera_fetch/latency_p50")
+    assert p50 is not None
+
+    middleware.spider_closed(spider, "finished")
+
+    latencies.sort()
+    previous = 0
+    for name, percentile in [("50", 50), ("90", 90), ("95", 95), ("99", 99), ("999", 99.9)]:
+        value = middleware.stats.get_value("crawlera_fetch/latency_p{}".format(name))
+        expected = latencies[int(len(latencies) * percentile / 100) - 1]
+        assert abs(value - expected) / expected < 0.1
+        assert previous <= value <= max(latencies)
+        previous = value
+
+
+@patch("time.time")
+def test_stats_domains(mocked_time):
+    middleware = get_test_middleware(settings={"CRAWLERA_FETCH_DOMAIN_STATS_MAX_DOMAINS": 2})
+    spider = Spider("foo")
+
+    urls = ["https://a.example"] * 10 + ["https://c.example"] * 2 + ["https://b.example"] * 5
+    for i, url in enumerate(urls):
+        mocked_time.return_value = 0  # start_ts
+        processed_request = middleware.process_request(Request(url), spider)
+        payload = {"headers": {}, "original_status": 200, "body": "", "url": url}
+        if i % 5 == 0:
+            payload["crawlera_error"] = "timeout"
+        response = TextResponse(
+            url=url,
+            request=processed_request,
+            body=json.dumps(payload).encode("utf-8"),
+        )
+        mocked_time.return_value = 2  # end_ts
+        if "crawlera_error" in payload:
+            with pytest.raises(CrawleraFetchException):
+                middleware.process_response(processed_request, response, spider)
+        else:
+            middleware.process_response(processed_request, response, spider)
+
+    middleware.spider_closed(spider, "finished")
+
+    stats = middleware.stats.get_stats()
+    assert stats["crawlera_fetch/domain/a.example/request_count"] == 10
+    assert stats["crawlera_fetch/domain/a.example/response_count"] == 10
+    assert stats["crawlera_fetch/domain/a.example/error_count"] == 2
+    assert stats["crawlera_fetch/domain/a.example/error_rate"] == 0.2
+    assert stats["crawlera_fetch/domain/a.example/error/timeout"] == 2
+    assert stats["crawlera_fetch/domain/a.example/latency_p50"] == 2
+    # b.example takes the place of c.example, inheriting its count
+    assert stats["crawlera_fetch/domain/b.example/request_count"] == 7
+    assert stats["crawlera_fetch/domain/b.example/response_count"] == 5
+    assert stats["crawlera_fetch/domain/evicted"] == 1
+    assert not any(key.startswith("crawlera_fetch/domain/c.example/") for key in stats)
+
+
+def test_stats_domains_evicted():
+    collector = DomainStatsCollector(max_domains=2)
+    stats = MemoryStatsCollector(get_crawler())
+    for i in range(200):
+        domain = "{}.example".format(i)
+        for _ in range(2 if i % 2 else 1):
+            collector.record_request(domain)
+            collector.record_response(domain, latency=1, error="error{}".format(i))
+        collector.set_stats(stats)
+        domains = {key.split("/")[2] for key in stats.get_stats()} - {"evicted"}
+        assert len(domains) <= 2
+        assert domains == {domain for domain, _, _, _ in collector.domains.top()}
+    assert stats.get_value("crawlera_fetch/domain/evicted") > 0
+
+
+@patch("time.time")
+def test_stats_timing_breakdown(mocked_time):
+    middleware = get_test_middleware()
+    spider = Spider("foo")
+
+    mocked_time.return_value = 100  # start_ts
+    processed_request = middleware.process_request(Request("https://example.org"), spider)
+    processed_request.meta["download_latency"] = 5
+    mocked_time.return_value = 108
+    middleware.headers_received(processed_request)
+    mocked_time.return_value = 109
+    middleware.response_downloaded(processed_request)
+    response = TextResponse(
+        url="https://example.org",
+        request=processed_request,
+        headers={"Server-Timing": "render;dur=1500, total;dur=4000;desc=Total"},
+        body=json.dumps(
+            {"headers": {}, "original_status": 200, "body": "", "url": "http://"}
+        ).encode("utf-8"),
+    )
+    mocked_time.return_value = 110  # end_ts
+    middleware.process_response(processed_request, response, spider)
+
+    timing = processed_request.meta["crawlera_fetch"]["timing"]
+    assert (timing["queue"], timing["wire"], timing["transfer"], timing["api"]) == (3, 5, 1, 4)
+    assert timing["latency"] == 10
+    assert timing["decode"] >= 0
+
+    middleware.spider_closed(spider, "finished")
+    assert middleware.stats.get_value("crawlera_fetch/timing/queue/total_latency") == 3
+    assert middleware.stats.get_value("crawlera_fetch/timing/transfer/avg_latency") == 1
+    assert middleware.stats.get_value("crawlera_fetch/timing/api/latency_p50") == 4
+    assert middleware.stats.get_value("crawlera_fetch/timing/decode/total_latency") is not None
@@ -0,0 +1,102 @@
+import json
+from types import SimpleNamespace
+from unittest.mock import patch
+
+from scrapy import Request
+from scrapy.http.response.text import TextResponse
+from scrapy.statscollectors import MemoryStatsCollector
+from scrapy.utils.test import get_crawler
+
+from crawlera_fetch.throttle import AdaptiveConcurrency
+
+from tests.utils import foo_spider, get_test_middleware
+
+
+def get_throttle(**kwargs):
+    stats = MemoryStatsCollector(get_crawler())
+    return AdaptiveConcurrency(stats=stats, target_latency=10, **kwargs)
+
+
+def test_throttle_additive_increase():
+    throttle = get_throttle(max_concurrency=8)
+    slot = SimpleNamespace(concurrency=2, delay=0)
+    for i in range(100):
+        throttle.update("slot", slot, latency=1, error=None, now=i)
+    assert slot.concurrency == 8
+    assert slot.delay == 0
+    assert throttle.stats.get_value("crawlera_fetch/throttle/increase") == 6
+
+
+def test_throttle_multiplicative_decrease():
+    throttle = get_throttle(min_concurrency=2)
+    slot = SimpleNamespace(concurrency=16, delay=0)
+
+    throttle.update("slot", slot, latency=20, error=None, now=100)
+    assert slot.concurrency == 8
+    assert slot.delay == 0
+    # at most once per round trip
+    throttle.update("slot", slot, latency=20, error=None, now=110)
+    assert slot.concurrency == 8
+
+    throttle.update("slot", slot, latency=1, error="banned", now=130)
+    assert slot.concurrency == 4
+    assert slot.delay == 0.5
+    throttle.update("slot", slot, latency=1, error="timeout", now=140)
+    assert slot.concurrency == 2
+    assert slot.delay == 1
+    throttle.update("slot", slot, latency=1, error="timeout", now=150)
+    assert slot.concurrency == 2
+    assert slot.delay == 2
+
+    # errors other than the back-off ones are not considered
+    throttle.update("slot", slot, latency=1, error="bad_uncork_url", now=160)
+    assert slot.concurrency == 2
+    assert slot.delay == 1.8
+
+    stats = throttle.stats
+    assert stats.get_value("crawlera_fetch/throttle/decrease") == 4
+    assert stats.get_value("crawlera_fetch/throttle/decrease/latency") == 1
+    assert stats.get_value("crawlera_fetch/throttle/decrease/banned") == 1
+    assert stats.get_value("crawlera_fetch/throttle/decrease/timeout") == 2
+
+
+def test_throttle_prune():
+    throttle = get_throttle()
+    for key in ["a", "b", "c"]:
+        throttle.update(key, SimpleNamespace(concurrency=1, delay=0), 1, None, 0)
+    throttle.prune(["b"])
+    assert list(throttle.slots) == ["b"]
+
+
+@patch("time.time")
+def test_throttle_middleware(mocked_time):
+    middleware = get_test_middleware(
+        settings={
+            "CRAWLERA_FETCH_THROTTLE_ENABLED": True,
+            "CRAWLERA_FETCH_THROTTLE_TARGET_LATENCY": 5,
+        }
+    )
+    slot = SimpleNamespace(concurrency=4, delay=0)
+    middleware.crawler.engine.downloader.slots["example.org"] = slot
+
+    for start_ts, latency, error in [(0, 1, None), (100, 10, None), (200, 1, "serverbusy")]:
+        mocked_time.return_value = start_ts
+        request = middleware.process_request(Request("https://example.org"), foo_spider)
+        payload = {"headers": {}, "original_status": 200, "body": "", "url": "http://"}
+        if error:
+            payload["crawlera_error"] = error
+        response = TextResponse(
+            url="https://example.org", request=request, body=json.dumps(payload).encode()
+        )
+        mocked_time.return_value = start_ts + latency
+        try:
+            middleware.process_response(request, response, foo_spider)
+        except Exception:
+            pass
+
+    assert slot.concurrency == 1
+    assert slot.delay == 0.5
+    middleware.spider_closed(foo_spider, "finished")
+    assert middleware.stats.get_value("crawlera_fetch/throttle/decrease/latency") == 1
+    assert middleware.stats.get_value("crawlera_fetch/throttle/decrease/serverbusy") == 1
+    assert middleware.stats.get_value("crawlera_fetch/throttle/min_concurrency") == 1
@@ -0,0 +1,24 @@
+from scrapy.statscollectors import MemoryStatsCollector
+from scrapy.utils.test import get_crawler
+
+from crawlera_fetch.timing import TimingStats, parse_server_timing
+
+
+def test_parse_server_timing():
+    assert parse_server_timing('total;dur=123.5, render;desc="Render";dur=100') == {
+        "total": 0.1235,
+        "render": 0.1,
+    }
+    assert parse_server_timing("miss, db;dur=abc") == {}
+    assert parse_server_timing("") == {}
+
+
+def test_timing_stats():
+    stats = MemoryStatsCollector(get_crawler())
+    timing_stats = TimingStats()
+    timing_stats.add("queue", 1)
+    timing_stats.add("queue", 3)
+    timing_stats.set_stats(stats)
+    assert stats.get_value("crawlera_fetch/timing/queue/total_latency") == 4
+    assert stats.get_value("crawlera_fetch/timing/queue/avg_latency") == 2
+    assert stats.get_value("crawlera_fetch/timing/wire/total_latency") is None
@@ -0,0 +1,74 @@
+import random
+from collections import Counter
+
+from crawlera_fetch.topk import SpaceSaving
+
+
+def test_space_saving_exact():
+    counter = SpaceSaving(10)
+    for key in "abracadabra":
+        counter.add(key)
+    assert len(counter) == 5
+    assert counter.evicted == 0
+    assert counter.top(2) == [("a", 5, 0, None), ("b", 2, 0, None)]
+    assert counter.count("r") == 2
+    assert counter.count("z") == 0
+
+
+def test_space_saving_bounded():
+    counter = SpaceSaving(10, factory=list)
+    keys = ["heavy"] * 500 + ["medium"] * 200 + ["key{}".format(i) for i in range(1000)]
+    for key in keys:
+        counter.add(key)
+    assert len(counter) == 10
+    assert counter.evicted > 0
+
+    expected = Counter(keys)
+    top = counter.top()
+    # keys seen more than len(keys) / capacity times are always tracked
+    assert "heavy" in counter
+    assert "medium" in counter
+    for key, count, error, data in top:
+        assert count - error <= expected[key] <= count
+        assert data == []
+
+
+def test_space_saving_data():
+    counter = SpaceSaving(1, factory=dict)
+    counter.add("a")["foo"] = "bar"
+    assert counter.get("a") == {"foo": "bar"}
+    assert counter.add("b") == {}
+    assert counter.get("a") is None
+    assert "a" not in counter
+    assert "b" in counter
+
+    assert SpaceSaving(0, factory=dict).add("a") is None
+
+
+def test_space_saving_buckets():
+    rng = random.Random(42)
+    counter = SpaceSaving(20)
+    expected = Counter()
+    for _ in range(5000):
+        key = int(rng.paretovariate(1))
+        count = rng.choice([1, 1, 1, 3])
+        expected[key] += count
+        min_count = counter.head.count if counter.head is not None else 0
+        full = len(counter) == counter.capacity and key not in counter
+        counter.add(key, count)
+        if full:
+            # the new key inherits the lowest count
+            assert counter.count(key) == min_count + count
+
+        # buckets are sorted by count and hold all the tracked keys
+        counts, keys, bucket, prev = [], [], counter.head, None
+        while bucket is not None:
+            assert bucket.prev is prev and bucket.keys
+            counts.append(bucket.count)
+            keys.extend(bucket.keys)
+            bucket, prev = bucket.next, bucket
+        assert counts == sorted(set(counts))
+        assert sorted(keys) == sorted(counter.entries)
+
+    for key, count, error, _ in counter.top():
+        assert count - error <= expected[key] <= count
@@ -10,6 +10,9 @@ from tests.data import SETTINGS
 
 
 class MockDownloader:
+    def __init__(self):
+        self.slots = {}
+
     def _get_slot_key(self, request, spider):
         if "download_slot" in request.meta:
             return request.meta["download_slot"]